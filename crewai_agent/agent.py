@@ -1,5 +1,4 @@
-import os
-import builtins
+import asyncio
 import logging
 from dotenv import load_dotenv
 
@@ -9,121 +8,115 @@ load_dotenv()
 import openlit
 openlit.init()
 
-from crewai import Agent, Task, Crew, Process
-from crewai.mcp import MCPServerStdio
-
 # Import local modules
-from .config import agent_runs, _thread_local, kimi_llm, AgentStoppedException, LOG_TOOLS_SERVER_PATH
-from .utils.logging import setup_logging
-from .tools.human_tool import HumanInputManager, AskHumanTool
-from .tools.knowledge_tool import KnowledgeBaseTool
+from .config import AgentStoppedException
+from .run_store import run_store, ACTIVE_STATUSES, RUNNING, WAITING, COMPLETED, ERROR, STOPPED
+from .checkpoint import AgentSuspended, start_steps, pop_steps, make_checkpoint
+from .agent_factory import agent_factory
+from .utils.logging import setup_logging, bind_run, unbind_run
+from .utils.mcp_utils import get_rizhiyi_server_params
+from .utils.mcp_pool import mcp_session_pool
+from .tools.mcp_tool import build_mcp_tools
 
 logger = logging.getLogger('crewai_agent')
 
 # Initialize logging redirection
 setup_logging()
 
-def run_crew(query: str, history: list = None, allow_human_input: bool = True, run_id: str = None, base_url: str = None, api_key: str = None, username: str = None):
-    # Set run_id for log capturing
+def _finish_run(run_id, result):
     if run_id:
-        _thread_local.run_id = run_id
-        if "logs" not in agent_runs[run_id]:
-            agent_runs[run_id]["logs"] = []
-
-    # Prepare context from history
-    context_str = ""
-    if history:
-        context_str = "以下是之前的对话历史，请参考这些信息来回答用户的新问题：\n"
-        for msg in history:
-            role_name = "用户" if msg.get('role') == 'user' else "助手"
-            context_str += f"{role_name}: {msg.get('content')}\n"
-        context_str += "\n当前新问题："
-
-    # Set up tools for this run
-    knowledge_tool = KnowledgeBaseTool()
-    tools = [knowledge_tool]
-    
-    if allow_human_input:
-        ask_tool = AskHumanTool()
-        if run_id:
-            ask_tool.run_id = run_id
-        tools.append(ask_tool)
-        
-        # We also keep the monkeypatching as a fallback for internal CrewAI calls
-        if run_id:
-            original_input = builtins.input
-            def web_input(prompt=""):
-                return HumanInputManager.ask(run_id, prompt)
-            builtins.input = web_input
-
-    # 构造 username:api-key 格式
-    formatted_api_key = f"{username}:{api_key}" if username and api_key else (api_key or "")
-
-    # Create a local agent instance for this run to avoid global state conflicts
-    local_log_assistant = Agent(
-        role='Log Analysis Assistant',
-        goal='Help users search logs in Rizhiyi and troubleshoot issues using the knowledge base.',
-        backstory="""You are a helpful and cautious log analysis assistant. 
-        You have access to a knowledge base (error codes, assets, solutions) and Rizhiyi log search.
-        IMPORTANT: If a user's query is vague, or if you need more details to perform a log search, use the 'ask_human' tool to clarify.
-        When searching logs, provide clear and concise analysis of the results.""",
-        tools=tools,
-        mcps=[
-            MCPServerStdio(
-                command="node",
-                args=[LOG_TOOLS_SERVER_PATH] if LOG_TOOLS_SERVER_PATH else [],
-                env={
-                    "LOGEASE_BASE_URL": base_url or "",
-                    "LOGEASE_API_KEY": formatted_api_key,
-                    "LOGEASE_TLS_REJECT_UNAUTHORIZED": os.getenv("LOGEASE_TLS_REJECT_UNAUTHORIZED", "false"),
-                    **os.environ
-                },
-                cache_tools_list=True,
-            )
-        ],
-        verbose=True,
-        allow_delegation=False,
-        memory=True,
-        llm=kimi_llm
-    )
-        
-    try:
-        # Task 1: Information Gathering and Problem Solving
-        info_task = Task(
-            description=f'{context_str}Answer the user query: "{query}". \n'
-                        'Steps:\n'
-                        '1. Search and analyze logs in Rizhiyi.\n'
-                        '2. Search the knowledge base for error codes or assets if needed.\n'
-                        '3. CRITICAL: If you need any clarification, use the "ask_human" tool to ask for details.',
-            expected_output='A detailed response based on the log analysis and knowledge base information. If ask_human was used, incorporate the user\'s feedback.',
-            agent=local_log_assistant
-        )
-
-        crew = Crew(
-            agents=[local_log_assistant],
-            tasks=[info_task],
-            process=Process.sequential,
-            verbose=True
-        )
-        
-        result = crew.kickoff()
-        
-        if run_id:
-            agent_runs[run_id]["status"] = "completed"
-            agent_runs[run_id]["result"] = str(result)
-            
-        return str(result)
-    except AgentStoppedException:
+        # 已被停止的运行保持 stopped
+        run_store.transition(run_id, ACTIVE_STATUSES, status=COMPLETED, result=str(result))
+    return str(result)
+
+def _suspend_run(run_id, prompt, query, history):
+    """保存检查点并进入等待状态；本次执行随后结束，worker 和 MCP 会话被释放"""
+    checkpoint = make_checkpoint(run_id, prompt, query, history)
+    run_store.transition(run_id, (RUNNING,), status=WAITING, prompt=prompt, response=None, checkpoint=checkpoint)
+    logger.info(f"Agent run {run_id} suspended for human input ({len(checkpoint['steps'])} steps checkpointed).")
+
+def _fail_run(run_id, e):
+    if isinstance(e, AgentStoppedException):
         logger.info(f"Agent run {run_id} stopped by user.")
         if run_id:
-            agent_runs[run_id]["status"] = "stopped"
-            agent_runs[run_id]["result"] = "Task stopped by user."
+            run_store.update(run_id, status=STOPPED, result="Task stopped by user.")
+        return
+    if run_id:
+        run_store.transition(run_id, ACTIVE_STATUSES, status=ERROR, result=str(e))
+
+def run_crew(query: str, history: list = None, allow_human_input: bool = True, run_id: str = None, base_url: str = None, api_key: str = None, username: str = None, steps: list = None, suspendable: bool = False):
+    """
+    执行一次运行。steps 是从检查点恢复时已经完成的步骤；
+    suspendable=True 时 ask_human 会挂起运行（抛出 AgentSuspended），调用方负责在收到回答后恢复。
+    """
+    # Set run_id for log capturing
+    if run_id:
+        bind_run(run_id)
+        start_steps(run_id, steps)
+
+    # 人类输入只通过 ask_human 工具获取（Task 不开启 human_input，crewai 不会调用 input()）
+    tools = agent_factory.base_tools(allow_human_input, suspendable=suspendable)
+
+    # 从会话池借出常驻的日志易 MCP 会话，运行结束后归还
+    mcp_session = None
+    try:
+        mcp_session = mcp_session_pool.acquire(get_rizhiyi_server_params(base_url, api_key, username))
+        tools.extend(build_mcp_tools(mcp_session))
     except Exception as e:
+        logger.error(f"Failed to acquire MCP session, running without log search tools: {e}")
+
+    try:
+        result = agent_factory.build_crew(query, history, tools, steps).kickoff()
+        return _finish_run(run_id, result)
+    except AgentSuspended as e:
+        _suspend_run(run_id, e.prompt, query, history)
+        raise
+    except AgentStoppedException as e:
+        _fail_run(run_id, e)
+    except Exception as e:
+        _fail_run(run_id, e)
+        raise e
+    finally:
         if run_id:
-            agent_runs[run_id]["status"] = "error"
-            agent_runs[run_id]["result"] = str(e)
+            unbind_run(run_id)
+            pop_steps(run_id)
+        if mcp_session is not None:
+            mcp_session_pool.release(mcp_session)
+
+async def arun_crew(query: str, history: list = None, allow_human_input: bool = True, run_id: str = None, base_url: str = None, api_key: str = None, username: str = None, steps: list = None, suspendable: bool = False):
+    """
+    run_crew 的异步版本，在异步运行时的事件循环上执行。
+    使用 crewai 的原生异步 akickoff，工具直接 await（人类输入、MCP 调用不占用线程）。
+    """
+    if run_id:
+        bind_run(run_id)
+        start_steps(run_id, steps)
+
+    tools = agent_factory.base_tools(allow_human_input, async_native=True, suspendable=suspendable)
+
+    mcp_session = None
+    try:
+        # 启动新会话需要等待子进程，放到线程中执行，不阻塞事件循环
+        params = get_rizhiyi_server_params(base_url, api_key, username)
+        mcp_session = await asyncio.to_thread(mcp_session_pool.acquire, params)
+        tools.extend(build_mcp_tools(mcp_session, async_native=True))
+    except Exception as e:
+        logger.error(f"Failed to acquire MCP session, running without log search tools: {e}")
+
+    try:
+        result = await agent_factory.build_crew(query, history, tools, steps).akickoff()
+        return _finish_run(run_id, result)
+    except AgentSuspended as e:
+        _suspend_run(run_id, e.prompt, query, history)
+        raise
+    except AgentStoppedException as e:
+        _fail_run(run_id, e)
+    except Exception as e:
+        _fail_run(run_id, e)
         raise e
     finally:
-        if run_id and allow_human_input:
-            # Restore original input
-            builtins.input = original_input
+        if run_id:
+            unbind_run(run_id)
+            pop_steps(run_id)
+        if mcp_session is not None:
+            mcp_session_pool.release(mcp_session)
@@ -0,0 +1,131 @@
+import copy
+import threading
+from crewai import Agent, Task, Crew, Process
+from crewai.utilities.llm_utils import create_llm
+
+from .config import kimi_llm
+from .checkpoint import render_steps
+from .tools.human_tool import AskHumanTool
+from .tools.knowledge_tool import KnowledgeBaseTool, get_knowledge_base_description
+
+AGENT_ROLE = 'Log Analysis Assistant'
+AGENT_GOAL = 'Help users search logs in Rizhiyi and troubleshoot issues using the knowledge base.'
+AGENT_BACKSTORY = """You are a helpful and cautious log analysis assistant. 
+        You have access to a knowledge base (error codes, assets, solutions) and Rizhiyi log search.
+        IMPORTANT: If a user's query is vague, or if you need more details to perform a log search, use the 'ask_human' tool to clarify.
+        When searching logs, provide clear and concise analysis of the results."""
+
+
+def _history_context(history):
+    # Prepare context from history
+    context_str = ""
+    if history:
+        context_str = "以下是之前的对话历史，请参考这些信息来回答用户的新问题：\n"
+        for msg in history:
+            role_name = "用户" if msg.get('role') == 'user' else "助手"
+            context_str += f"{role_name}: {msg.get('content')}\n"
+        context_str += "\n当前新问题："
+    return context_str
+
+
+class AgentFactory:
+    """
+    智能体模板缓存。
+    LLM 的配置和 API 客户端、不持有运行状态的工具（知识库、ask_human）在进程内只构建一次，
+    工具通过 current_run_id() 获取当前运行，多个运行可以共用同一个实例；MCP 工具按会话缓存（见 build_mcp_tools）。
+    Agent/Task/Crew 持有单次执行的可变状态（执行器、消息、工具调用计数），每次运行用缓存的部件重新组装，
+    只绑定本次的查询、历史和已完成的步骤。
+    """
+    def __init__(self, llm):
+        self._llm_source = llm
+        self._lock = threading.Lock()
+        self._llm = None
+        self._tools = {}
+
+    @property
+    def llm(self):
+        """crewai 的 LLM 对象（由 LangChain 配置转换而来，转换时会创建 API 客户端）"""
+        with self._lock:
+            if self._llm is None:
+                self._llm = create_llm(self._llm_source)
+            return self._llm
+
+    def run_llm(self):
+        """
+        本次运行专用的 LLM。
+        crewai 的执行器会修改 LLM 的 stop 词并累计 token 用量，运行之间不能共用同一个对象；
+        副本与缓存的 LLM 共用配置和 API 客户端，只复制可变的容器，token 统计从零开始。
+        """
+        llm = copy.copy(self.llm)
+        for name, value in vars(llm).items():
+            if isinstance(value, (list, dict)):
+                setattr(llm, name, copy.copy(value))
+        if isinstance(getattr(llm, '_token_usage', None), dict):
+            llm._token_usage = dict.fromkeys(llm._token_usage, 0)
+        return llm
+
+    def _tool(self, key, make_tool):
+        with self._lock:
+            tool = self._tools.get(key)
+            if tool is None:
+                tool = self._tools[key] = make_tool()
+            return tool
+
+    def base_tools(self, allow_human_input, async_native=False, suspendable=False):
+        """每次运行都使用的工具（不含绑定会话的 MCP 工具）"""
+        knowledge_tool = self._tool(
+            ('knowledge_base', async_native), lambda: KnowledgeBaseTool(async_native=async_native)
+        )
+        # 知识库元数据变化时（上传或删除 CSV），描述随注册表更新
+        description = get_knowledge_base_description()
+        if knowledge_tool.description != description:
+            knowledge_tool.description = description
+        tools = [knowledge_tool]
+
+        if allow_human_input:
+            tools.append(self._tool(
+                ('ask_human', async_native, suspendable),
+                lambda: AskHumanTool(async_native=async_native, suspendable=suspendable),
+            ))
+        return tools
+
+    def build_crew(self, query, history, tools, steps=None):
+        # Create a local agent instance for this run to avoid global state conflicts
+        local_log_assistant = Agent(
+            role=AGENT_ROLE,
+            goal=AGENT_GOAL,
+            backstory=AGENT_BACKSTORY,
+            tools=tools,
+            verbose=True,
+            allow_delegation=False,
+            memory=True,
+            llm=self.run_llm()
+        )
+
+        # Task 1: Information Gathering and Problem Solving
+        info_task = Task(
+            description=f'{_history_context(history)}Answer the user query: "{query}". \n'
+                        f'{render_steps(steps)}'
+                        'Steps:\n'
+                        '1. Search and analyze logs in Rizhiyi.\n'
+                        '2. Search the knowledge base for error codes or assets if needed.\n'
+                        '3. CRITICAL: If you need any clarification, use the "ask_human" tool to ask for details.',
+            expected_output='A detailed response based on the log analysis and knowledge base information. If ask_human was used, incorporate the user\'s feedback.',
+            agent=local_log_assistant
+        )
+
+        return Crew(
+            agents=[local_log_assistant],
+            tasks=[info_task],
+            process=Process.sequential,
+            verbose=True
+        )
+
+    def warm(self):
+        """提前构建 LLM 和基础工具，首个运行不用承担这部分开销"""
+        self.llm
+        self.base_tools(allow_human_input=True, suspendable=True)
+
+
+# 进程内共享的智能体模板
+agent_factory = AgentFactory(kimi_llm)
@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import logging
+from .run_store import run_store
+
+logger = logging.getLogger('crewai_agent')
+
+# 等待期间重新读取运行状态的间隔（秒），用于发现其他进程写入共享存储的变化
+WAIT_POLL_INTERVAL = 1.0
+
+
+class AsyncRuntime:
+    """
+    异步执行运行时。
+    所有运行作为 task 在同一个常驻事件循环线程上执行，等待 LLM、MCP 工具和人类输入时只挂起 task，
+    不占用线程；同步线程通过 spawn 提交协程，通过 notify 唤醒等待中的运行。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._waiters = {}
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="agent-async-runtime", daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def spawn(self, coro):
+        """在运行时的事件循环上执行协程，返回 concurrent.futures.Future（可在任意线程调用）"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def notify(self, run_id):
+        """运行状态被外部修改（人类输入、停止请求）时唤醒等待它的 task（可在任意线程调用）"""
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._wake, run_id)
+
+    def _wake(self, run_id):
+        waiter = self._waiters.get(run_id)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def wait_for(self, run_id, predicate, timeout):
+        """
+        RunStore.wait_for 的异步版本：等待运行状态满足 predicate，返回运行状态；
+        超时或运行不存在时返回 None。本进程内的修改通过 notify 立即唤醒，
+        其他进程对共享存储的修改按 WAIT_POLL_INTERVAL 发现。
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            # 先登记再读取，读取之后到达的 notify 不会丢失
+            waiter = self._waiters[run_id] = loop.create_future()
+            try:
+                run = run_store.get(run_id)
+                if run is None:
+                    return None
+                if predicate(run):
+                    return run
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    await asyncio.wait_for(waiter, min(remaining, WAIT_POLL_INTERVAL))
+                except asyncio.TimeoutError:
+                    pass
+            finally:
+                if self._waiters.get(run_id) is waiter:
+                    del self._waiters[run_id]
+
+
+# 进程内共享的异步运行时
+async_runtime = AsyncRuntime()
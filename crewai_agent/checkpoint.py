@@ -0,0 +1,74 @@
+import json
+
+# 检查点中每个工具输出保留的最大字符数，避免日志检索结果把运行状态撑大
+CHECKPOINT_MAX_OUTPUT_CHARS = 2000
+
+# 本进程中正在执行的运行已完成的工具调用 {run_id: [step, ...]}
+_steps = {}
+
+
+class AgentSuspended(BaseException):
+    """
+    挂起模式下 ask_human 抛出，结束当前 crew 执行，由执行入口保存检查点。
+    继承 BaseException：crewai 会捕获工具抛出的 Exception 并重试，普通异常无法中断执行。
+    """
+    def __init__(self, prompt):
+        super().__init__(prompt)
+        self.prompt = prompt
+
+
+def start_steps(run_id, steps=None):
+    """开始记录运行的工具调用，恢复运行时从检查点中的步骤继续"""
+    _steps[run_id] = list(steps or [])
+
+
+def record_step(run_id, tool, arguments, output):
+    steps = _steps.get(run_id)
+    if steps is None:
+        return
+    output = str(output)
+    if len(output) > CHECKPOINT_MAX_OUTPUT_CHARS:
+        output = output[:CHECKPOINT_MAX_OUTPUT_CHARS] + "...(truncated)"
+    steps.append({"tool": tool, "arguments": arguments, "output": output})
+
+
+def pop_steps(run_id):
+    return _steps.pop(run_id, [])
+
+
+def make_checkpoint(run_id, prompt, query, history):
+    """
+    运行在等待人类输入时保存的全部状态：原始问题、对话历史、已完成的工具调用和待回答的问题。
+    只包含可以 JSON 序列化的数据，任意 worker（或进程）都可以据此恢复运行。
+    """
+    return {
+        "query": query,
+        "history": history or [],
+        "steps": pop_steps(run_id),
+        "prompt": prompt,
+    }
+
+
+def resume_steps(checkpoint, answer):
+    """恢复运行时的步骤：检查点中的工具调用，加上这次人类问答"""
+    return checkpoint["steps"] + [{
+        "tool": "ask_human",
+        "arguments": {"prompt": checkpoint["prompt"]},
+        "output": answer,
+    }]
+
+
+def render_steps(steps):
+    """把已完成的步骤渲染成任务描述的一部分，让恢复后的智能体从这里继续"""
+    if not steps:
+        return ""
+    lines = [
+        "Progress so far on this request (these steps were already executed; "
+        "reuse their results instead of repeating them):"
+    ]
+    for index, step in enumerate(steps, 1):
+        arguments = json.dumps(step["arguments"], ensure_ascii=False, default=str)
+        lines.append(f"Step {index}: called tool `{step['tool']}` with {arguments}")
+        lines.append(f"Result: {step['output']}")
+    lines.append("Continue from here.\n")
+    return "\n".join(lines)
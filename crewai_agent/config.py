@@ -1,5 +1,6 @@
 import os
 import threading
+import contextvars
 from langchain_openai import ChatOpenAI
 
 # Base directory of the project
@@ -8,9 +9,68 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # MCP server path
 LOG_TOOLS_SERVER_PATH = os.getenv("LOG_TOOLS_SERVER_PATH")
 
-# Global state for agent runs and Human-in-the-loop
-agent_runs = {}
+# MCP session pool settings
+MCP_POOL_MAX_SIZE = int(os.getenv("MCP_POOL_MAX_SIZE", "8"))
+MCP_POOL_IDLE_TIMEOUT = float(os.getenv("MCP_POOL_IDLE_TIMEOUT", "600"))
+MCP_POOL_HEALTH_INTERVAL = float(os.getenv("MCP_POOL_HEALTH_INTERVAL", "60"))
+MCP_POOL_ACQUIRE_TIMEOUT = float(os.getenv("MCP_POOL_ACQUIRE_TIMEOUT", "30"))
+MCP_START_TIMEOUT = float(os.getenv("MCP_START_TIMEOUT", "20"))
+MCP_CALL_TIMEOUT = float(os.getenv("MCP_CALL_TIMEOUT", "120"))
+MCP_TOOLS_CACHE_TTL = float(os.getenv("MCP_TOOLS_CACHE_TTL", "300"))
+MCP_TOOLS_ERROR_TTL = float(os.getenv("MCP_TOOLS_ERROR_TTL", "30"))
+
+# Knowledge base settings
+KB_CACHE_DIR = os.getenv("KB_CACHE_DIR", os.path.join(BASE_DIR, "data", ".cache"))
+KB_TOP_K = int(os.getenv("KB_TOP_K", "10"))
+KB_SEARCH_WORKERS = int(os.getenv("KB_SEARCH_WORKERS", "4"))
+KB_SEARCH_TIMEOUT = float(os.getenv("KB_SEARCH_TIMEOUT", "30"))
+KB_OUTPUT_FORMAT = os.getenv("KB_OUTPUT_FORMAT", "kv")
+KB_MAX_CELL_CHARS = int(os.getenv("KB_MAX_CELL_CHARS", "200"))
+KB_MAX_OUTPUT_CHARS = int(os.getenv("KB_MAX_OUTPUT_CHARS", "4000"))
+KB_INGEST_CHUNK_ROWS = int(os.getenv("KB_INGEST_CHUNK_ROWS", "50000"))
+KB_EMBEDDING_MODEL = os.getenv("KB_EMBEDDING_MODEL", "")
+KB_EMBEDDING_BASE_URL = os.getenv("KB_EMBEDDING_BASE_URL")
+KB_EMBEDDING_BATCH_SIZE = int(os.getenv("KB_EMBEDDING_BATCH_SIZE", "256"))
+KB_MIN_SIMILARITY = float(os.getenv("KB_MIN_SIMILARITY", "0.3"))
+
+# Agent run scheduler settings
+AGENT_EXECUTION_BACKEND = os.getenv("AGENT_EXECUTION_BACKEND", "thread")
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "4"))
+AGENT_MAX_QUEUE = int(os.getenv("AGENT_MAX_QUEUE", "32"))
+AGENT_USER_CONCURRENCY = int(os.getenv("AGENT_USER_CONCURRENCY", "1"))
+AGENT_USER_MAX_PENDING = int(os.getenv("AGENT_USER_MAX_PENDING", "3"))
+AGENT_ASYNC_MAX_RUNS = int(os.getenv("AGENT_ASYNC_MAX_RUNS", "200"))
+
+# Human-in-the-loop: suspend (checkpoint the run and release its worker) or wait (block the worker)
+AGENT_HUMAN_INPUT_MODE = os.getenv("AGENT_HUMAN_INPUT_MODE", "suspend")
+AGENT_HUMAN_INPUT_TIMEOUT = float(os.getenv("AGENT_HUMAN_INPUT_TIMEOUT", "300"))
+
+# Agent run log capture: events (crewai event bus and hooks) or stdout (parse crewai's console output)
+AGENT_LOG_CAPTURE = os.getenv("AGENT_LOG_CAPTURE", "events")
+
+# Agent run state store: memory, sqlite or file
+AGENT_RUN_STORE = os.getenv("AGENT_RUN_STORE", "memory")
+AGENT_RUN_STORE_PATH = os.getenv("AGENT_RUN_STORE_PATH")
+AGENT_RUN_TTL = float(os.getenv("AGENT_RUN_TTL", "3600"))
+AGENT_RUN_GC_INTERVAL = float(os.getenv("AGENT_RUN_GC_INTERVAL", "60"))
+# Agent run logs: entries kept in memory per run (older ones spill to gzip JSONL on disk) and page size for reads
+AGENT_LOG_MEMORY_ENTRIES = int(os.getenv("AGENT_LOG_MEMORY_ENTRIES", "500"))
+AGENT_LOG_SPILL_DIR = os.getenv("AGENT_LOG_SPILL_DIR")
+AGENT_LOG_PAGE_SIZE = int(os.getenv("AGENT_LOG_PAGE_SIZE", "200"))
+
+# Thread-local binding of the current agent run
 _thread_local = threading.local()
+# 异步模式下多个运行共用事件循环线程，run_id 绑定在每个运行 task 的上下文中
+_current_run = contextvars.ContextVar('agent_run_id', default=None)
+# 本进程中正在执行的运行（共享存储里其他进程的运行不在其中）
+_local_runs = set()
+
+def current_run_id():
+    """
+    当前线程或 task 正在执行的 run_id。
+    运行交给其他线程的工作需要显式带上上下文（asyncio.to_thread、RunContextExecutor、crewai 事件总线都会复制上下文）。
+    """
+    return _current_run.get() or getattr(_thread_local, 'run_id', None)
 
 class AgentStoppedException(Exception):
     """Exception raised when the agent run is manually stopped."""
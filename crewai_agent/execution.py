@@ -0,0 +1,249 @@
+import queue
+import atexit
+import asyncio
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .config import AGENT_EXECUTION_BACKEND, AGENT_MAX_WORKERS
+from .run_store import run_store, ACTIVE_STATUSES, RUNNING, WAITING, STOPPED
+from .async_runtime import async_runtime
+from .checkpoint import AgentSuspended
+
+# 进程模式下 Django 进程不加载 crewai，智能体只在 worker 进程中导入
+if AGENT_EXECUTION_BACKEND != 'process':
+    from .agent import run_crew, arun_crew
+
+logger = logging.getLogger('crewai_agent')
+
+# 子进程把运行状态同步回主进程的间隔（秒）
+PUMP_INTERVAL = 0.2
+# 需要同步的运行状态字段（logs 单独按增量同步）
+SYNC_FIELDS = ('status', 'prompt', 'result', 'checkpoint')
+
+# 本进程中进程模式运行的控制队列 {run_id: queue}
+_controls = {}
+
+
+def execute_run(run_id, **kwargs):
+    """
+    执行一次智能体运行，返回结果文本。
+    AGENT_EXECUTION_BACKEND=process 时在子进程中执行，否则在当前线程中执行（async 模式请使用 dispatch_run）。
+    """
+    if AGENT_EXECUTION_BACKEND == 'process':
+        return process_backend.run(run_id, kwargs)
+    return run_crew(run_id=run_id, **kwargs)
+
+
+def dispatch_run(run_id, on_result, **kwargs):
+    """
+    调度器 worker 调用的入口，运行成功后在普通线程中调用 on_result(result)（可以安全访问 Django ORM）。
+    thread/process 模式下阻塞到运行结束；async 模式下把运行交给异步运行时，
+    立即返回 concurrent.futures.Future，worker 线程不等待运行结束。
+    运行挂起等待人类输入时（检查点已保存）不调用 on_result，恢复后的那次执行结束时才调用。
+    """
+    kwargs.setdefault('suspendable', True)
+    if AGENT_EXECUTION_BACKEND == 'async':
+        return async_runtime.spawn(_dispatch_async(run_id, on_result, kwargs))
+    try:
+        result = execute_run(run_id, **kwargs)
+    except AgentSuspended:
+        return
+    on_result(result)
+
+
+async def _dispatch_async(run_id, on_result, kwargs):
+    try:
+        result = await arun_crew(run_id=run_id, **kwargs)
+    except AgentSuspended:
+        return None
+    await asyncio.to_thread(on_result, result)
+    return result
+
+
+def send_input(run_id, user_input):
+    """把人类输入交给等待中的运行"""
+    run_store.transition(run_id, (WAITING,), response=user_input)
+    async_runtime.notify(run_id)
+    control = _controls.get(run_id)
+    if control is not None:
+        control.put(('input', user_input))
+
+
+def request_stop(run_id):
+    """请求停止运行；正在等待人类输入的运行会被立即唤醒"""
+    run_store.transition(run_id, ACTIVE_STATUSES, status=STOPPED)
+    async_runtime.notify(run_id)
+    control = _controls.get(run_id)
+    if control is not None:
+        control.put(('stop', None))
+
+
+# ---------------------------------------------------------------------------
+# 子进程
+# ---------------------------------------------------------------------------
+
+_event_queue = None
+
+
+def _init_child(event_queue):
+    global _event_queue
+    _event_queue = event_queue
+    # 提前导入并构建智能体模板，首个任务不用等待 crewai 加载
+    from . import agent  # noqa: F401
+    from .agent_factory import agent_factory
+    agent_factory.warm()
+
+
+def _child_pump(run_id, control, finished):
+    """
+    在子进程中运行（仅限不能跨进程共享的内存存储）：
+    把本地运行状态的变化增量发回主进程，并把主进程发来的人类输入和停止请求应用到本地状态。
+    """
+    sent = {field: None for field in SYNC_FIELDS}
+    sent_logs = 0
+    while True:
+        done = finished.wait(PUMP_INTERVAL)
+
+        while True:
+            try:
+                kind, payload = control.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'input':
+                run_store.transition(run_id, (WAITING,), response=payload)
+            elif kind == 'stop':
+                run_store.transition(run_id, ACTIVE_STATUSES, status=STOPPED)
+
+        run = run_store.get(run_id) or {}
+        fields = {field: run.get(field) for field in SYNC_FIELDS if run.get(field) != sent[field]}
+        new_logs = run_store.get_logs(run_id, since=sent_logs)
+        if fields or new_logs:
+            _event_queue.put(('update', run_id, fields, new_logs))
+            sent.update(fields)
+            sent_logs += len(new_logs)
+
+        if done:
+            _event_queue.put(('done', run_id, None, None))
+            return
+
+
+def _child_run(run_id, control, kwargs):
+    """
+    子进程中的任务入口。
+    共享存储（sqlite/file）下子进程直接读写运行状态；
+    内存存储下使用进程内独立的运行状态，由 _child_pump 同步回主进程。
+    """
+    from .agent import run_crew
+
+    if run_store.shared:
+        try:
+            return run_crew(run_id=run_id, **kwargs)
+        finally:
+            _event_queue.put(('done', run_id, None, None))
+
+    run_store.create(run_id, status=RUNNING)
+    finished = threading.Event()
+    pump = threading.Thread(target=_child_pump, args=(run_id, control, finished), daemon=True)
+    pump.start()
+    try:
+        return run_crew(run_id=run_id, **kwargs)
+    finally:
+        finished.set()
+        pump.join()
+        run_store.delete(run_id)
+
+
+# ---------------------------------------------------------------------------
+# 主进程
+# ---------------------------------------------------------------------------
+
+class ProcessBackend:
+    """
+    进程池执行后端。
+    每个运行在独立的 worker 进程中执行（spawn 启动，不继承 Django 进程状态），
+    使用内存存储时，状态和日志通过共享的事件队列回传，人类输入和停止请求通过每个运行的控制队列下发；
+    使用共享存储时子进程直接读写存储。
+    一个 worker 进程同一时间只执行一个运行，builtins.input 等进程级状态不会在运行之间共享。
+    """
+    def __init__(self, max_workers=AGENT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._ctx = multiprocessing.get_context('spawn')
+        self._executor = None
+        self._manager = None
+        self._event_queue = None
+        self._done = {}
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._event_queue is None:
+                self._event_queue = self._ctx.Queue()
+                self._manager = self._ctx.Manager()
+                threading.Thread(target=self._pump, name="agent-process-events", daemon=True).start()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=self._ctx,
+                    initializer=_init_child,
+                    initargs=(self._event_queue,),
+                )
+            return self._executor
+
+    def _pump(self):
+        """把子进程回传的状态变化应用到主进程的运行状态存储"""
+        while True:
+            try:
+                kind, run_id, fields, logs = self._event_queue.get()
+            except (EOFError, OSError):
+                return
+            if kind == 'done':
+                done = self._done.get(run_id)
+                if done is not None:
+                    done.set()
+                continue
+            # 主进程已标记停止（或已结束）时，不再被子进程滞后的状态覆盖
+            if fields:
+                run_store.transition(run_id, ACTIVE_STATUSES, **fields)
+            for entry in logs:
+                run_store.append_log(run_id, entry)
+
+    def run(self, run_id, kwargs):
+        executor = self._ensure_started()
+        control = _controls[run_id] = self._manager.Queue()
+        done = self._done[run_id] = threading.Event()
+        try:
+            future = executor.submit(_child_run, run_id, control, kwargs)
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # worker 进程异常退出，丢弃进程池，下一次运行时重建
+                with self._lock:
+                    if self._executor is executor:
+                        self._executor = None
+                executor.shutdown(wait=False)
+                raise RuntimeError("Agent worker process exited unexpectedly")
+            except BaseException:
+                # 包括挂起（AgentSuspended），同样要等检查点同步回主进程
+                done.wait(timeout=5)
+                raise
+            # 等待最后一批状态同步完成，保证返回时日志已经完整
+            done.wait(timeout=5)
+            return result
+        finally:
+            self._done.pop(run_id, None)
+            _controls.pop(run_id, None)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            if self._manager is not None:
+                self._manager.shutdown()
+                self._manager = None
+
+
+process_backend = ProcessBackend()
+atexit.register(process_backend.shutdown)
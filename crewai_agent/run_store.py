@@ -0,0 +1,760 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import struct
+import bisect
+import itertools
+import collections
+import sqlite3
+import tempfile
+import threading
+import logging
+from .config import (
+    AGENT_RUN_STORE, AGENT_RUN_STORE_PATH, AGENT_RUN_TTL, AGENT_RUN_GC_INTERVAL, AGENT_HUMAN_INPUT_TIMEOUT, BASE_DIR,
+    AGENT_LOG_MEMORY_ENTRIES, AGENT_LOG_SPILL_DIR, AGENT_LOG_PAGE_SIZE,
+)
+
+logger = logging.getLogger('crewai_agent')
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 运行状态
+QUEUED = 'queued'
+RUNNING = 'running'
+WAITING = 'waiting'
+COMPLETED = 'completed'
+ERROR = 'error'
+STOPPED = 'stopped'
+ACTIVE_STATUSES = (QUEUED, RUNNING, WAITING)
+FINISHED_STATUSES = (COMPLETED, ERROR, STOPPED)
+
+# 每次运行默认携带的字段
+DEFAULT_FIELDS = {'status': QUEUED, 'prompt': None, 'response': None, 'result': None, 'session_id': None, 'checkpoint': None}
+
+# 非内存存储等待状态变化时的轮询间隔（秒）
+POLL_INTERVAL = 0.5
+
+_RUN_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+# 文件存储的日志偏移索引：每 LOG_INDEX_STRIDE 条日志记录一次该条在日志文件中的字节偏移
+LOG_INDEX_STRIDE = 64
+_OFFSET = struct.Struct('<Q')
+
+
+def _stamp_fields(current_status, fields):
+    """写入时补充 updated_at，首次进入结束状态时记录 finished_at"""
+    now = time.time()
+    fields['updated_at'] = now
+    status = fields.get('status')
+    if status in FINISHED_STATUSES and current_status not in FINISHED_STATUSES:
+        fields['finished_at'] = now
+    return fields
+
+
+class RunStore:
+    """
+    智能体运行状态存储的接口。
+    每次运行是一条以 run_id 为键的记录（status、prompt、response、result 等字段）加一串追加写入的日志。
+    状态变更通过 transition 原子地完成（比较并交换）；结束超过 TTL 的运行和等待人类输入超时的运行
+    由后台线程每隔 gc_interval 清理一次（第一次创建运行时启动）。
+    shared 表示存储能否被多个进程共享。
+    """
+    shared = False
+
+    def __init__(self, ttl=AGENT_RUN_TTL, gc_interval=AGENT_RUN_GC_INTERVAL, suspend_timeout=AGENT_HUMAN_INPUT_TIMEOUT):
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+        self.suspend_timeout = suspend_timeout
+        self._last_gc = time.monotonic()
+        self._gc_thread = None
+        self._gc_lock = threading.Lock()
+
+    def create(self, run_id, **fields):
+        raise NotImplementedError
+
+    def get(self, run_id):
+        """运行的字段（不含日志），不存在时返回 None"""
+        raise NotImplementedError
+
+    def update(self, run_id, **fields):
+        """无条件更新字段，运行不存在时返回 False"""
+        return self.transition(run_id, None, **fields)
+
+    def transition(self, run_id, from_statuses, **fields):
+        """仅当当前状态属于 from_statuses（None 表示任意状态）时更新，返回是否更新成功"""
+        raise NotImplementedError
+
+    def append_log(self, run_id, entry):
+        """追加一条日志，返回它的序号（从 1 开始），运行不存在时返回 None"""
+        raise NotImplementedError
+
+    def get_logs(self, run_id, since=0, limit=None):
+        """序号大于 since 的日志，最多 limit 条（None 表示不限）"""
+        raise NotImplementedError
+
+    def iter_logs(self, run_id, page_size=AGENT_LOG_PAGE_SIZE):
+        """按页读取运行的全部日志"""
+        since = 0
+        while True:
+            page = self.get_logs(run_id, since=since, limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            since += len(page)
+
+    def delete(self, run_id):
+        raise NotImplementedError
+
+    def active_run_ids(self):
+        raise NotImplementedError
+
+    def gc(self):
+        """删除结束超过 TTL 的运行，返回删除的数量"""
+        raise NotImplementedError
+
+    def expire_suspended(self):
+        """挂起等待人类输入超过 suspend_timeout 的运行标记为超时错误，返回标记的数量"""
+        cutoff = time.time() - self.suspend_timeout
+        expired = 0
+        for run_id in self.active_run_ids():
+            run = self.get(run_id)
+            if not run or run['status'] != WAITING or not run.get('checkpoint'):
+                continue
+            if run.get('updated_at', 0) < cutoff and self.transition(
+                run_id, (WAITING,), status=ERROR, result="Human input timeout", prompt=None, checkpoint=None
+            ):
+                expired += 1
+        return expired
+
+    def get_status(self, run_id):
+        run = self.get(run_id)
+        return run['status'] if run else None
+
+    def wait_for(self, run_id, predicate, timeout):
+        """
+        等待运行满足 predicate，返回最后读到的运行字段；超时返回 None。
+        默认轮询实现，可跨进程使用。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            run = self.get(run_id)
+            if run is None or predicate(run):
+                return run
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def start_gc(self):
+        """启动后台清理线程（只启动一次），这样没有新运行创建时过期和超时的运行也会被处理"""
+        if self._gc_thread is not None:
+            return
+        with self._gc_lock:
+            if self._gc_thread is None:
+                self._gc_thread = threading.Thread(target=self._gc_loop, name='agent-run-gc', daemon=True)
+                self._gc_thread.start()
+
+    def _gc_loop(self):
+        while True:
+            time.sleep(self.gc_interval)
+            self.maybe_gc()
+
+    def maybe_gc(self):
+        """距离上次清理超过 gc_interval 时清理一次"""
+        now = time.monotonic()
+        if now - self._last_gc < self.gc_interval:
+            return
+        self._last_gc = now
+        try:
+            removed = self.gc()
+            if removed:
+                logger.info(f"Removed {removed} expired agent runs")
+            expired = self.expire_suspended()
+            if expired:
+                logger.info(f"Expired {expired} agent runs waiting for human input")
+        except Exception as e:
+            logger.warning(f"Agent run garbage collection failed: {e}")
+
+
+class SpilledLog:
+    """
+    内存存储中一次运行的日志：最近的条目留在内存，超过 capacity 时把较早的一半追加到 gzip 压缩的 JSONL 文件。
+    每批是一个独立的 gzip member，记录它第一条的下标和在文件中的偏移，分页读取时只解压覆盖所需范围的 member。
+    压缩和写文件在存储的锁外进行，写完后才在锁内把这批条目从内存移到文件；
+    文件只追加，已发布的部分不再变化，可以在存储的锁外读取。
+    """
+    def __init__(self, path, capacity):
+        self.path = path
+        self.capacity = capacity
+        self.recent = collections.deque()
+        self.count = 0
+        self.spilled = 0
+        self.discarded = False
+        self._spilling = False
+        self._members = []  # [(第一条的下标, 文件偏移)]
+
+    def append(self, entry):
+        """
+        在存储的锁内调用。
+        需要落盘时返回较早的一批条目（仍留在内存中可读），调用方在锁外交给 write_batch，再在锁内 publish。
+        """
+        self.recent.append(entry)
+        self.count += 1
+        if self.path and not self._spilling and len(self.recent) > self.capacity:
+            self._spilling = True
+            return list(itertools.islice(self.recent, max(self.capacity // 2, 1)))
+        return None
+
+    def write_batch(self, batch):
+        """在锁外压缩并追加到文件，返回这个 member 的偏移，写入失败时返回 None（条目继续留在内存）"""
+        data = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+        compressed = gzip.compress(data.encode('utf-8'))
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # 同一时间每个运行只有一批在写，打开后的文件末尾就是这个 member 的偏移
+            with open(self.path, 'ab') as f:
+                offset = f.tell()
+                f.write(compressed)
+            return offset
+        except OSError as e:
+            logger.warning(f"Failed to spill agent logs to {self.path}: {e}")
+            return None
+
+    def publish(self, size, offset):
+        """在存储的锁内调用：写入完成后把这批条目从内存移到文件。日志已被丢弃时返回 False，由调用方删除文件"""
+        self._spilling = False
+        if self.discarded:
+            return False
+        if offset is None:
+            return True
+        for _ in range(size):
+            self.recent.popleft()
+        self._members.append((self.spilled, offset))
+        self.spilled += size
+        return True
+
+    def snapshot(self, since, limit):
+        """在存储的锁内调用：返回需要从文件读取的下标范围和内存中的那部分条目"""
+        end = self.count if limit is None else min(self.count, since + limit)
+        if since >= end:
+            return (0, 0), []
+        disk_range = (since, min(end, self.spilled)) if since < self.spilled else (0, 0)
+        start = max(since, self.spilled) - self.spilled
+        stop = max(end - self.spilled, 0)
+        return disk_range, list(itertools.islice(self.recent, min(start, stop), stop))
+
+    def read_spilled(self, start, stop):
+        if start >= stop:
+            return []
+        # 只读取覆盖 [start, stop) 的 member：从包含 start 的 member 到第一条不小于 stop 的 member 之前
+        first_member = bisect.bisect_right(self._members, (start, float('inf'))) - 1
+        last_member = bisect.bisect_left(self._members, (stop,))
+        first, offset = self._members[first_member]
+        end = self._members[last_member][1] if last_member < len(self._members) else None
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(end - offset) if end is not None else f.read()
+            lines = gzip.decompress(data).decode('utf-8').splitlines()
+            return [json.loads(line) for line in lines[start - first:stop - first]]
+        except FileNotFoundError:
+            # 运行已被清理
+            return []
+        except (EOFError, gzip.BadGzipFile) as e:
+            logger.warning(f"Corrupted agent log spill file {self.path}: {e}")
+            return []
+
+    def discard(self):
+        """丢弃日志并删除文件；正在写入的一批由 publish 的调用方在写完后删除"""
+        self.discarded = True
+        if self.path:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+
+class MemoryRunStore(RunStore):
+    """
+    进程内存储，只适用于单进程部署。
+    每个运行在内存中只保留最近 memory_entries 条日志，更早的写入 spill_dir 下的压缩文件（见 SpilledLog）。
+    """
+
+    def __init__(self, spill_dir=None, memory_entries=AGENT_LOG_MEMORY_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.spill_dir = spill_dir
+        self.memory_entries = memory_entries
+        self._runs = {}
+        self._logs = {}
+        self._cond = threading.Condition()
+
+    def _new_log(self, run_id):
+        path = None
+        if self.spill_dir and _RUN_ID_PATTERN.match(run_id or ''):
+            # process 模式下子进程有自己的内存存储，文件名带上进程号避免和主进程冲突
+            path = os.path.join(self.spill_dir, f"{run_id}.{os.getpid()}.jsonl.gz")
+        return SpilledLog(path, self.memory_entries)
+
+    def create(self, run_id, **fields):
+        self.start_gc()
+        run = dict(DEFAULT_FIELDS, **fields)
+        _stamp_fields(None, run)
+        log = self._new_log(run_id)
+        with self._cond:
+            self._runs[run_id] = run
+            previous = self._logs.get(run_id)
+            self._logs[run_id] = log
+            self._cond.notify_all()
+        if previous is not None:
+            previous.discard()
+
+    def get(self, run_id):
+        with self._cond:
+            run = self._runs.get(run_id)
+            return dict(run) if run is not None else None
+
+    def transition(self, run_id, from_statuses, **fields):
+        with self._cond:
+            run = self._runs.get(run_id)
+            if run is None or (from_statuses is not None and run['status'] not in from_statuses):
+                return False
+            run.update(_stamp_fields(run['status'], fields))
+            self._cond.notify_all()
+            return True
+
+    def append_log(self, run_id, entry):
+        with self._cond:
+            log = self._logs.get(run_id)
+            if log is None:
+                return None
+            batch = log.append(entry)
+            seq = log.count
+            self._cond.notify_all()
+        if batch:
+            # 压缩和写文件不占用存储的锁
+            offset = log.write_batch(batch)
+            with self._cond:
+                kept = log.publish(len(batch), offset)
+            if not kept:
+                log.discard()
+        return seq
+
+    def get_logs(self, run_id, since=0, limit=None):
+        with self._cond:
+            log = self._logs.get(run_id)
+            if log is None:
+                return []
+            disk_range, recent = log.snapshot(since, limit)
+        # 解压在锁外进行，不阻塞其他运行写日志
+        return log.read_spilled(*disk_range) + recent
+
+    def delete(self, run_id):
+        with self._cond:
+            self._runs.pop(run_id, None)
+            log = self._logs.pop(run_id, None)
+        if log is not None:
+            log.discard()
+
+    def active_run_ids(self):
+        with self._cond:
+            return [run_id for run_id, run in self._runs.items() if run['status'] in ACTIVE_STATUSES]
+
+    def gc(self):
+        cutoff = time.time() - self.ttl
+        with self._cond:
+            expired = [
+                run_id for run_id, run in self._runs.items()
+                if run.get('finished_at') is not None and run['finished_at'] < cutoff
+            ]
+            logs = []
+            for run_id in expired:
+                self._runs.pop(run_id, None)
+                logs.append(self._logs.pop(run_id, None))
+        for log in logs:
+            if log is not None:
+                log.discard()
+        return len(expired)
+
+    def wait_for(self, run_id, predicate, timeout):
+        # 内存存储的每次写入都会通知条件变量，不需要轮询
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                run = self._runs.get(run_id)
+                if run is None or predicate(run):
+                    return dict(run) if run is not None else None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+
+class SQLiteRunStore(RunStore):
+    """
+    SQLite 存储，同一台机器上的多个 worker 进程共享。
+    按主键查询运行，日志按 (run_id, seq) 存放，读取增量日志只走索引。
+    """
+    shared = True
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS agent_runs (
+            run_id TEXT PRIMARY KEY,
+            status TEXT NOT NULL,
+            data TEXT NOT NULL,
+            log_count INTEGER NOT NULL DEFAULT 0,
+            finished_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS agent_runs_status ON agent_runs (status);
+        CREATE INDEX IF NOT EXISTS agent_runs_finished_at ON agent_runs (finished_at);
+        CREATE TABLE IF NOT EXISTS agent_run_logs (
+            run_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            entry TEXT NOT NULL,
+            PRIMARY KEY (run_id, seq)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """在 BEGIN IMMEDIATE 事务中执行读改写，保证多进程下的原子性"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def create(self, run_id, **fields):
+        self.start_gc()
+        run = dict(DEFAULT_FIELDS, **fields)
+        _stamp_fields(None, run)
+
+        def apply(conn):
+            # 同一 run_id 重新创建时清空旧日志，序号从 1 重新开始
+            conn.execute("DELETE FROM agent_run_logs WHERE run_id = ?", (run_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO agent_runs (run_id, status, data, log_count, finished_at) VALUES (?, ?, ?, 0, ?)",
+                (run_id, run['status'], json.dumps(run), run.get('finished_at')),
+            )
+        self._write(apply)
+
+    def get(self, run_id):
+        row = self._connect().execute("SELECT data FROM agent_runs WHERE run_id = ?", (run_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def transition(self, run_id, from_statuses, **fields):
+        def apply(conn):
+            row = conn.execute("SELECT data FROM agent_runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return False
+            run = json.loads(row[0])
+            if from_statuses is not None and run['status'] not in from_statuses:
+                return False
+            run.update(_stamp_fields(run['status'], fields))
+            conn.execute(
+                "UPDATE agent_runs SET status = ?, data = ?, finished_at = ? WHERE run_id = ?",
+                (run['status'], json.dumps(run), run.get('finished_at'), run_id),
+            )
+            return True
+        return self._write(apply)
+
+    def append_log(self, run_id, entry):
+        def apply(conn):
+            row = conn.execute("SELECT log_count FROM agent_runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            seq = row[0] + 1
+            conn.execute("UPDATE agent_runs SET log_count = ? WHERE run_id = ?", (seq, run_id))
+            conn.execute(
+                "INSERT INTO agent_run_logs (run_id, seq, entry) VALUES (?, ?, ?)",
+                (run_id, seq, json.dumps(entry, ensure_ascii=False)),
+            )
+            return seq
+        return self._write(apply)
+
+    def get_logs(self, run_id, since=0, limit=None):
+        rows = self._connect().execute(
+            "SELECT entry FROM agent_run_logs WHERE run_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (run_id, since, -1 if limit is None else limit),
+        ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def delete(self, run_id):
+        def apply(conn):
+            conn.execute("DELETE FROM agent_run_logs WHERE run_id = ?", (run_id,))
+            conn.execute("DELETE FROM agent_runs WHERE run_id = ?", (run_id,))
+        self._write(apply)
+
+    def active_run_ids(self):
+        placeholders = ", ".join("?" for _ in ACTIVE_STATUSES)
+        rows = self._connect().execute(
+            f"SELECT run_id FROM agent_runs WHERE status IN ({placeholders})", ACTIVE_STATUSES
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def gc(self):
+        cutoff = time.time() - self.ttl
+
+        def apply(conn):
+            expired = [row[0] for row in conn.execute(
+                "SELECT run_id FROM agent_runs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,)
+            )]
+            for run_id in expired:
+                conn.execute("DELETE FROM agent_run_logs WHERE run_id = ?", (run_id,))
+                conn.execute("DELETE FROM agent_runs WHERE run_id = ?", (run_id,))
+            return len(expired)
+        return self._write(apply)
+
+
+class FileRunStore(RunStore):
+    """
+    文件存储：每次运行一个 JSON 状态文件加一个 JSONL 日志文件，可放在共享目录上供多进程使用。
+    读改写在每个运行自己的文件锁内完成，状态文件通过原子替换写入。
+    日志旁有一个偏移索引文件（见 LOG_INDEX_STRIDE），分页读取时直接定位到 since 附近，追加日志不改写状态文件。
+    """
+    shared = True
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, run_id):
+        if not _RUN_ID_PATTERN.match(run_id or ''):
+            return None
+        base = os.path.join(self.directory, run_id)
+        return f"{base}.json", f"{base}.log.jsonl", f"{base}.lock"
+
+    def _locked(self, run_id, fn):
+        paths = self._paths(run_id)
+        if paths is None:
+            return None
+        state_path, log_path, lock_path = paths
+        with self._lock:
+            while True:
+                with open(lock_path, 'a') as lock_file:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                        # 等锁期间锁文件可能被 delete 删除或重建，锁住的不是当前的锁文件时重新打开
+                        try:
+                            current = os.path.samestat(os.fstat(lock_file.fileno()), os.stat(lock_path))
+                        except FileNotFoundError:
+                            current = False
+                        if not current:
+                            continue
+                    result = fn(state_path, log_path)
+                    if not os.path.exists(state_path):
+                        # 运行不存在（已删除或从未创建），持锁删除锁文件，不留下孤立文件
+                        try:
+                            os.remove(lock_path)
+                        except FileNotFoundError:
+                            pass
+                    return result
+
+    @staticmethod
+    def _index_path(log_path):
+        return f"{log_path}.idx"
+
+    @staticmethod
+    def _read_checkpoint(index_path, number):
+        """
+        第 number 个检查点，即第 number * LOG_INDEX_STRIDE 条日志的 (下标, 字节偏移)。
+        索引不全（如写日志后进程崩溃）时退回最后一个可用的检查点。
+        """
+        if number <= 0:
+            return 0, 0
+        try:
+            with open(index_path, 'rb') as f:
+                number = min(number, os.fstat(f.fileno()).st_size // _OFFSET.size)
+                if number <= 0:
+                    return 0, 0
+                f.seek((number - 1) * _OFFSET.size)
+                return number * LOG_INDEX_STRIDE, _OFFSET.unpack(f.read(_OFFSET.size))[0]
+        except FileNotFoundError:
+            return 0, 0
+
+    def _scan_log(self, log_path, index_path):
+        """
+        在运行的锁内调用：从最后一个检查点数到日志末尾。
+        返回 (日志条数, 最后一条完整日志之后的偏移, 索引中缺少的检查点偏移)。
+        """
+        index, offset = self._read_checkpoint(index_path, sys.maxsize)
+        last_checkpoint = index
+        missing = []
+        try:
+            with open(log_path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    if index > last_checkpoint and index % LOG_INDEX_STRIDE == 0:
+                        missing.append(offset)
+                    offset += len(line)
+                    index += 1
+        except FileNotFoundError:
+            pass
+        return index, offset, missing
+
+    def _read_state(self, state_path):
+        try:
+            with open(state_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_state(self, state_path, run):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(run, f, ensure_ascii=False)
+            os.replace(tmp_path, state_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def create(self, run_id, **fields):
+        self.start_gc()
+        run = dict(DEFAULT_FIELDS, **fields)
+        _stamp_fields(None, run)
+
+        def apply(state_path, log_path):
+            open(log_path, 'w').close()
+            try:
+                os.remove(self._index_path(log_path))
+            except FileNotFoundError:
+                pass
+            self._write_state(state_path, run)
+        self._locked(run_id, apply)
+
+    def get(self, run_id):
+        # 状态文件总是整体替换，不加锁读取也不会读到写了一半的内容
+        paths = self._paths(run_id)
+        return self._read_state(paths[0]) if paths else None
+
+    def transition(self, run_id, from_statuses, **fields):
+        def apply(state_path, log_path):
+            run = self._read_state(state_path)
+            if run is None or (from_statuses is not None and run['status'] not in from_statuses):
+                return False
+            run.update(_stamp_fields(run['status'], fields))
+            self._write_state(state_path, run)
+            return True
+        return bool(self._locked(run_id, apply))
+
+    def append_log(self, run_id, entry):
+        def apply(state_path, log_path):
+            if not os.path.exists(state_path):
+                return None
+            index_path = self._index_path(log_path)
+            count, end, missing = self._scan_log(log_path, index_path)
+            # 从最后一条完整日志之后写入，覆盖崩溃时可能留下的半行
+            with os.fdopen(os.open(log_path, os.O_WRONLY | os.O_CREAT), 'wb') as f:
+                f.seek(end)
+                f.truncate()
+                f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8'))
+            if count and count % LOG_INDEX_STRIDE == 0:
+                missing.append(end)
+            if missing:
+                with open(index_path, 'ab') as f:
+                    f.write(b"".join(_OFFSET.pack(offset) for offset in missing))
+            return count + 1
+        return self._locked(run_id, apply)
+
+    def get_logs(self, run_id, since=0, limit=None):
+        paths = self._paths(run_id)
+        if paths is None:
+            return []
+        log_path = paths[1]
+        # 从 since 之前最近的检查点开始读，不必从头扫描
+        index, offset = self._read_checkpoint(self._index_path(log_path), since // LOG_INDEX_STRIDE)
+        logs = []
+        try:
+            with open(log_path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if limit is not None and len(logs) >= limit:
+                        break
+                    # 末尾可能是正在写入的半行
+                    if not line.endswith(b"\n"):
+                        break
+                    if index >= since:
+                        logs.append(json.loads(line))
+                    index += 1
+        except FileNotFoundError:
+            pass
+        return logs
+
+    def delete(self, run_id):
+        # 在运行的文件锁内删除，避免与并发的状态变更交错；锁文件由 _locked 在运行不存在时删除
+        def apply(state_path, log_path):
+            for path in (state_path, log_path, self._index_path(log_path)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        self._locked(run_id, apply)
+
+    def _iter_runs(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                run_id = name[:-5]
+                try:
+                    run = self.get(run_id)
+                except ValueError:
+                    continue
+                if run is not None:
+                    yield run_id, run
+
+    def active_run_ids(self):
+        return [run_id for run_id, run in self._iter_runs() if run['status'] in ACTIVE_STATUSES]
+
+    def gc(self):
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for run_id, run in list(self._iter_runs()):
+            if run.get('finished_at') is not None and run['finished_at'] < cutoff:
+                self.delete(run_id)
+                removed += 1
+        return removed
+
+
+def create_run_store(kind=AGENT_RUN_STORE, path=AGENT_RUN_STORE_PATH):
+    """按配置创建运行状态存储：memory、sqlite 或 file"""
+    cache_dir = os.path.join(BASE_DIR, "data", ".cache")
+    if kind == 'sqlite':
+        return SQLiteRunStore(path or os.path.join(cache_dir, "agent_runs.sqlite3"))
+    if kind == 'file':
+        return FileRunStore(path or os.path.join(cache_dir, "agent_runs"))
+    if kind != 'memory':
+        logger.warning(f"Unknown AGENT_RUN_STORE '{kind}', falling back to memory")
+    return MemoryRunStore(spill_dir=AGENT_LOG_SPILL_DIR or os.path.join(cache_dir, "agent_logs"))
+
+
+# 进程内共享的运行状态存储
+run_store = create_run_store()
@@ -0,0 +1,197 @@
+import bisect
+import itertools
+from concurrent.futures import Future
+import threading
+import logging
+from .config import (
+    _thread_local, _current_run, AGENT_EXECUTION_BACKEND, AGENT_MAX_WORKERS, AGENT_MAX_QUEUE,
+    AGENT_USER_CONCURRENCY, AGENT_USER_MAX_PENDING, AGENT_ASYNC_MAX_RUNS,
+)
+from .run_store import run_store, QUEUED, RUNNING
+
+logger = logging.getLogger('crewai_agent')
+
+# 优先级：数值越小越先执行，同优先级按提交顺序（FIFO）
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class RunRejected(Exception):
+    """准入控制拒绝了新的运行（队列已满或用户的运行数已达上限）"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Job:
+    __slots__ = ('sort_key', 'run_id', 'user', 'target')
+
+    def __init__(self, sort_key, run_id, user, target):
+        self.sort_key = sort_key
+        self.run_id = run_id
+        self.user = user
+        self.target = target
+
+    def __lt__(self, other):
+        return self.sort_key < other.sort_key
+
+
+class AgentRunScheduler:
+    """
+    智能体运行调度器。
+    固定数量的 worker 线程从优先级队列中取任务执行，代替每个请求一个线程：
+    - max_workers 是 worker 线程数；
+    - max_running 限制同时执行的 crew 数量，默认等于 max_workers。任务返回 Future 时（async 模式），
+      worker 不等待它结束就继续分派，名额在 Future 完成时释放，少量线程即可支撑大量并发运行；
+    - max_queue 限制排队长度，超出时拒绝新任务；
+    - user_concurrency 限制同一用户同时执行的任务数，超出的任务留在队列中，不阻塞其他用户；
+    - user_max_pending 限制同一用户排队加执行中的任务总数。
+    """
+    def __init__(self, max_workers=AGENT_MAX_WORKERS, max_queue=AGENT_MAX_QUEUE,
+                 user_concurrency=AGENT_USER_CONCURRENCY, user_max_pending=AGENT_USER_MAX_PENDING,
+                 max_running=None):
+        self.max_workers = max_workers
+        self.max_running = max_running or max_workers
+        self.max_queue = max_queue
+        self.user_concurrency = user_concurrency
+        self.user_max_pending = user_max_pending
+        self._cond = threading.Condition()
+        self._queue = []
+        self._running = {}
+        self._user_running = {}
+        self._user_pending = {}
+        self._seq = itertools.count()
+        self._workers = []
+
+    def _ensure_workers(self):
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker, name=f"agent-worker-{len(self._workers)}", daemon=True
+            )
+            self._workers.append(worker)
+            worker.start()
+
+    def _check_admission_locked(self, user):
+        if len(self._queue) >= self.max_queue:
+            raise RunRejected("当前排队任务过多，请稍后再试", retry_after=30)
+        if user is not None and self._user_pending.get(user, 0) >= self.user_max_pending:
+            raise RunRejected(f"您已有 {self.user_max_pending} 个任务在运行或排队，请等待完成后再试", retry_after=10)
+
+    def check_admission(self, user=None):
+        """预先检查是否会被拒绝，便于在写入数据库之前返回错误；submit 时仍会再次检查"""
+        with self._cond:
+            self._check_admission_locked(user)
+
+    def submit(self, run_id, target, user=None, priority=PRIORITY_NORMAL):
+        """把运行放入队列，返回排队位置（从 1 开始）；被拒绝时抛出 RunRejected"""
+        with self._cond:
+            self._check_admission_locked(user)
+            job = _Job((priority, next(self._seq)), run_id, user, target)
+            bisect.insort(self._queue, job)
+            if user is not None:
+                self._user_pending[user] = self._user_pending.get(user, 0) + 1
+            self._ensure_workers()
+            self._cond.notify()
+            return self._position_locked(run_id)
+
+    def cancel(self, run_id):
+        """从队列中移除尚未开始的运行，已开始或不存在时返回 False"""
+        with self._cond:
+            for index, job in enumerate(self._queue):
+                if job.run_id == run_id:
+                    del self._queue[index]
+                    self._finish_user_locked(job.user, started=False)
+                    self._cond.notify_all()
+                    return True
+        return False
+
+    def _position_locked(self, run_id):
+        # 被用户并发上限挡住的任务仍按队列顺序计算位置
+        for index, job in enumerate(self._queue):
+            if job.run_id == run_id:
+                return index + 1
+        return None
+
+    def queue_position(self, run_id):
+        """排队位置（从 1 开始），不在队列中时返回 None"""
+        with self._cond:
+            return self._position_locked(run_id)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.max_workers,
+                'max_running': self.max_running,
+                'running': len(self._running),
+                'queued': len(self._queue),
+            }
+
+    def _next_job_locked(self):
+        """按优先级取第一个所属用户未达到并发上限的任务"""
+        if len(self._running) >= self.max_running:
+            return None
+        for index, job in enumerate(self._queue):
+            if job.user is None or self._user_running.get(job.user, 0) < self.user_concurrency:
+                del self._queue[index]
+                return job
+        return None
+
+    def _finish_user_locked(self, user, started):
+        if user is None:
+            return
+        if started:
+            self._user_running[user] -= 1
+            if not self._user_running[user]:
+                del self._user_running[user]
+        self._user_pending[user] -= 1
+        if not self._user_pending[user]:
+            del self._user_pending[user]
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job_locked()
+                self._running[job.run_id] = job
+                if job.user is not None:
+                    self._user_running[job.user] = self._user_running.get(job.user, 0) + 1
+
+            outcome = None
+            try:
+                # 排队期间被停止的任务直接跳过
+                if run_store.transition(job.run_id, (QUEUED,), status=RUNNING):
+                    outcome = job.target()
+            except Exception as e:
+                logger.error(f"Unhandled error in agent run {job.run_id}: {e}", exc_info=True)
+            finally:
+                # worker 线程会被复用，清除上一次运行绑定的 run_id，避免后续输出被记到旧运行上
+                _thread_local.run_id = None
+                _current_run.set(None)
+
+            if isinstance(outcome, Future):
+                outcome.add_done_callback(lambda future, job=job: self._job_done(job, future))
+            else:
+                self._release(job)
+
+    def _job_done(self, job, future):
+        if not future.cancelled() and future.exception() is not None:
+            e = future.exception()
+            logger.error(f"Unhandled error in agent run {job.run_id}: {e}", exc_info=e)
+        self._release(job)
+
+    def _release(self, job):
+        with self._cond:
+            self._running.pop(job.run_id, None)
+            self._finish_user_locked(job.user, started=True)
+            # 执行名额或用户并发名额释放后，被挡住的任务可能可以执行了
+            self._cond.notify_all()
+
+
+# 进程内共享的调度器；async 模式下运行不占用 worker 线程，一个线程负责分派即可
+if AGENT_EXECUTION_BACKEND == 'async':
+    agent_scheduler = AgentRunScheduler(max_workers=1, max_running=AGENT_ASYNC_MAX_RUNS)
+else:
+    agent_scheduler = AgentRunScheduler()
@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+# crewai_agent.config 在导入时创建 LLM 客户端并读取缓存目录，测试使用占位密钥和临时目录
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+os.environ.setdefault('KB_CACHE_DIR', tempfile.mkdtemp(prefix='kb-cache-'))
+os.environ.setdefault('AGENT_LOG_SPILL_DIR', tempfile.mkdtemp(prefix='agent-logs-'))
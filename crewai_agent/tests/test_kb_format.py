@@ -0,0 +1,50 @@
+import unittest
+
+from crewai_agent.utils.kb_format import format_cell, format_hits
+
+
+def make_hits(count, row, source='a.csv', mode='keyword'):
+    return [{'source': source, 'mode': mode, 'score': 1.0, 'row': dict(row)} for _ in range(count)]
+
+
+class FormatCellTests(unittest.TestCase):
+    def test_collapses_whitespace_and_truncates(self):
+        self.assertEqual(format_cell("a \n b\tc"), "a b c")
+        self.assertEqual(format_cell("x" * 10, max_chars=5), "xxxx…")
+
+
+class FormatHitsTests(unittest.TestCase):
+    def test_kv_lines_skip_missing_values(self):
+        output = format_hits(make_hits(1, {'name': 'foo', 'note': float('nan')}), style='kv')
+        self.assertEqual(output, "[a.csv · keyword] name: foo")
+
+    def test_tsv_groups_rows_under_one_header_per_source(self):
+        hits = make_hits(2, {'name': 'foo', 'count': 1}) + make_hits(1, {'id': 7}, source='b.csv')
+        self.assertEqual(format_hits(hits, style='tsv').splitlines(), [
+            "# a.csv (keyword)", "name\tcount", "foo\t1", "foo\t1",
+            "# b.csv (keyword)", "id", "7",
+        ])
+
+    def test_omits_rows_beyond_budget(self):
+        output = format_hits(make_hits(50, {'name': 'x' * 50}), style='kv', max_chars=500)
+        self.assertLessEqual(len(output), 500)
+        self.assertRegex(output.splitlines()[-1], r"^\.\.\. \d+ more rows omitted$")
+
+    def test_budget_is_a_hard_limit(self):
+        wide = {f'column_{i}': 'v' * 150 for i in range(10)}
+        long_header = {f'a_very_long_column_name_{i}': 1 for i in range(40)}
+        for style in ('kv', 'tsv'):
+            for row in (wide, long_header):
+                for max_chars in (100, 300, 1000):
+                    with self.subTest(style=style, max_chars=max_chars, columns=len(row)):
+                        output = format_hits(make_hits(3, row), style=style, max_chars=max_chars, max_cell_chars=200)
+                        self.assertLessEqual(len(output), max_chars)
+
+    def test_tsv_falls_back_to_kv_when_header_exceeds_budget(self):
+        row = {f'a_very_long_column_name_{i}': 1 for i in range(40)}
+        output = format_hits(make_hits(2, row), style='tsv', max_chars=300)
+        self.assertTrue(output.startswith("[a.csv · keyword] "))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from crewai_agent.utils.kb_index import tokenize, get_csv_index, invalidate_csv_index, remove_bm25_cache, BM25Index
+
+
+class KnowledgeIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def make_index(self, content, name='hosts.csv'):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        self.addCleanup(invalidate_csv_index, path)
+        self.addCleanup(remove_bm25_cache, path)
+        return get_csv_index(path)
+
+
+class TokenizeTests(unittest.TestCase):
+    def test_splits_words_and_cjk_bigrams(self):
+        self.assertEqual(tokenize('Error 500 超时'), ['error', '500', '超', '时', '超时'])
+
+
+class SearchTests(KnowledgeIndexTestCase):
+    HOSTS = (
+        "host_id,hostname,role\n"
+        "1,prod-srv-012,web server\n"
+        "2,prod-db-001,database\n"
+        "3,stage-srv-020,web server for staging\n"
+    )
+
+    def test_bm25_ranks_rows_with_more_matching_terms_first(self):
+        index = self.make_index(self.HOSTS)
+        hits = index.search('web staging', 10)
+        self.assertEqual([row_id for row_id, _ in hits], [2, 0])
+        self.assertGreater(hits[0][1], hits[1][1])
+
+    def test_bm25_respects_top_k(self):
+        index = self.make_index(self.HOSTS)
+        self.assertEqual(len(index.search('prod', 1)), 1)
+
+    def test_falls_back_to_substring_match(self):
+        index = self.make_index(self.HOSTS)
+        # rv-01 切出的词条都不完整，BM25 没有结果
+        self.assertEqual(index.bm25.search('rv-01', 10), [])
+        self.assertEqual([row_id for row_id, _ in index.search('rv-01', 10)], [0])
+
+    def test_substring_matches_fill_after_bm25_hits(self):
+        index = self.make_index(self.HOSTS)
+        # BM25 只命中 database 行，prod-srv-012 由子串匹配补在其后
+        self.assertEqual([row_id for row_id, _ in index.bm25.search('database rv-01', 10)], [1])
+        self.assertEqual([row_id for row_id, _ in index.search('database rv-01', 10)], [1, 0])
+        self.assertEqual([row_id for row_id, _ in index.search('database rv-01', 1)], [1])
+
+    def test_substring_match_is_case_insensitive_and_skips_id_columns(self):
+        index = self.make_index(self.HOSTS)
+        self.assertEqual([row_id for row_id, _ in index.substring_search('DB-0', 10)], [1])
+        # host_id 列不参与检索
+        self.assertEqual(index.substring_search('3', 10), [])
+
+    def test_no_match_returns_empty(self):
+        index = self.make_index(self.HOSTS)
+        self.assertEqual(index.search('nothing-like-this', 10), [])
+
+
+class LookupTests(KnowledgeIndexTestCase):
+    def test_exact_lookup_ignores_case(self):
+        index = self.make_index(SearchTests.HOSTS)
+        self.assertEqual(index.lookup('PROD-DB-001'), [1])
+        self.assertEqual(index.lookup('prod-db'), [])
+
+
+class BM25CacheTests(KnowledgeIndexTestCase):
+    def test_cache_is_reused_and_removed(self):
+        index = self.make_index("name\nalpha\nbeta\n")
+        index.search('alpha', 5)
+        loaded = BM25Index.load(index.path, index.signature)
+        self.assertIsNotNone(loaded)
+        self.assertEqual(loaded.search('alpha', 5), index.search('alpha', 5))
+
+        remove_bm25_cache(index.path)
+        self.assertIsNone(BM25Index.load(index.path, index.signature))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from crewai_agent.utils import kb_ingest
+from crewai_agent.utils.kb_ingest import ingest_upload, IngestError
+
+
+class FakeUpload:
+    """模拟 Django 的 UploadedFile：size 和按块读取"""
+    def __init__(self, data, chunk_size=7):
+        self.data = data
+        self.size = len(data)
+        self.chunk_size = chunk_size
+
+    def chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+
+class IngestUploadTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.dest = os.path.join(self.directory, 'data.csv')
+
+    def test_ingests_rows_and_stats(self):
+        result = ingest_upload(FakeUpload(b'name,count\nfoo,1\nbar,2\n'), self.dest)
+        self.assertEqual(result['rows'], 2)
+        self.assertEqual(result['columns'], ['name', 'count'])
+        self.assertEqual(result['stats']['count']['max'], 2)
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), b'name,count\nfoo,1\nbar,2\n')
+
+    def test_rejects_extra_fields_at_chunk_boundary(self):
+        with open(self.dest, 'wb') as f:
+            f.write(b'a,b\n0,0\n')
+        data = b'a,b\n1,2\n3,4\n5,6\n7,8,9,10\n'
+        # 字段过多的行恰好是第二个分块的第一行
+        with mock.patch.object(kb_ingest, 'KB_INGEST_CHUNK_ROWS', 3):
+            with self.assertRaises(IngestError) as raised:
+                ingest_upload(FakeUpload(data), self.dest)
+        self.assertIn('第 5 行', str(raised.exception))
+        # 校验失败时原有文件保持不变，也不留下临时文件
+        with open(self.dest, 'rb') as f:
+            self.assertEqual(f.read(), b'a,b\n0,0\n')
+        self.assertEqual(os.listdir(self.directory), ['data.csv'])
+
+    def test_rejects_extra_fields_inside_chunk(self):
+        with self.assertRaises(IngestError):
+            ingest_upload(FakeUpload(b'a,b\n1,2\n3,4,5\n'), self.dest)
+
+    def test_allows_quoted_delimiters_and_newlines(self):
+        result = ingest_upload(FakeUpload(b'a,b\n"x,y","line1\nline2"\n3,4\n'), self.dest)
+        self.assertEqual(result['rows'], 2)
+
+    def test_rejects_empty_file(self):
+        with self.assertRaises(IngestError):
+            ingest_upload(FakeUpload(b''), self.dest)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import threading
+import unittest
+
+from crewai_agent.config import current_run_id
+from crewai_agent.utils.logging import DEFAULT_BOX_TITLE, BoxLogParser, RunContextExecutor, bind_run, unbind_run
+
+BOX = (
+    "╭──────────── 🤖 Agent Started ────────────╮\n"
+    "│                                         │\n"
+    "│  Agent: 日志分析师                        │\n"
+    "│  Task: 查询错误日志                       │\n"
+    "│                                         │\n"
+    "╰─────────────────────────────────────────╯\n"
+)
+
+
+def feed_all(chunks):
+    parser = BoxLogParser()
+    records = []
+    for chunk in chunks:
+        records.extend(parser.feed(chunk))
+    return records
+
+
+class BoxLogParserTests(unittest.TestCase):
+    expected = [("Agent Started", "Agent: 日志分析师\nTask: 查询错误日志")]
+
+    def test_parses_box(self):
+        self.assertEqual(feed_all([BOX]), self.expected)
+
+    def test_split_at_every_character(self):
+        self.assertEqual(feed_all(list(BOX)), self.expected)
+
+    def test_bottom_border_without_newline(self):
+        self.assertEqual(feed_all([BOX.rstrip("\n")]), self.expected)
+
+    def test_strips_ansi_escapes(self):
+        colored = BOX.replace("Agent: ", "\x1b[1m\x1b[95mAgent: \x1b[00m")
+        self.assertEqual(feed_all([colored]), self.expected)
+
+    def test_ignores_text_outside_boxes(self):
+        records = feed_all(["noise before\n", BOX, "noise between\n", BOX.replace("查询", "统计")])
+        self.assertEqual([content for _, content in records],
+                         ["Agent: 日志分析师\nTask: 查询错误日志", "Agent: 日志分析师\nTask: 统计错误日志"])
+
+    def test_untitled_and_empty_boxes(self):
+        untitled = "╭─────────╮\n│ body │\n╰─────────╯\n"
+        empty = "╭── Empty ──╮\n│          │\n╰──────────╯\n"
+        self.assertEqual(feed_all([untitled, empty]), [(DEFAULT_BOX_TITLE, "body")])
+
+    def test_drops_progress_lines(self):
+        box = "╭── Tree ──╮\n│ 🚀 Crew: crew │\n│ 📋 Task: x │\n│ kept │\n╰──────────╯\n"
+        self.assertEqual(feed_all([box]), [("Tree", "kept")])
+
+
+class RunContextExecutorTests(unittest.TestCase):
+    def test_tasks_see_submitters_run(self):
+        executor = RunContextExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+
+        def bound(run_id):
+            bind_run(run_id)
+            try:
+                return executor.submit(current_run_id).result()
+            finally:
+                unbind_run(run_id)
+
+        self.assertEqual(bound('run-a'), 'run-a')
+        self.assertEqual(bound('run-b'), 'run-b')
+        # worker 复用后不残留上一个运行
+        self.assertIsNone(executor.submit(current_run_id).result())
+
+    def test_plain_threads_are_not_bound(self):
+        bind_run('run-a')
+        self.addCleanup(unbind_run, 'run-a')
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(current_run_id()))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,233 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from crewai_agent import run_store as run_store_module
+from crewai_agent.run_store import (
+    COMPLETED, ERROR, QUEUED, RUNNING, WAITING, FileRunStore, MemoryRunStore, SQLiteRunStore, SpilledLog,
+)
+
+# 测试中不需要后台清理线程
+STORE_KWARGS = dict(ttl=60, gc_interval=3600, suspend_timeout=60)
+
+
+class RunStoreContract:
+    """三种存储共同遵守的接口约定，子类实现 make_store"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='run-store-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.store = self.make_store()
+
+    def test_create_and_get(self):
+        self.store.create('run1', session_id=3)
+        run = self.store.get('run1')
+        self.assertEqual(run['status'], QUEUED)
+        self.assertEqual(run['session_id'], 3)
+        self.assertIn('updated_at', run)
+        self.assertIsNone(self.store.get('missing'))
+
+    def test_transition_is_compare_and_swap(self):
+        self.store.create('run1')
+        self.assertTrue(self.store.transition('run1', (QUEUED,), status=RUNNING))
+        self.assertFalse(self.store.transition('run1', (QUEUED,), status=RUNNING))
+        self.assertFalse(self.store.transition('missing', None, status=RUNNING))
+        self.assertTrue(self.store.update('run1', status=COMPLETED, result='ok'))
+        run = self.store.get('run1')
+        self.assertEqual((run['status'], run['result']), (COMPLETED, 'ok'))
+        self.assertIsNotNone(run['finished_at'])
+
+    def test_logs_are_numbered_and_paged(self):
+        self.store.create('run1')
+        seqs = [self.store.append_log('run1', {'content': i}) for i in range(10)]
+        self.assertEqual(seqs, list(range(1, 11)))
+        self.assertIsNone(self.store.append_log('missing', {'content': 0}))
+        self.assertEqual([e['content'] for e in self.store.get_logs('run1', since=7)], [7, 8, 9])
+        self.assertEqual([e['content'] for e in self.store.get_logs('run1', since=2, limit=3)], [2, 3, 4])
+        self.assertEqual(self.store.get_logs('run1', since=10), [])
+        self.assertEqual([e['content'] for e in self.store.iter_logs('run1', page_size=3)], list(range(10)))
+
+    def test_recreate_resets_logs(self):
+        self.store.create('run1')
+        self.store.append_log('run1', {'content': 'old'})
+        self.store.create('run1')
+        self.assertEqual(self.store.get_logs('run1'), [])
+        self.assertEqual(self.store.append_log('run1', {'content': 'new'}), 1)
+
+    def test_delete(self):
+        self.store.create('run1')
+        self.store.append_log('run1', {'content': 'x'})
+        self.store.delete('run1')
+        self.assertIsNone(self.store.get('run1'))
+        self.assertEqual(self.store.get_logs('run1'), [])
+
+    def test_active_run_ids(self):
+        for run_id, status in (('a', QUEUED), ('b', RUNNING), ('c', WAITING), ('d', COMPLETED)):
+            self.store.create(run_id, status=status)
+        self.assertEqual(sorted(self.store.active_run_ids()), ['a', 'b', 'c'])
+
+    def test_gc_removes_runs_finished_before_ttl(self):
+        self.store.create('old')
+        self.store.create('recent')
+        self.store.create('active')
+        with mock.patch.object(run_store_module.time, 'time', return_value=time.time() - 120):
+            self.store.update('old', status=COMPLETED)
+        self.store.update('recent', status=COMPLETED)
+        self.assertEqual(self.store.gc(), 1)
+        self.assertIsNone(self.store.get('old'))
+        self.assertIsNotNone(self.store.get('recent'))
+        self.assertIsNotNone(self.store.get('active'))
+
+    def test_expire_suspended(self):
+        self.store.create('stale', status=WAITING, checkpoint={'query': 'q'})
+        self.store.create('fresh', status=WAITING, checkpoint={'query': 'q'})
+        with mock.patch.object(run_store_module.time, 'time', return_value=time.time() - 120):
+            self.store.update('stale', prompt='waiting')
+        self.assertEqual(self.store.expire_suspended(), 1)
+        self.assertEqual(self.store.get_status('stale'), ERROR)
+        self.assertEqual(self.store.get_status('fresh'), WAITING)
+
+    def test_wait_for(self):
+        self.store.create('run1', status=RUNNING)
+        self.assertIsNone(self.store.wait_for('run1', lambda run: run['status'] == COMPLETED, timeout=0.05))
+        self.store.update('run1', status=COMPLETED)
+        self.assertEqual(self.store.wait_for('run1', lambda run: run['status'] == COMPLETED, timeout=1)['status'], COMPLETED)
+
+
+class MemoryRunStoreTests(RunStoreContract, unittest.TestCase):
+    def make_store(self):
+        return MemoryRunStore(spill_dir=self.directory, memory_entries=4, **STORE_KWARGS)
+
+    def spill_files(self):
+        return [name for name in os.listdir(self.directory) if name.endswith('.jsonl.gz')]
+
+    def test_older_logs_spill_to_disk(self):
+        self.store.create('run1')
+        for i in range(25):
+            self.store.append_log('run1', {'content': i})
+        log = self.store._logs['run1']
+        self.assertLessEqual(len(log.recent), 5)
+        self.assertGreater(log.spilled, 0)
+        self.assertEqual(len(self.spill_files()), 1)
+        self.assertEqual([e['content'] for e in self.store.get_logs('run1')], list(range(25)))
+        # 跨越落盘和内存边界的分页
+        for since in range(25):
+            with self.subTest(since=since):
+                self.assertEqual([e['content'] for e in self.store.get_logs('run1', since=since, limit=3)],
+                                 list(range(since, min(since + 3, 25))))
+
+    def test_delete_removes_spill_file(self):
+        self.store.create('run1')
+        for i in range(10):
+            self.store.append_log('run1', {'content': i})
+        self.store.delete('run1')
+        self.assertEqual(self.spill_files(), [])
+
+    def test_invalid_run_id_stays_in_memory(self):
+        self.store.create('../escape')
+        for i in range(10):
+            self.store.append_log('../escape', {'content': i})
+        self.assertEqual(self.spill_files(), [])
+        self.assertEqual(len(self.store.get_logs('../escape')), 10)
+
+
+class SpilledLogTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='spilled-log-')
+        self.addCleanup(shutil.rmtree, self.directory, True)
+        self.log = SpilledLog(os.path.join(self.directory, 'run.jsonl.gz'), capacity=4)
+
+    def append(self, entry):
+        batch = self.log.append(entry)
+        if batch:
+            self.assertTrue(self.log.publish(len(batch), self.log.write_batch(batch)))
+
+    def test_members_are_read_by_range(self):
+        for i in range(20):
+            self.append(i)
+        self.assertGreater(len(self.log._members), 1)
+        self.assertEqual(self.log.read_spilled(0, self.log.spilled), list(range(self.log.spilled)))
+        self.assertEqual(self.log.read_spilled(3, 5), [3, 4])
+
+    def test_failed_write_keeps_entries_in_memory(self):
+        for i in range(4):
+            self.log.append(i)
+        batch = self.log.append(4)
+        self.assertTrue(self.log.publish(len(batch), None))
+        self.assertEqual(self.log.spilled, 0)
+        self.assertEqual(list(self.log.recent), [0, 1, 2, 3, 4])
+
+    def test_publish_after_discard(self):
+        for i in range(4):
+            self.log.append(i)
+        batch = self.log.append(4)
+        offset = self.log.write_batch(batch)
+        self.log.discard()
+        self.assertFalse(self.log.publish(len(batch), offset))
+
+
+class SQLiteRunStoreTests(RunStoreContract, unittest.TestCase):
+    def make_store(self):
+        return SQLiteRunStore(os.path.join(self.directory, 'runs.sqlite3'), **STORE_KWARGS)
+
+    def test_shared_between_instances(self):
+        self.store.create('run1')
+        self.store.append_log('run1', {'content': 'x'})
+        other = self.make_store()
+        self.assertEqual(other.get_status('run1'), QUEUED)
+        self.assertEqual(other.append_log('run1', {'content': 'y'}), 2)
+
+
+class FileRunStoreTests(RunStoreContract, unittest.TestCase):
+    def make_store(self):
+        return FileRunStore(self.directory, **STORE_KWARGS)
+
+    def test_offset_index_is_used_for_paging(self):
+        count = run_store_module.LOG_INDEX_STRIDE * 3 + 5
+        self.store.create('run1')
+        for i in range(count):
+            self.store.append_log('run1', {'content': i})
+        index_path = os.path.join(self.directory, 'run1.log.jsonl.idx')
+        self.assertEqual(os.path.getsize(index_path), 3 * run_store_module._OFFSET.size)
+        for since in (0, 63, 64, 65, 130, count - 1):
+            with self.subTest(since=since):
+                self.assertEqual([e['content'] for e in self.store.get_logs('run1', since=since, limit=2)],
+                                 list(range(since, min(since + 2, count))))
+
+    def test_partial_line_is_overwritten(self):
+        self.store.create('run1')
+        self.store.append_log('run1', {'content': 0})
+        with open(os.path.join(self.directory, 'run1.log.jsonl'), 'ab') as f:
+            f.write(b'{"content": ')
+        self.assertEqual(len(self.store.get_logs('run1')), 1)
+        self.assertEqual(self.store.append_log('run1', {'content': 1}), 2)
+        self.assertEqual([e['content'] for e in self.store.get_logs('run1')], [0, 1])
+
+    def test_rebuilds_missing_index(self):
+        stride = run_store_module.LOG_INDEX_STRIDE
+        self.store.create('run1')
+        for i in range(stride * 2 + 1):
+            self.store.append_log('run1', {'content': i})
+        index_path = os.path.join(self.directory, 'run1.log.jsonl.idx')
+        os.remove(index_path)
+        self.store.append_log('run1', {'content': stride * 2 + 1})
+        self.assertEqual(os.path.getsize(index_path), 2 * run_store_module._OFFSET.size)
+        self.assertEqual(self.store.get_logs('run1', since=stride * 2, limit=1)[0]['content'], stride * 2)
+
+    def test_delete_removes_all_files(self):
+        self.store.create('run1')
+        self.store.append_log('run1', {'content': 'x'})
+        self.store.delete('run1')
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_rejects_invalid_run_id(self):
+        self.store.create('../escape')
+        self.assertIsNone(self.store.get('../escape'))
+        self.assertIsNone(self.store.append_log('../escape', {'content': 'x'}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import threading
+import unittest
+from concurrent.futures import Future
+from unittest import mock
+
+from crewai_agent import scheduler as scheduler_module
+from crewai_agent.run_store import COMPLETED, QUEUED, RUNNING, STOPPED, MemoryRunStore
+from crewai_agent.scheduler import PRIORITY_HIGH, PRIORITY_LOW, AgentRunScheduler, RunRejected
+
+TIMEOUT = 5
+
+
+class SchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = MemoryRunStore(gc_interval=3600)
+        patcher = mock.patch.object(scheduler_module, 'run_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.started = []
+        self.gates = {}
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+
+    def job(self, run_id):
+        """返回一个记录开始顺序、直到 release(run_id) 才结束的任务"""
+        self.store.create(run_id)
+        gate = self.gates[run_id] = threading.Event()
+
+        def target():
+            with self.changed:
+                self.started.append(run_id)
+                self.changed.notify_all()
+            gate.wait(TIMEOUT)
+            self.store.update(run_id, status=COMPLETED)
+        return target
+
+    def release(self, run_id):
+        self.gates[run_id].set()
+
+    def wait_started(self, count):
+        with self.changed:
+            self.assertTrue(self.changed.wait_for(lambda: len(self.started) >= count, TIMEOUT), self.started)
+            return list(self.started)
+
+    def release_all(self):
+        for gate in self.gates.values():
+            gate.set()
+
+
+class AdmissionTests(SchedulerTestCase):
+    def test_rejects_when_queue_is_full(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_queue=2, user_concurrency=5, user_max_pending=5)
+        self.addCleanup(self.release_all)
+        scheduler.submit('running', self.job('running'))
+        self.wait_started(1)
+        self.assertEqual(scheduler.submit('q1', self.job('q1')), 1)
+        self.assertEqual(scheduler.submit('q2', self.job('q2')), 2)
+        with self.assertRaises(RunRejected) as ctx:
+            scheduler.check_admission()
+        self.assertEqual(ctx.exception.retry_after, 30)
+        with self.assertRaises(RunRejected):
+            scheduler.submit('q3', self.job('q3'))
+        self.assertEqual(scheduler.stats()['queued'], 2)
+
+    def test_rejects_user_over_pending_limit(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_queue=10, user_concurrency=1, user_max_pending=2)
+        self.addCleanup(self.release_all)
+        scheduler.submit('a1', self.job('a1'), user='alice')
+        scheduler.submit('a2', self.job('a2'), user='alice')
+        with self.assertRaises(RunRejected) as ctx:
+            scheduler.submit('a3', self.job('a3'), user='alice')
+        self.assertEqual(ctx.exception.retry_after, 10)
+        # 其他用户不受影响
+        scheduler.check_admission('bob')
+        scheduler.submit('b1', self.job('b1'), user='bob')
+
+    def test_pending_count_is_released_when_runs_finish(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_queue=10, user_concurrency=1, user_max_pending=1)
+        scheduler.submit('a1', self.job('a1'), user='alice')
+        self.wait_started(1)
+        with self.assertRaises(RunRejected):
+            scheduler.check_admission('alice')
+        self.release('a1')
+        self.store.wait_for('a1', lambda run: run['status'] == COMPLETED, TIMEOUT)
+        with scheduler._cond:
+            self.assertTrue(scheduler._cond.wait_for(lambda: 'alice' not in scheduler._user_pending, TIMEOUT))
+        scheduler.check_admission('alice')
+
+
+class DispatchTests(SchedulerTestCase):
+    def test_priority_then_fifo(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_queue=10)
+        self.addCleanup(self.release_all)
+        scheduler.submit('first', self.job('first'))
+        self.wait_started(1)
+        scheduler.submit('low', self.job('low'), priority=PRIORITY_LOW)
+        scheduler.submit('normal1', self.job('normal1'))
+        scheduler.submit('high', self.job('high'), priority=PRIORITY_HIGH)
+        scheduler.submit('normal2', self.job('normal2'))
+        self.assertEqual([scheduler.queue_position(run_id) for run_id in ('high', 'normal1', 'normal2', 'low')],
+                         [1, 2, 3, 4])
+        self.assertIsNone(scheduler.queue_position('first'))
+        self.release_all()
+        self.assertEqual(self.wait_started(5), ['first', 'high', 'normal1', 'normal2', 'low'])
+
+    def test_user_concurrency_does_not_block_other_users(self):
+        scheduler = AgentRunScheduler(max_workers=2, max_queue=10, user_concurrency=1, user_max_pending=5)
+        self.addCleanup(self.release_all)
+        scheduler.submit('a1', self.job('a1'), user='alice')
+        scheduler.submit('a2', self.job('a2'), user='alice')
+        scheduler.submit('b1', self.job('b1'), user='bob')
+        self.assertEqual(self.wait_started(2), ['a1', 'b1'])
+        self.assertEqual(scheduler.queue_position('a2'), 1)
+        self.release('a1')
+        self.assertEqual(self.wait_started(3)[-1], 'a2')
+
+    def test_cancel_removes_queued_run(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_queue=10, user_concurrency=1, user_max_pending=2)
+        self.addCleanup(self.release_all)
+        scheduler.submit('a1', self.job('a1'), user='alice')
+        self.wait_started(1)
+        scheduler.submit('a2', self.job('a2'), user='alice')
+        self.assertTrue(scheduler.cancel('a2'))
+        self.assertFalse(scheduler.cancel('a2'))
+        self.assertFalse(scheduler.cancel('a1'))
+        self.assertIsNone(scheduler.queue_position('a2'))
+        scheduler.check_admission('alice')
+
+    def test_skips_runs_stopped_while_queued(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_queue=10)
+        self.addCleanup(self.release_all)
+        scheduler.submit('first', self.job('first'))
+        self.wait_started(1)
+        scheduler.submit('stopped', self.job('stopped'))
+        scheduler.submit('last', self.job('last'))
+        self.store.transition('stopped', (QUEUED,), status=STOPPED)
+        self.release('first')
+        self.assertEqual(self.wait_started(2), ['first', 'last'])
+        self.assertEqual(self.store.get_status('stopped'), STOPPED)
+
+    def test_future_holds_running_slot_until_done(self):
+        scheduler = AgentRunScheduler(max_workers=1, max_running=1, max_queue=10)
+        future = Future()
+        self.store.create('async')
+        scheduler.submit('async', lambda: future)
+        self.store.wait_for('async', lambda run: run['status'] == RUNNING, TIMEOUT)
+        target = self.job('next')
+        scheduler.submit('next', target)
+        self.assertEqual(scheduler.queue_position('next'), 1)
+        future.set_result(None)
+        self.release('next')
+        self.assertEqual(self.wait_started(1), ['next'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+from crewai.tools import BaseTool
+from ..config import current_run_id
+from ..checkpoint import record_step
+
+
+class AsyncNativeTool(BaseTool):
+    """
+    同时提供 _run 和 _arun 的工具。
+    crewai 的 akickoff 通过 to_structured_tool 生成的函数调用工具，同步函数会被放进线程池执行；
+    async_native=True 时改为直接 await _arun，等待期间不占用线程。
+    每次调用的参数和输出记入当前运行的步骤，挂起时保存在检查点中。
+    """
+    async_native: bool = False
+
+    def to_structured_tool(self):
+        structured_tool = super().to_structured_tool()
+        if self.async_native:
+            async def func(**kwargs):
+                output = await self._arun(**kwargs)
+                self._record(kwargs, output)
+                return output
+        else:
+            def func(**kwargs):
+                output = self._run(**kwargs)
+                self._record(kwargs, output)
+                return output
+        structured_tool.func = func
+        return structured_tool
+
+    def _record(self, kwargs, output):
+        run_id = current_run_id()
+        if run_id:
+            # 只保留工具声明的参数（crewai 可能附带不可序列化的上下文）
+            arguments = {key: value for key, value in kwargs.items() if key in self.args_schema.model_fields}
+            record_step(run_id, self.name, arguments, output)
@@ -1,60 +1,99 @@
 import time
-from crewai.tools import BaseTool
-from ..config import agent_runs, _thread_local, AgentStoppedException
+from ..config import current_run_id, AgentStoppedException, AGENT_HUMAN_INPUT_MODE, AGENT_HUMAN_INPUT_TIMEOUT
+from ..run_store import run_store, RUNNING, WAITING, ERROR, STOPPED
+from ..async_runtime import async_runtime
+from ..checkpoint import AgentSuspended
+from .async_tool import AsyncNativeTool
+
+def _answered(run):
+    return run['status'] == STOPPED or run.get('response') is not None
 
 class HumanInputManager:
     """Manages human input requests from the agent to the web UI."""
     @staticmethod
-    def ask(run_id: str, prompt: str) -> str:
-        if run_id in agent_runs:
-            agent_runs[run_id]["status"] = "waiting"
-            agent_runs[run_id]["prompt"] = prompt
-            agent_runs[run_id]["event"].clear()
-            
-            # Wait for the web UI to provide input with a timeout
-            timeout = 300 # 5 minutes
-            
-            is_set = agent_runs[run_id]["event"].wait(timeout=timeout)
-            
-            # 检查是否因为停止而被唤醒
-            if agent_runs[run_id].get("status") == "stopped":
+    def _begin(run_id: str, prompt: str) -> bool:
+        # 只有运行中的任务可以进入等待状态，同时清掉上一次的回复
+        if not run_store.transition(run_id, (RUNNING,), status=WAITING, prompt=prompt, response=None):
+            if run_store.get_status(run_id) == STOPPED:
                 raise AgentStoppedException("Agent execution stopped by user during human input")
+            return False
+        return True
+
+    @staticmethod
+    def _finish(run_id: str, run) -> str:
+        # 检查是否因为停止而被唤醒
+        if run is not None and run['status'] == STOPPED:
+            raise AgentStoppedException("Agent execution stopped by user during human input")
+
+        if run is None:
+            run_store.transition(run_id, (WAITING,), status=ERROR, result="Human input timeout")
+            return "Error: Human input timeout"
+
+        response = run['response']
+        run_store.transition(run_id, (WAITING,), status=RUNNING, prompt=None, response=None) # Clear for next time
+
+        # 记录人类反馈到日志，以便前端渲染
+        run_store.append_log(run_id, {
+            "title": "人类反馈",
+            "content": response,
+            "timestamp": time.time()
+        })
+
+        return response
+
+    @staticmethod
+    def suspend(run_id: str, prompt: str):
+        """挂起模式：不在这里等待回答，抛出 AgentSuspended 结束本次执行，由执行入口保存检查点"""
+        if run_store.get_status(run_id) == STOPPED:
+            raise AgentStoppedException("Agent execution stopped by user during human input")
+        raise AgentSuspended(prompt)
+
+    @staticmethod
+    def ask(run_id: str, prompt: str) -> str:
+        if not HumanInputManager._begin(run_id, prompt):
+            return "Error: run_id not found"
+
+        # Wait for the web UI to provide input with a timeout
+        run = run_store.wait_for(run_id, _answered, AGENT_HUMAN_INPUT_TIMEOUT)
+        return HumanInputManager._finish(run_id, run)
+
+    @staticmethod
+    async def aask(run_id: str, prompt: str) -> str:
+        """ask 的异步版本：等待期间只挂起当前 task，不占用线程"""
+        if not HumanInputManager._begin(run_id, prompt):
+            return "Error: run_id not found"
+
+        run = await async_runtime.wait_for(run_id, _answered, AGENT_HUMAN_INPUT_TIMEOUT)
+        return HumanInputManager._finish(run_id, run)
 
-            if not is_set:
-                agent_runs[run_id]["status"] = "error"
-                agent_runs[run_id]["result"] = "Human input timeout"
-                return "Error: Human input timeout"
-                
-            agent_runs[run_id]["status"] = "running"
-            agent_runs[run_id]["prompt"] = None
-            response = agent_runs[run_id]["response"]
-            agent_runs[run_id]["response"] = None # Clear for next time
-            
-            # 记录人类反馈到日志，以便前端渲染
-            if "logs" not in agent_runs[run_id]:
-                agent_runs[run_id]["logs"] = []
-            agent_runs[run_id]["logs"].append({
-                "title": "人类反馈",
-                "content": response,
-                "timestamp": time.time()
-            })
-            
-            return response
-        return "Error: run_id not found"
-
-class AskHumanTool(BaseTool):
+class AskHumanTool(AsyncNativeTool):
     name: str = "ask_human"
     description: str = "Use this tool to ask the user a question, get clarification, or request missing information. Use this whenever you are unsure or want to interact with the human."
     run_id: str = None
+    # 运行的执行入口支持从检查点恢复时才挂起，否则阻塞等待回答
+    suspendable: bool = False
+
+    def _should_suspend(self):
+        return self.suspendable and AGENT_HUMAN_INPUT_MODE == 'suspend'
+
+    def _run(self, prompt: str) -> str:
+        # 优先从当前线程绑定的 run_id 获取，防止工具实例属性丢失
+        run_id = current_run_id() or self.run_id
 
-    def _run(self, prompt: str) -> str:        
-        # 优先从线程局部变量获取 run_id，防止工具实例属性丢失
-        run_id = getattr(_thread_local, 'run_id', self.run_id)
-        
         if not run_id:
             # Fallback to standard input if no run_id (e.g. CLI)
             output = input(prompt)
             return output
-            
+
+        if self._should_suspend():
+            HumanInputManager.suspend(run_id, prompt)
         output = HumanInputManager.ask(run_id, prompt)
         return output
+
+    async def _arun(self, prompt: str) -> str:
+        run_id = current_run_id() or self.run_id
+        if not run_id:
+            return "Error: run_id not found"
+        if self._should_suspend():
+            HumanInputManager.suspend(run_id, prompt)
+        return await HumanInputManager.aask(run_id, prompt)
@@ -1,69 +1,36 @@
 import os
-import json
-import re
-import pandas as pd
+import time
+import asyncio
 import logging
-from typing import Optional, Type, Dict, Any
+from itertools import chain, zip_longest
+from concurrent.futures import TimeoutError, wait
+from typing import Optional, Type
 from pydantic import BaseModel, Field
-from crewai.tools import BaseTool
 
 logger = logging.getLogger('crewai_agent')
 
-try:
-    from crewai_tools import CSVSearchTool
-except ImportError:
-    CSVSearchTool = None
-
-from ..config import BASE_DIR, agent_runs, _thread_local, AgentStoppedException
+from ..config import BASE_DIR, KB_TOP_K, KB_SEARCH_WORKERS, KB_SEARCH_TIMEOUT, current_run_id, AgentStoppedException
+from ..run_store import run_store, STOPPED
+from ..utils.kb_index import get_csv_index
+from ..utils.kb_embeddings import get_embedder, embed_query, semantic_search
+from ..utils.kb_format import format_hits
+from ..utils.kb_registry import knowledge_base_registry
+from ..utils.logging import RunContextExecutor
+from .async_tool import AsyncNativeTool
 
 def get_knowledge_base_description():
-    """动态生成知识库工具的描述，包含当前所有 CSV 的元数据"""
-    base_desc = """Search the knowledge base for error codes, troubleshooting steps, and asset information. 
-    You should choose the appropriate source based on the query.
-    Use precise=True when you have an exact ID, error code, or tag name.
-    
-    Current available sources:
-    """
-    
-    data_dir = os.path.join(BASE_DIR, "data")
-    metadata_path = os.path.join(data_dir, "metadata.json")
-    
-    metadata = {}
-    if os.path.exists(metadata_path):
-        try:
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                metadata = json.load(f)
-        except Exception as e:
-            logger.error(f"Error loading metadata for description: {e}")
-
-    # 扫描目录下的所有 CSV
-    if os.path.exists(data_dir):
-        csv_files = [f for f in os.listdir(data_dir) if f.endswith('.csv')]
-        for filename in csv_files:
-            desc_info = metadata.get(filename, "No description provided.")
-            if isinstance(desc_info, dict):
-                desc = desc_info.get("description", "No description provided.")
-                cols = desc_info.get("columns", "")
-                if isinstance(cols, list):
-                    cols = ", ".join(cols)
-                base_desc += f"- {filename}: {desc} (Columns: {cols})\n"
-            else:
-                base_desc += f"- {filename}: {desc_info}\n"
-    else:
-        base_desc += "No CSV sources available yet.\n"
-        
-    return base_desc
+    """知识库工具的描述，包含当前所有 CSV 的元数据（由注册表缓存，元数据变化时自动刷新）"""
+    return knowledge_base_registry.description
 
 class KnowledgeBaseInput(BaseModel):
     query: str = Field(..., description="The search term to look up in the knowledge base.")
     source: Optional[str] = Field(None, description="Optional: Specific CSV file to search in (e.g., 'assets.csv'). If not provided, searches all.")
     precise: bool = Field(False, description="Whether to use precise matching (exact string match) instead of fuzzy matching.")
 
-class KnowledgeBaseTool(BaseTool):
+class KnowledgeBaseTool(AsyncNativeTool):
     name: str = "knowledge_base"
     description: str = get_knowledge_base_description()
     args_schema: Type[BaseModel] = KnowledgeBaseInput
-    _csv_search_tools: Dict[str, Any] = {} # 缓存 CSVSearchTool 实例
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -72,8 +39,8 @@ class KnowledgeBaseTool(BaseTool):
 
     def _run(self, query: str, source: Optional[str] = None, precise: bool = False) -> str:
         # 检查是否已被手动停止
-        run_id = getattr(_thread_local, 'run_id', None)
-        if run_id and agent_runs.get(run_id, {}).get("status") == "stopped":
+        run_id = current_run_id()
+        if run_id and run_store.get_status(run_id) == STOPPED:
             raise AgentStoppedException("Agent execution stopped by user")
 
         try:
@@ -81,89 +48,142 @@ class KnowledgeBaseTool(BaseTool):
             if not os.path.exists(data_dir):
                 return "Error: data directory not found."
             
-            all_results = []
             if source:
                 csv_files = [source] if source.endswith('.csv') else [f"{source}.csv"]
             else:
-                csv_files = [f for f in os.listdir(data_dir) if f.endswith('.csv')]
+                csv_files = knowledge_base_registry.source_names()
             
             if not csv_files:
                 return f"No CSV files found matching '{source}'."
 
-            for filename in csv_files:
-                csv_path = os.path.join(data_dir, filename)
-                if not os.path.exists(csv_path):
-                    continue
-                
-                if precise:
-                    # 【模式 1】精确匹配
-                    try:
-                        df = pd.read_csv(csv_path)
-                        search_cols = [col for col in df.columns if not col.lower().endswith('_id')]
-                        if not search_cols: search_cols = df.columns.tolist()
-                        
-                        mask = pd.Series([False] * len(df))
-                        for col in search_cols:
-                            mask |= df[col].astype(str).str.lower() == str(query).lower()
-                        
-                        result = df[mask]
-                        if not result.empty:
-                            result_copy = result.copy()
-                            result_copy['source_file'] = filename
-                            all_results.append(result_copy.to_string(index=False))
-                    except Exception as e:
-                        logger.error(f"Error in precise search for {filename}: {e}")
-                
-                else:
-                    # 【模式 2】模糊匹配
-                    success_semantic = False
-                    if CSVSearchTool:
-                        try:
-                            if csv_path not in self._csv_search_tools:
-                                self._csv_search_tools[csv_path] = CSVSearchTool(csv=csv_path)
-                            
-                            rag_result = self._csv_search_tools[csv_path]._run(search_query=query)
-                            if rag_result and "Relevant Content" in rag_result:
-                                all_results.append(f"--- Results from {filename} (Semantic Search) ---\n{rag_result}")
-                                success_semantic = True
-                        except Exception as e:
-                            logger.error(f"Semantic search failed for {filename}, falling back to keyword: {e}")
-
-                    if not success_semantic:
-                        try:
-                            df = pd.read_csv(csv_path)
-                            search_cols = [col for col in df.columns if not col.lower().endswith('_id')]
-                            if not search_cols: search_cols = df.columns.tolist()
-                            
-                            mask = pd.Series([False] * len(df))
-                            query_words = str(query).lower().split()
-                            for col in search_cols:
-                                col_data = df[col].astype(str).str.lower()
-                                for word in query_words:
-                                    if len(word) > 1:
-                                        mask |= col_data.str.contains(re.escape(word), na=False)
-                            
-                            result = df[mask]
-                            if not result.empty:
-                                result_copy = result.copy()
-                                result_copy['source_file'] = filename
-                                all_results.append(result_copy.to_string(index=False))
-                        except Exception as e:
-                            logger.error(f"Error in keyword search for {filename}: {e}")
-            
-            if not all_results:
+            csv_files = [f for f in csv_files if os.path.exists(os.path.join(data_dir, f))]
+            results, timed_out = self._fan_out(data_dir, csv_files, query, precise)
+            hits = list(chain.from_iterable(results)) if precise else self._merge_ranked(results)[:KB_TOP_K]
+
+            if not hits:
                 match_type = "precise" if precise else "fuzzy"
-                return f"No {match_type} matches found in {source or 'knowledge base'} for '{query}'."
-            
-            if all(isinstance(r, str) for r in all_results):
-                return "\n\n".join(all_results)
-            else:
-                final_output = ""
-                for r in all_results:
-                    final_output += str(r) + "\n\n"
-                return final_output.strip()
+                message = f"No {match_type} matches found in {source or 'knowledge base'} for '{query}'."
+                if timed_out:
+                    message += f" Search timed out for: {', '.join(timed_out)}."
+                return message
+
+            output = format_hits(hits)
+            if timed_out:
+                output += f"\n\n(Partial results: search timed out for {', '.join(timed_out)})"
+            return output
 
         except Exception as e:
             error_msg = f"Error searching knowledge base: {str(e)}"
             logger.error(f"> 工具执行错误: {error_msg}")
             return error_msg
+
+    async def _arun(self, query: str, source: Optional[str] = None, precise: bool = False) -> str:
+        # 检索是 CPU 和磁盘密集的，放到线程中执行（to_thread 会带上当前运行的上下文）
+        return await asyncio.to_thread(self._run, query, source, precise)
+
+    def _fan_out(self, data_dir, csv_files, query, precise):
+        """
+        在线程池中并发检索各个文件，整体受 KB_SEARCH_TIMEOUT 限制。
+        模糊检索先为每个文件做关键词检索，同时在独立线程池中向量化查询；
+        查询向量按时就绪后再做语义检索，某个文件的语义检索没有在截止时间前完成时使用它的关键词结果。
+        返回 (按文件名排列的各文件命中列表, 超时的文件列表)，超时的文件不影响其他文件的结果。
+        """
+        deadline = time.monotonic() + KB_SEARCH_TIMEOUT
+        paths = {filename: os.path.join(data_dir, filename) for filename in csv_files}
+
+        # 调用向量模型是网络请求，放在独立的线程池中，慢请求不占用检索线程
+        query_future = None
+        if not precise and get_embedder() is not None:
+            query_future = _embed_executor.submit(embed_query, query)
+
+        results, timed_out = self._collect({
+            _search_executor.submit(self._search_file, filename, path, query, precise): filename
+            for filename, path in paths.items()
+        }, deadline)
+        if timed_out:
+            logger.warning(f"Knowledge base search timed out after {KB_SEARCH_TIMEOUT}s for: {timed_out}")
+
+        query_vector = None
+        if query_future is not None:
+            try:
+                query_vector = query_future.result(timeout=max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                logger.warning(f"Query embedding timed out after {KB_SEARCH_TIMEOUT}s, using keyword results")
+            except Exception as e:
+                logger.error(f"Query embedding failed, using keyword results: {e}")
+
+        if query_vector is not None:
+            semantic, late = self._collect({
+                _search_executor.submit(self._semantic_file, filename, paths[filename], query_vector): filename
+                for filename in results
+            }, deadline)
+            if late:
+                logger.warning(f"Semantic search timed out after {KB_SEARCH_TIMEOUT}s, using keyword results for: {late}")
+            for filename, hits in semantic.items():
+                if hits:
+                    results[filename] = hits
+
+        return [results[name] for name in sorted(results)], timed_out
+
+    @staticmethod
+    def _collect(futures, deadline):
+        """等待一批检索任务直到截止时间，返回 ({文件名: 结果}, 未完成的文件列表)"""
+        done, not_done = wait(futures, timeout=max(deadline - time.monotonic(), 0))
+        results = {}
+        for future in done:
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                logger.error(f"Error searching {futures[future]}: {e}")
+        for future in not_done:
+            future.cancel()
+        return results, sorted(futures[future] for future in not_done)
+
+    @staticmethod
+    def _merge_ranked(results):
+        """
+        合并各文件的模糊检索结果。
+        余弦相似度、BM25 和子串匹配的分数量纲不同，不能直接比较；各文件的结果已按相关度排好，
+        按名次轮流取：先取每个文件的第一名，再取第二名，依此类推。
+        """
+        return [hit for tier in zip_longest(*results) for hit in tier if hit is not None]
+
+    def _search_file(self, filename, csv_path, query, precise):
+        """检索单个文件，返回 [{'source', 'mode', 'score', 'row'}]"""
+        index = get_csv_index(csv_path)
+
+        if precise:
+            # 【模式 1】精确匹配
+            return self._make_hits(index, filename, 'precise', [(row_id, 1.0) for row_id in index.lookup(query)])
+
+        # 【模式 2】模糊匹配：关键词检索，语义检索可用时由 _semantic_file 的结果替代
+        return self._make_hits(index, filename, 'keyword', index.search(query, KB_TOP_K))
+
+    def _semantic_file(self, filename, csv_path, query_vector):
+        """语义检索单个文件；失败、向量未就绪或没有足够相似的行时返回 None，由调用方保留关键词结果"""
+        try:
+            scored = semantic_search(csv_path, query_vector, KB_TOP_K)
+            if not scored:
+                return None
+            index = get_csv_index(csv_path)
+            scored = [(row_id, score) for row_id, score in scored if row_id < index.num_rows]
+            return self._make_hits(index, filename, 'semantic', scored)
+        except Exception as e:
+            logger.error(f"Semantic search failed for {filename}, falling back to keyword: {e}")
+            return None
+
+    @staticmethod
+    def _make_hits(index, filename, mode, scored):
+        if not scored:
+            return []
+        rows = index.rows([row_id for row_id, _ in scored]).to_dict(orient='records')
+        return [
+            {'source': filename, 'mode': mode, 'score': score, 'row': row}
+            for (_, score), row in zip(scored, rows)
+        ]
+
+
+# 全局共享的检索线程池，限制并发文件数；任务在调用工具的运行的上下文中执行
+_search_executor = RunContextExecutor(max_workers=KB_SEARCH_WORKERS, thread_name_prefix='kb-search')
+# 查询向量化的线程池，与检索线程池分开
+_embed_executor = RunContextExecutor(max_workers=KB_SEARCH_WORKERS, thread_name_prefix='kb-embed')
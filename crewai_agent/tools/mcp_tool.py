@@ -0,0 +1,109 @@
+import logging
+import weakref
+from typing import Any, Optional, Type
+from pydantic import BaseModel, Field, PrivateAttr, create_model
+
+from ..config import current_run_id, AgentStoppedException
+from ..run_store import run_store, STOPPED
+from .async_tool import AsyncNativeTool
+
+logger = logging.getLogger('crewai_agent')
+
+_JSON_TYPES = {
+    "string": str,
+    "number": float,
+    "integer": int,
+    "boolean": bool,
+    "array": list,
+    "object": dict,
+}
+
+
+def schema_to_model(tool_name, input_schema):
+    """把 MCP 工具的 JSON Schema 转成 pydantic 参数模型"""
+    properties = (input_schema or {}).get("properties", {})
+    required = set((input_schema or {}).get("required", []))
+    fields = {}
+    for field_name, field_schema in properties.items():
+        field_type = _JSON_TYPES.get(field_schema.get("type"), Any)
+        description = field_schema.get("description", "")
+        if field_name in required:
+            fields[field_name] = (field_type, Field(..., description=description))
+        else:
+            fields[field_name] = (Optional[field_type], Field(None, description=description))
+    model_name = f"{tool_name.replace('-', '_').replace(' ', '_')}Input"
+    return create_model(model_name, **fields)
+
+
+def format_tool_result(result):
+    """把 CallToolResult 的内容拼成文本"""
+    parts = []
+    for item in result.content or []:
+        parts.append(item.text if hasattr(item, "text") else str(item))
+    text = "\n".join(parts)
+    if result.isError:
+        return f"Error: {text}"
+    return text
+
+
+class MCPPoolTool(AsyncNativeTool):
+    """绑定到会话池中某个已借出会话的 MCP 工具，调用时直接复用该会话"""
+    name: str
+    description: str
+    args_schema: Type[BaseModel]
+    _session: Any = PrivateAttr(default=None)
+
+    def __init__(self, session, tool, **kwargs):
+        super().__init__(
+            name=tool["name"],
+            description=tool.get("description") or f"MCP tool {tool['name']}",
+            args_schema=schema_to_model(tool["name"], tool.get("input_schema")),
+            **kwargs
+        )
+        self._session = session
+
+    def _prepare(self, kwargs):
+        # 检查是否已被手动停止
+        run_id = current_run_id()
+        if run_id and run_store.get_status(run_id) == STOPPED:
+            raise AgentStoppedException("Agent execution stopped by user")
+
+        # 未填写的可选参数不传给服务器
+        return {key: value for key, value in kwargs.items() if value is not None}
+
+    def _error(self, e):
+        error_msg = f"Error executing MCP tool {self.name}: {e}"
+        logger.error(f"> 工具执行错误: {error_msg}")
+        return error_msg
+
+    def _run(self, **kwargs) -> str:
+        arguments = self._prepare(kwargs)
+        try:
+            return format_tool_result(self._session.call_tool(self.name, arguments))
+        except Exception as e:
+            return self._error(e)
+
+    async def _arun(self, **kwargs) -> str:
+        arguments = self._prepare(kwargs)
+        try:
+            return format_tool_result(await self._session.acall_tool(self.name, arguments))
+        except Exception as e:
+            return self._error(e)
+
+
+# 按会话缓存的工具对象 {session: {async_native: (session.tools, [MCPPoolTool, ...])}}
+_session_tools = weakref.WeakKeyDictionary()
+
+
+def build_mcp_tools(session, async_native=False):
+    """
+    为借出的会话生成全部工具。
+    生成参数模型（create_model）的开销较大，工具对象缓存在会话上，会话被再次借出时直接复用；
+    工具列表刷新（session.tools 被替换）后重新生成。会话同一时间只借给一个运行，缓存的工具不会被并发使用。
+    """
+    cached = _session_tools.setdefault(session, {})
+    entry = cached.get(async_native)
+    if entry is None or entry[0] is not session.tools:
+        tools = [MCPPoolTool(session, tool, async_native=async_native) for tool in session.tools]
+        entry = cached[async_native] = (session.tools, tools)
+    return list(entry[1])
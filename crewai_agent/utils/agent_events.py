@@ -0,0 +1,88 @@
+import json
+import time
+from crewai.agents.parser import parse, AgentFinish
+from crewai.events import crewai_event_bus, TaskStartedEvent, TaskFailedEvent
+from crewai.hooks import register_after_llm_call_hook, register_before_tool_call_hook, register_after_tool_call_hook
+from ..config import current_run_id
+from ..run_store import run_store, STOPPED
+
+_registered = False
+
+
+def record_event(kind, title, content, run_id=None):
+    """
+    把一条结构化事件追加到运行的日志中（只追加，不回写已有条目）。
+    title 决定前端的渲染样式，kind 是事件类型（task_started、thought、tool_call、tool_input、tool_result、final_answer、error）。
+    """
+    run_id = run_id or current_run_id()
+    if not run_id or not content:
+        return
+    run_store.append_log(run_id, {
+        "type": kind,
+        "title": title,
+        "content": content,
+        "timestamp": time.time()
+    })
+
+
+def _on_task_started(source, event):
+    # 事件总线在线程池中调用处理函数，上下文复制自发出事件的线程（或 task），可以取到当前运行
+    task = event.task
+    if task is None:
+        return
+    if task.agent is not None:
+        record_event('agent_started', '智能体角色', task.agent.role)
+    record_event('task_started', '当前任务', task.description)
+
+
+def _on_task_failed(source, event):
+    run_id = current_run_id()
+    # 用户停止时 crewai 同样会报告任务失败，不算执行错误
+    if run_id and run_store.get_status(run_id) != STOPPED:
+        record_event('error', '执行错误', event.error, run_id)
+
+
+def _after_llm_call(context):
+    """LLM 返回后、执行工具前在运行自己的线程（或 task）中同步调用，记录思考和最终答案"""
+    if not current_run_id() or not context.response:
+        return None
+    try:
+        answer = parse(context.response)
+    except Exception:
+        # 格式不对的回复由 crewai 要求模型重试，这里不记录
+        return None
+    record_event('thought', '思考中', answer.thought.removeprefix('Thought:').strip())
+    if isinstance(answer, AgentFinish):
+        record_event('final_answer', '最终答案', str(answer.output))
+    return None
+
+
+def _before_tool_call(context):
+    if current_run_id():
+        record_event('tool_call', '执行工具', context.tool_name)
+        arguments = json.dumps(context.tool_input, ensure_ascii=False, indent=2, default=str)
+        record_event('tool_input', '输入参数', f"```json\n{arguments}\n```")
+    return None
+
+
+def _after_tool_call(context):
+    if current_run_id():
+        record_event('tool_result', '工具输出', str(context.tool_result))
+    return None
+
+
+def setup_event_capture():
+    """
+    通过 crewai 的事件总线和执行钩子记录运行日志，代替解析 stdout 中的装饰框。
+    钩子和事件处理函数是进程级的，只处理绑定了运行的线程（或 task）中发生的事件。
+    """
+    global _registered
+    if _registered:
+        return
+    _registered = True
+    crewai_event_bus.register_handler(TaskStartedEvent, _on_task_started)
+    crewai_event_bus.register_handler(TaskFailedEvent, _on_task_failed)
+    # 钩子在执行器创建时读取，必须在构建 crew 之前注册
+    register_after_llm_call_hook(_after_llm_call)
+    register_before_tool_call_hook(_before_tool_call)
+    register_after_tool_call_hook(_after_tool_call)
@@ -0,0 +1,382 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from ..config import KB_CACHE_DIR, KB_EMBEDDING_MODEL, KB_EMBEDDING_BASE_URL, KB_EMBEDDING_BATCH_SIZE, KB_MIN_SIMILARITY
+from .kb_index import get_csv_index
+from .kb_store import file_signature
+
+logger = logging.getLogger('crewai_agent')
+
+try:
+    from langchain_openai import OpenAIEmbeddings
+except ImportError:
+    OpenAIEmbeddings = None
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+if not KB_EMBEDDING_MODEL:
+    # 语义检索默认关闭，升级后原先依赖向量检索的部署需要显式配置
+    logger.warning(
+        "Semantic knowledge base search is disabled (KB_EMBEDDING_MODEL is not set); "
+        "fuzzy search uses BM25 keyword matching only. Set KB_EMBEDDING_MODEL, e.g. text-embedding-3-small, to enable it."
+    )
+
+
+def get_embedder():
+    """懒加载向量模型客户端，未配置模型或缺少依赖时返回 None"""
+    global _embedder
+    if OpenAIEmbeddings is None or not KB_EMBEDDING_MODEL:
+        return None
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                kwargs = {'model': KB_EMBEDDING_MODEL}
+                if KB_EMBEDDING_BASE_URL:
+                    kwargs['base_url'] = KB_EMBEDDING_BASE_URL
+                _embedder = OpenAIEmbeddings(**kwargs)
+    return _embedder
+
+
+def row_to_text(columns, values):
+    """把一行数据拼成用于向量化的文本，跳过空值"""
+    parts = [f"{col}: {value}" for col, value in zip(columns, values) if not pd.isna(value)]
+    return "; ".join(parts)
+
+
+def row_hash(text):
+    """行内容的 64 位哈希，用于新旧版本之间比对行"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def embed_texts(embedder, texts):
+    """分批向量化并做 L2 归一化，之后用点积即可得到余弦相似度"""
+    vectors = []
+    for start in range(0, len(texts), KB_EMBEDDING_BATCH_SIZE):
+        vectors.extend(embedder.embed_documents(texts[start:start + KB_EMBEDDING_BATCH_SIZE]))
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _write_atomic(path, write_fn):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class EmbeddingStore:
+    """
+    单个 CSV 文件的磁盘向量存储。
+    向量以 .npy 存放，按文件内容哈希命名，加载时使用内存映射；
+    相同内容的文件在任何进程、任何时候都不会被重复向量化。
+    """
+    def __init__(self, csv_path, content_hash, vectors):
+        self.csv_path = csv_path
+        self.content_hash = content_hash
+        self.vectors = vectors
+
+    @staticmethod
+    def store_dir(csv_path):
+        digest = hashlib.sha1(csv_path.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(KB_CACHE_DIR, 'embeddings', f"{os.path.basename(csv_path)}.{digest}")
+
+    @classmethod
+    def paths(cls, csv_path, content_hash):
+        base = os.path.join(cls.store_dir(csv_path), content_hash)
+        return f"{base}.npy", f"{base}.rows.npy", f"{base}.json"
+
+    @classmethod
+    def load(cls, csv_path, content_hash):
+        """从磁盘以内存映射方式加载，不存在或模型不一致时返回 None"""
+        vectors_path, _, meta_path = cls.paths(csv_path, content_hash)
+        if not (os.path.exists(vectors_path) and os.path.exists(meta_path)):
+            return None
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('model') != KB_EMBEDDING_MODEL:
+                return None
+            vectors = np.load(vectors_path, mmap_mode='r')
+            return cls(csv_path, content_hash, vectors)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable embedding store {vectors_path}: {e}")
+            return None
+
+    @classmethod
+    def load_previous(cls, csv_path, exclude):
+        """
+        加载该文件最近一个旧版本的 (向量, 行哈希)，用于增量构建。
+        没有可复用的旧版本时返回 None。
+        """
+        store_dir = cls.store_dir(csv_path)
+        if not os.path.isdir(store_dir):
+            return None
+        versions = []
+        for name in os.listdir(store_dir):
+            if name.endswith('.json') and name[:-5] != exclude:
+                meta_path = os.path.join(store_dir, name)
+                versions.append((os.path.getmtime(meta_path), name[:-5]))
+        for _, version in sorted(versions, reverse=True):
+            vectors_path, rows_path, meta_path = cls.paths(csv_path, version)
+            try:
+                with open(meta_path, 'r', encoding='utf-8') as f:
+                    meta = json.load(f)
+                if meta.get('model') != KB_EMBEDDING_MODEL or not os.path.exists(rows_path):
+                    continue
+                return np.load(vectors_path, mmap_mode='r'), np.load(rows_path)
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable embedding store {vectors_path}: {e}")
+        return None
+
+    @classmethod
+    def build(cls, csv_path, content_hash, index, embedder):
+        """
+        向量化文件。
+        与上一版本按行哈希比对，只对新增或修改的行调用向量模型，
+        被删除的行随旧版本一起清理。
+        """
+        columns = [index.column(col).tolist() for col in index.search_cols]
+        texts = [row_to_text(index.search_cols, values) for values in zip(*columns)]
+        hashes = np.asarray([row_hash(text) for text in texts], dtype=np.uint64)
+
+        reusable = {}
+        previous = cls.load_previous(csv_path, exclude=content_hash)
+        if previous is not None:
+            old_vectors, old_hashes = previous
+            for position, value in enumerate(old_hashes.tolist()):
+                reusable.setdefault(value, position)
+
+        missing = [i for i, value in enumerate(hashes.tolist()) if value not in reusable]
+        new_vectors = embed_texts(embedder, [texts[i] for i in missing]) if missing else None
+
+        if previous is not None and len(old_vectors):
+            dim = old_vectors.shape[1]
+        elif new_vectors is not None:
+            dim = new_vectors.shape[1]
+        else:
+            dim = 0
+        vectors = np.empty((len(texts), dim), dtype=np.float32)
+        if previous is not None:
+            reused = [i for i, value in enumerate(hashes.tolist()) if value in reusable]
+            if reused:
+                vectors[reused] = old_vectors[[reusable[hashes[i].item()] for i in reused]]
+        if missing:
+            vectors[missing] = new_vectors
+
+        removed = len(reusable.keys() - set(hashes.tolist())) if previous is not None else 0
+        logger.info(
+            f"Embedded {len(missing)} of {len(texts)} rows of {csv_path} "
+            f"({len(texts) - len(missing)} reused, {removed} removed)"
+        )
+        cls.save(csv_path, content_hash, vectors, hashes)
+        cls.prune(csv_path, keep=content_hash)
+        return cls.load(csv_path, content_hash) or cls(csv_path, content_hash, vectors)
+
+    @classmethod
+    def save(cls, csv_path, content_hash, vectors, hashes):
+        vectors_path, rows_path, meta_path = cls.paths(csv_path, content_hash)
+        os.makedirs(os.path.dirname(vectors_path), exist_ok=True)
+        meta = {'model': KB_EMBEDDING_MODEL, 'rows': int(vectors.shape[0])}
+        # 先写向量和行哈希再写元数据，元数据存在即代表该版本完整
+        _write_atomic(vectors_path, lambda f: np.save(f, vectors))
+        _write_atomic(rows_path, lambda f: np.save(f, hashes))
+        _write_atomic(meta_path, lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+    @classmethod
+    def prune(cls, csv_path, keep=None):
+        """删除除 keep 以外的所有版本；keep 为 None 时删除整个文件的向量"""
+        store_dir = cls.store_dir(csv_path)
+        if not os.path.isdir(store_dir):
+            return
+        for name in os.listdir(store_dir):
+            if keep and name.startswith(f"{keep}."):
+                continue
+            try:
+                os.remove(os.path.join(store_dir, name))
+            except OSError as e:
+                logger.warning(f"Failed to remove stale embedding file {name}: {e}")
+        if keep is None:
+            try:
+                os.rmdir(store_dir)
+            except OSError:
+                pass
+
+    def search(self, query_vector, top_k):
+        """返回 [(行号, 相似度)]，按相似度降序"""
+        if not len(self.vectors):
+            return []
+        scores = self.vectors @ query_vector
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        ranked = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(row_id), float(scores[row_id])) for row_id in ranked]
+
+
+def content_hash(path):
+    """计算文件内容的 sha256"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+_hash_cache = {}
+_stores = {}
+_build_locks = {}
+_building = set()
+_failures = {}
+_registry_lock = threading.Lock()
+
+# 构建失败后的重试退避（秒），每次失败翻倍
+BUILD_RETRY_BASE = 60
+BUILD_RETRY_MAX = 3600
+
+
+def get_content_hash(path):
+    """按文件签名缓存内容哈希，避免每次查询都读全文件"""
+    signature = file_signature(path)
+    cached = _hash_cache.get(path)
+    if cached and cached[0] == signature:
+        return cached[1]
+    digest = content_hash(path)
+    _hash_cache[path] = (signature, digest)
+    return digest
+
+
+def build_embedding_store(csv_path):
+    """
+    加载或构建文件当前版本的向量存储（会调用向量模型，可能很慢）。
+    只在上传流程的后台线程或 schedule_build 启动的线程中调用，不在查询路径上执行。
+    失败时记录下来，退避期内查询不会重复触发构建。
+    """
+    embedder = get_embedder()
+    if embedder is None:
+        return None
+
+    csv_path = os.path.abspath(csv_path)
+    digest = get_content_hash(csv_path)
+    with _registry_lock:
+        build_lock = _build_locks.setdefault(csv_path, threading.Lock())
+
+    with build_lock:
+        store = _stores.get(csv_path)
+        if store is not None and store.content_hash == digest:
+            return store
+        try:
+            store = EmbeddingStore.load(csv_path, digest)
+            if store is None:
+                store = EmbeddingStore.build(csv_path, digest, get_csv_index(csv_path), embedder)
+        except Exception:
+            failure = _failures.get(csv_path)
+            delay = BUILD_RETRY_BASE
+            if failure and failure[0] == digest:
+                delay = min(failure[2] * 2, BUILD_RETRY_MAX)
+            _failures[csv_path] = (digest, time.monotonic() + delay, delay)
+            raise
+        _failures.pop(csv_path, None)
+        _stores[csv_path] = store
+        return store
+
+
+def _build_in_background(csv_path):
+    try:
+        build_embedding_store(csv_path)
+    except Exception as e:
+        logger.error(f"Failed to build embeddings for {csv_path}: {e}")
+    finally:
+        with _registry_lock:
+            _building.discard(csv_path)
+
+
+def schedule_build(csv_path, digest):
+    """在后台线程中构建向量；已有构建在进行，或该版本最近失败仍在退避期内时不做任何事"""
+    failure = _failures.get(csv_path)
+    if failure and failure[0] == digest and time.monotonic() < failure[1]:
+        return
+    with _registry_lock:
+        if csv_path in _building:
+            return
+        _building.add(csv_path)
+    threading.Thread(target=_build_in_background, args=(csv_path,), name='kb-embed-build', daemon=True).start()
+
+
+def get_embedding_store(csv_path):
+    """
+    查询路径上获取文件的向量存储：内存 -> 磁盘（内存映射），都没有时返回 None。
+    不会在查询中向量化文件：缺失的向量交给后台线程构建，本次查询由调用方退回关键词检索。
+    未配置向量模型时同样返回 None。
+    """
+    if get_embedder() is None:
+        return None
+
+    csv_path = os.path.abspath(csv_path)
+    digest = get_content_hash(csv_path)
+    store = _stores.get(csv_path)
+    if store is not None and store.content_hash == digest:
+        return store
+
+    store = EmbeddingStore.load(csv_path, digest)
+    if store is None:
+        schedule_build(csv_path, digest)
+        return None
+    _stores[csv_path] = store
+    return store
+
+
+def sync_embeddings(csv_path):
+    """
+    文件更新后同步向量：只对变化的行做向量化。
+    供上传流程在后台调用，这样第一次查询时向量已经就绪。
+    """
+    try:
+        build_embedding_store(csv_path)
+    except Exception as e:
+        logger.error(f"Failed to sync embeddings for {csv_path}: {e}")
+
+
+def remove_embeddings(csv_path):
+    """文件被删除时清理其全部向量"""
+    csv_path = os.path.abspath(csv_path)
+    _stores.pop(csv_path, None)
+    _hash_cache.pop(csv_path, None)
+    _failures.pop(csv_path, None)
+    EmbeddingStore.prune(csv_path)
+
+
+def embed_query(query):
+    """向量化查询并做 L2 归一化；未配置向量模型时返回 None"""
+    embedder = get_embedder()
+    if embedder is None:
+        return None
+    query_vector = np.asarray(embedder.embed_query(query), dtype=np.float32)
+    norm = np.linalg.norm(query_vector)
+    if norm:
+        query_vector /= norm
+    return query_vector
+
+
+def semantic_search(csv_path, query_vector, top_k):
+    """
+    用已向量化的查询（见 embed_query）检索文件，返回相似度不低于 KB_MIN_SIMILARITY 的 [(行号, 相似度)]；
+    未启用向量检索或向量尚未就绪时返回 None，没有足够相似的行时返回空列表。
+    """
+    store = get_embedding_store(csv_path)
+    if store is None:
+        return None
+    return [(row_id, score) for row_id, score in store.search(query_vector, top_k) if score >= KB_MIN_SIMILARITY]
@@ -0,0 +1,74 @@
+import pandas as pd
+from ..config import KB_OUTPUT_FORMAT, KB_MAX_CELL_CHARS, KB_MAX_OUTPUT_CHARS
+
+
+def format_cell(value, max_chars=KB_MAX_CELL_CHARS):
+    """单元格转为单行文本，超长时截断"""
+    text = " ".join(str(value).split())
+    if max_chars and len(text) > max_chars:
+        text = text[:max_chars - 1] + "…"
+    return text
+
+
+def _kv_lines(hits, max_cell_chars):
+    """key-value 格式：每个命中一行，带来源文件和检索方式"""
+    for hit in hits:
+        cells = [
+            f"{col}: {format_cell(value, max_cell_chars)}"
+            for col, value in hit['row'].items() if not pd.isna(value)
+        ]
+        yield 1, f"[{hit['source']} · {hit['mode']}] " + " | ".join(cells)
+
+
+def _tsv_lines(hits, max_cell_chars):
+    """TSV 格式：同一来源的行共用一个表头，表头在该来源第一次出现时输出"""
+    groups = {}
+    for hit in hits:
+        groups.setdefault(hit['source'], []).append(hit)
+    for source, source_hits in groups.items():
+        columns = list(source_hits[0]['row'].keys())
+        yield 0, f"# {source} ({source_hits[0]['mode']})"
+        yield 0, "\t".join(columns)
+        for hit in source_hits:
+            values = ["" if pd.isna(hit['row'].get(col)) else format_cell(hit['row'].get(col), max_cell_chars) for col in columns]
+            yield 1, "\t".join(values)
+
+
+def format_hits(hits, style=KB_OUTPUT_FORMAT, max_chars=KB_MAX_OUTPUT_CHARS, max_cell_chars=KB_MAX_CELL_CHARS):
+    """
+    把检索命中渲染为紧凑文本。
+    输出总长度不超过 max_chars，放不下的行以 "N more rows omitted" 汇总；
+    tsv 格式的表头本身就超出预算时改用 kv 格式。
+    """
+    lines_iter = _tsv_lines(hits, max_cell_chars) if style == 'tsv' else _kv_lines(hits, max_cell_chars)
+
+    lines = []
+    used = 0
+    emitted = 0
+    pending_headers = []
+    for is_row, line in lines_iter:
+        if not is_row:
+            pending_headers.append(line)
+            continue
+        block = pending_headers + [line]
+        cost = sum(len(text) + 1 for text in block)
+        # 为省略提示预留空间
+        if max_chars and used + cost > max_chars - 40:
+            if emitted:
+                break
+            # 第一行就超出预算时截断它，保证总长度有上限；预算扣除同一块中的表头（tsv）以及省略号和换行
+            room = max_chars - 40 - used - sum(len(text) + 1 for text in block[:-1]) - 2
+            if room <= 0 and style == 'tsv':
+                # 表头本身就放不下（列很多或列名很长），改用不需要表头的 kv 格式
+                return format_hits(hits, 'kv', max_chars, max_cell_chars)
+            block[-1] = block[-1][:max(room, 0)] + "…"
+            cost = sum(len(text) + 1 for text in block)
+        lines.extend(block)
+        used += cost
+        emitted += 1
+        pending_headers = []
+
+    omitted = len(hits) - emitted
+    if omitted > 0:
+        lines.append(f"... {omitted} more rows omitted")
+    return "\n".join(lines)
@@ -0,0 +1,345 @@
+import os
+import re
+import pickle
+import hashlib
+import tempfile
+import threading
+import logging
+import numpy as np
+import pandas as pd
+from ..config import KB_CACHE_DIR
+from .kb_store import file_signature, load_dataframe, load_table, source_version
+
+logger = logging.getLogger('crewai_agent')
+
+# 英文/数字按单词切分，中文连续片段按单字 + 二元组切分
+TOKEN_PATTERN = re.compile(r'[0-9a-z]+|[\u4e00-\u9fff]+')
+CJK_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+BM25_FORMAT_VERSION = 2
+
+
+def tokenize(text):
+    """把文本切分为检索词条"""
+    tokens = []
+    for piece in TOKEN_PATTERN.findall(str(text).lower()):
+        if CJK_PATTERN.match(piece):
+            tokens.extend(piece)
+            tokens.extend(piece[i:i + 2] for i in range(len(piece) - 1))
+        else:
+            tokens.append(piece)
+    return tokens
+
+
+def get_search_columns(columns):
+    """参与检索的列：默认跳过 *_id 列，全是 id 列时退回全部列"""
+    search_cols = [col for col in columns if not str(col).lower().endswith('_id')]
+    return search_cols or list(columns)
+
+
+class BM25Index:
+    """
+    词条 -> 倒排表 的关键词索引，使用 BM25 打分。
+    所有倒排表拼接成两个扁平数组（行号、词频），每个词条记录自己的 [start, end) 区间；
+    落盘后以内存映射方式加载，多个 worker 共享同一份倒排数据。
+    """
+    def __init__(self, signature, doc_lens, offsets, rows, tfs):
+        self.signature = signature
+        self.doc_lens = doc_lens
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+        self.avgdl = float(doc_lens.mean()) if len(doc_lens) else 0.0
+        # 文档长度归一化项与查询无关，预先算好
+        self.norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(doc_lens) / (self.avgdl or 1.0))
+
+    @classmethod
+    def build(cls, signature, index):
+        builder = BM25Builder()
+        builder.add([index.column(col).tolist() for col in index.search_cols], 0)
+        return builder.finish(signature)
+
+    def search(self, query, top_k):
+        """返回 [(行号, 分数)]，按分数降序，最多 top_k 条"""
+        terms = set(tokenize(query))
+        if not terms or not len(self.doc_lens):
+            return []
+
+        n_docs = len(self.doc_lens)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        for term in terms:
+            span = self.offsets.get(term)
+            if span is None:
+                continue
+            rows = self.rows[span[0]:span[1]]
+            tfs = self.tfs[span[0]:span[1]]
+            idf = np.log(1 + (n_docs - len(rows) + 0.5) / (len(rows) + 0.5))
+            scores[rows] += idf * tfs * (BM25_K1 + 1) / (tfs + self.norm[rows])
+
+        matched = np.flatnonzero(scores)
+        if not len(matched):
+            return []
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        ranked = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(int(row_id), float(scores[row_id])) for row_id in ranked]
+
+    @staticmethod
+    def cache_base(csv_path):
+        digest = hashlib.sha1(csv_path.encode('utf-8')).hexdigest()[:12]
+        return os.path.join(KB_CACHE_DIR, 'bm25', f"{os.path.basename(csv_path)}.{digest}")
+
+    @classmethod
+    def load(cls, csv_path, signature):
+        """从磁盘映射索引，签名不一致或文件损坏时返回 None"""
+        base = cls.cache_base(csv_path)
+        if not os.path.exists(f"{base}.pkl"):
+            return None
+        try:
+            with open(f"{base}.pkl", 'rb') as f:
+                payload = pickle.load(f)
+            if payload.get('version') != BM25_FORMAT_VERSION or tuple(payload.get('signature', ())) != signature:
+                return None
+            arrays = {
+                name: np.load(f"{base}.{payload['stamp']}.{name}.npy", mmap_mode='r')
+                for name in ('doc_lens', 'rows', 'tfs')
+            }
+            return cls(signature, arrays['doc_lens'], payload['offsets'], arrays['rows'], arrays['tfs'])
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable BM25 cache {base}: {e}")
+            return None
+
+    def save(self, csv_path):
+        """原子写入磁盘，供其他进程和重启后复用"""
+        base = self.cache_base(csv_path)
+        directory = os.path.dirname(base)
+        os.makedirs(directory, exist_ok=True)
+        # 数组文件名带上签名，新旧版本互不覆盖，正在映射旧版本的 worker 不受影响
+        stamp = f"{self.signature[0]}-{self.signature[1]}"
+        for name, array in (('doc_lens', self.doc_lens), ('rows', self.rows), ('tfs', self.tfs)):
+            _write_atomic(f"{base}.{stamp}.{name}.npy", lambda f, array=array: np.save(f, np.asarray(array)))
+        payload = {
+            'version': BM25_FORMAT_VERSION,
+            'signature': self.signature,
+            'stamp': stamp,
+            'offsets': self.offsets,
+        }
+        _write_atomic(f"{base}.pkl", lambda f: pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+        # 清理旧版本的数组文件
+        prefix = os.path.basename(base) + "."
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith('.npy') and not name.startswith(f"{prefix}{stamp}."):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+
+class BM25Builder:
+    """增量构建 BM25 索引，可以按块喂入数据"""
+    def __init__(self):
+        self.term_rows = {}
+        self.doc_lens = []
+
+    def add(self, columns, offset):
+        """columns 为检索列的值列表，offset 为这一块第一行的行号"""
+        for row_id, values in enumerate(zip(*columns), start=offset):
+            counts = {}
+            for value in values:
+                if pd.isna(value):
+                    continue
+                for token in tokenize(value):
+                    counts[token] = counts.get(token, 0) + 1
+            self.doc_lens.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self.term_rows.setdefault(token, []).append((row_id, tf))
+
+    def finish(self, signature):
+        offsets = {}
+        total = sum(len(entries) for entries in self.term_rows.values())
+        rows = np.empty(total, dtype=np.int32)
+        tfs = np.empty(total, dtype=np.float32)
+        position = 0
+        for token, entries in self.term_rows.items():
+            end = position + len(entries)
+            rows[position:end], tfs[position:end] = zip(*entries)
+            offsets[token] = (position, end)
+            position = end
+        doc_lens = np.asarray(self.doc_lens, dtype=np.int32)
+        return BM25Index(signature, doc_lens, offsets, rows, tfs)
+
+
+def exact_postings(series):
+    """一列的 "小写值 -> 行号数组" 倒排表；与旧实现一致，空值统一视为 'nan'"""
+    values = series.astype(str).where(series.notna(), 'nan').str.lower()
+    return values.groupby(values, sort=False).indices
+
+
+def _write_atomic(path, write_fn):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_fn(f)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class CSVIndex:
+    """
+    单个 CSV 文件的内存索引。
+    按列维护 "小写单元格值 -> 行号" 的倒排表，精确匹配只需一次字典查找。
+    行数据保存在内存映射的 Arrow 表中，多个 worker 共享同一份物理内存；
+    未安装 pyarrow 时退回进程内的 DataFrame。
+    """
+    def __init__(self, path, signature, version, table=None, df=None, exact=None, bm25=None):
+        self.path = path
+        self.signature = signature
+        self.version = version
+        self.table = table
+        self.df = df
+        self.columns = table.column_names if table is not None else df.columns.tolist()
+        self.num_rows = table.num_rows if table is not None else len(df)
+        self.search_cols = get_search_columns(self.columns)
+        if exact is None:
+            exact = {col: exact_postings(self.column(col)) for col in self.search_cols}
+        self.exact = exact
+        self._bm25 = bm25
+        self._bm25_lock = threading.Lock()
+
+    def column(self, col):
+        """以 pandas Series 形式读取一列（临时对象，用完即弃）"""
+        if self.table is not None:
+            return self.table.column(col).to_pandas()
+        return self.df[col]
+
+    @property
+    def bm25(self):
+        """关键词索引按需构建：优先映射磁盘缓存，否则现场构建并落盘"""
+        if self._bm25 is None:
+            with self._bm25_lock:
+                if self._bm25 is None:
+                    bm25 = BM25Index.load(self.path, self.signature)
+                    if bm25 is None:
+                        bm25 = BM25Index.build(self.signature, self)
+                        try:
+                            bm25.save(self.path)
+                            bm25 = BM25Index.load(self.path, self.signature) or bm25
+                        except Exception as e:
+                            logger.warning(f"Failed to persist BM25 index for {self.path}: {e}")
+                    self._bm25 = bm25
+        return self._bm25
+
+    def search(self, query, top_k):
+        """
+        关键词检索，返回按相关度排列的 [(行号, 分数)]。
+        BM25 只匹配完整词条，结果不足 top_k 时用子串匹配补齐（如 srv-01 查到 prod-srv-012），
+        子串匹配的行排在 BM25 结果之后，两者的分数不可比较。
+        """
+        hits = self.bm25.search(query, top_k)
+        if len(hits) < top_k:
+            seen = {row_id for row_id, _ in hits}
+            extra = [hit for hit in self.substring_search(query, top_k + len(hits)) if hit[0] not in seen]
+            hits += extra[:top_k - len(hits)]
+        return hits
+
+    def substring_search(self, query, top_k):
+        """
+        子串匹配：查询按空白切词（忽略单字符），任一检索列包含任一词即命中，忽略大小写。
+        分数为命中的 (词, 列) 对数，同分按原始行序，最多 top_k 条。需要扫描检索列，只作为 BM25 的兜底。
+        """
+        words = [word for word in str(query).lower().split() if len(word) > 1]
+        if not words or not self.num_rows:
+            return []
+        scores = np.zeros(self.num_rows, dtype=np.int32)
+        for col in self.search_cols:
+            values = self.column(col)
+            values = values.astype(str).where(values.notna(), '').str.lower()
+            for word in words:
+                scores += values.str.contains(word, regex=False).to_numpy(dtype=np.int32)
+        matched = np.flatnonzero(scores)
+        ranked = matched[np.argsort(-scores[matched], kind='stable')][:top_k]
+        return [(int(row_id), float(scores[row_id])) for row_id in ranked]
+
+    def lookup(self, query):
+        """返回任一检索列与 query 完全相等（忽略大小写）的行号，按原始顺序排列"""
+        key = str(query).lower()
+        row_ids = set()
+        for postings in self.exact.values():
+            hits = postings.get(key)
+            if hits is not None:
+                row_ids.update(hits.tolist())
+        return sorted(row_ids)
+
+    def rows(self, row_ids):
+        """按行号取出行，只拷贝被选中的行"""
+        if self.table is not None:
+            return self.table.take(row_ids).to_pandas()
+        return self.df.iloc[row_ids].reset_index(drop=True)
+
+
+_indexes = {}
+_build_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get_csv_index(path):
+    """
+    获取 CSV 文件的索引。
+    索引常驻进程内存，只有文件 mtime/size 或共享版本号变化时才重新映射、重建。
+    """
+    path = os.path.abspath(path)
+    signature = file_signature(path)
+    version = source_version(path)
+    cached = _indexes.get(path)
+    if cached is not None and cached.signature == signature and cached.version == version:
+        return cached
+
+    with _registry_lock:
+        build_lock = _build_locks.setdefault(path, threading.Lock())
+
+    # 同一文件只允许一个线程重建，其余线程等待后直接复用结果
+    with build_lock:
+        cached = _indexes.get(path)
+        if cached is not None and cached.signature == signature and cached.version == version:
+            return cached
+        table = load_table(path)
+        if table is not None:
+            # 转换可能刚刚递增了版本号
+            index = CSVIndex(path, signature, source_version(path), table=table)
+        else:
+            index = CSVIndex(path, signature, version, df=load_dataframe(path))
+        _indexes[path] = index
+        logger.debug(f"Built knowledge base index for {path} ({index.num_rows} rows, version {index.version})")
+        return index
+
+
+def register_csv_index(index):
+    """登记一个已经构建好的索引（例如流式上传过程中顺带建好的）"""
+    _indexes[os.path.abspath(index.path)] = index
+
+
+def invalidate_csv_index(path):
+    """主动丢弃某个文件的索引（例如文件被删除时）"""
+    _indexes.pop(os.path.abspath(path), None)
+
+
+def remove_bm25_cache(path):
+    """文件被删除时清理其磁盘上的 BM25 索引（.pkl 和各版本的 .npy）"""
+    base = BM25Index.cache_base(os.path.abspath(path))
+    directory = os.path.dirname(base)
+    if not os.path.isdir(directory):
+        return
+    prefix = os.path.basename(base) + "."
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and (name.endswith('.pkl') or name.endswith('.npy')):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError as e:
+                logger.warning(f"Failed to remove BM25 cache file {name}: {e}")
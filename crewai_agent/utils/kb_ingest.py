@@ -0,0 +1,234 @@
+import io
+import os
+import csv
+import time
+import uuid
+import logging
+import numpy as np
+import pandas as pd
+from ..config import KB_INGEST_CHUNK_ROWS
+from .kb_store import pa, pa_ipc, columnar_path, file_signature, signature_metadata, bump_version
+from .kb_index import CSVIndex, register_csv_index
+
+logger = logging.getLogger('crewai_agent')
+
+# 预览保留的行数
+PREVIEW_ROWS = 10
+
+
+class IngestError(Exception):
+    """上传的 CSV 无法通过校验"""
+    pass
+
+
+class _UploadStream(io.RawIOBase):
+    """把上传分块包装成可读流，parser 读到哪里就把对应分块写入临时文件"""
+    def __init__(self, chunks, sink):
+        self._chunks = iter(chunks)
+        self._sink = sink
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                return 0
+            self._sink.write(chunk)
+            self._pending = chunk
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _check_field_counts(path):
+    """
+    逐行检查字段数不超过表头的列数。
+    pandas 分块解析时，字段过多的行如果恰好是某个分块的第一行会被静默截断而不报错，
+    所以在解析之后用 csv 模块对落盘的文件再做一次检查。
+    """
+    with open(path, 'r', encoding='utf-8', errors='replace', newline='') as f:
+        reader = csv.reader(f)
+        expected = None
+        for row in reader:
+            if not row:
+                continue
+            if expected is None:
+                expected = len(row)
+            elif len(row) > expected:
+                raise IngestError(f"第 {reader.line_num} 行有 {len(row)} 个字段，超过表头的 {expected} 列")
+
+
+def _merge_dtype(current, new):
+    """合并多个分块推断出的 dtype：数值类型取公共类型，其他情况退化为 object"""
+    if current is None or current == new:
+        return new
+    if current.kind in 'iuf' and new.kind in 'iuf':
+        return np.result_type(current, new)
+    return np.dtype(object)
+
+
+def _to_builtin(value):
+    return value.item() if hasattr(value, 'item') else value
+
+
+class _ColumnStats:
+    """单列统计信息：dtype、空值数、数值列的最小/最大值"""
+    def __init__(self):
+        self.dtype = None
+        self.nulls = 0
+        self.min = None
+        self.max = None
+
+    def update(self, series):
+        self.dtype = _merge_dtype(self.dtype, series.dtype)
+        self.nulls += int(series.isna().sum())
+        if series.dtype.kind in 'iuf' and series.notna().any():
+            low, high = _to_builtin(series.min()), _to_builtin(series.max())
+            self.min = low if self.min is None else min(self.min, low)
+            self.max = high if self.max is None else max(self.max, high)
+
+    def to_dict(self):
+        stats = {'dtype': str(self.dtype), 'nulls': self.nulls}
+        if self.min is not None and self.dtype.kind in 'iuf':
+            stats['min'] = self.min
+            stats['max'] = self.max
+        return stats
+
+
+class _ColumnarSink:
+    """
+    把分块以 record batch 的形式追加到 Arrow IPC 文件。
+    后续分块的类型与首块不兼容时放弃写入，列式文件留给 load_table 按需重新转换。
+    """
+    def __init__(self, path, signature):
+        self.path = path
+        self.signature = signature
+        self.tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        self.schema = None
+        self.file = None
+        self.writer = None
+        self.ok = pa is not None
+
+    def write(self, df):
+        if not self.ok:
+            return
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                metadata = dict(table.schema.metadata or {})
+                metadata.update(signature_metadata(self.signature))
+                self.schema = table.schema.with_metadata(metadata)
+                self.file = pa.OSFile(self.tmp_path, 'wb')
+                self.writer = pa_ipc.new_file(self.file, self.schema)
+            table = table.replace_schema_metadata(self.schema.metadata).cast(self.schema)
+            self.writer.write_table(table)
+        except Exception as e:
+            logger.info(f"Deferring columnar conversion of {self.path}: {e}")
+            self.abort()
+
+    def abort(self):
+        self.ok = False
+        self._close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def _close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def commit(self):
+        if not self.ok or self.writer is None:
+            self.abort()
+            return False
+        self._close()
+        os.replace(self.tmp_path, self.path)
+        return True
+
+
+def ingest_upload(uploaded_file, dest_path):
+    """
+    流式导入上传的 CSV。
+    一边接收分块一边解析校验：统计行数和列信息、推断 dtype、写列式文件，
+    全部通过后才原子地重命名到 dest_path。整个过程不会把整个文件读进内存；
+    落盘后再用 csv 模块检查一遍每行的字段数（见 _check_field_counts）。
+    检索索引在列式文件提交后从最终的 Arrow 表构建：各分块单独推断的 dtype 可能不同（如 1 和 1.0），
+    只有最终的表与查询时读到的行一致。
+    校验失败时抛出 IngestError，dest_path 上原有的文件保持不变。
+    返回 {'rows', 'columns', 'stats', 'preview'}，preview 为前几行的 DataFrame。
+    """
+    dest_path = os.path.abspath(dest_path)
+    directory = os.path.dirname(dest_path)
+    tmp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.part")
+
+    # 预先确定最终文件的签名 (mtime, size)，列式文件和索引都以它为准
+    mtime_ns = time.time_ns()
+    signature = (mtime_ns, uploaded_file.size)
+    sink = _ColumnarSink(columnar_path(dest_path), signature)
+
+    rows = 0
+    columns = None
+    stats = {}
+    preview = None
+    try:
+        with open(tmp_path, 'wb') as raw_sink:
+            stream = io.BufferedReader(_UploadStream(uploaded_file.chunks(), raw_sink))
+            try:
+                with pd.read_csv(stream, chunksize=KB_INGEST_CHUNK_ROWS) as reader:
+                    for chunk in reader:
+                        if columns is None:
+                            columns = chunk.columns.tolist()
+                            if not columns:
+                                raise IngestError("CSV 文件没有列")
+                            stats = {col: _ColumnStats() for col in columns}
+                            preview = chunk.head(PREVIEW_ROWS)
+
+                        for col in columns:
+                            stats[col].update(chunk[col])
+                        sink.write(chunk)
+                        rows += len(chunk)
+            except IngestError:
+                raise
+            except Exception as e:
+                raise IngestError(str(e)) from e
+            # parser 可能没有读到流的末尾（例如末尾只有空行），把剩余分块也落盘
+            while stream.read(1024 * 1024):
+                pass
+
+        if columns is None:
+            raise IngestError("CSV 文件为空")
+        _check_field_counts(tmp_path)
+
+        os.utime(tmp_path, ns=(mtime_ns, mtime_ns))
+        columnar_ok = sink.commit() and file_signature(tmp_path) == signature
+        os.replace(tmp_path, dest_path)
+    except Exception:
+        sink.abort()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    version = bump_version(dest_path)
+    if columnar_ok:
+        table = pa_ipc.open_file(pa.memory_map(columnar_path(dest_path), 'r')).read_all()
+        index = CSVIndex(dest_path, signature, version, table=table)
+        # 提前构建并落盘关键词索引，第一次查询不用承担这部分开销
+        index.bm25
+        register_csv_index(index)
+    logger.info(f"Ingested {dest_path}: {rows} rows, {len(columns)} columns")
+
+    return {
+        'rows': rows,
+        'columns': columns,
+        'stats': {col: column_stats.to_dict() for col, column_stats in stats.items()},
+        'preview': preview,
+    }
@@ -0,0 +1,131 @@
+import os
+import json
+import threading
+import logging
+import pandas as pd
+from ..config import BASE_DIR
+
+logger = logging.getLogger('crewai_agent')
+
+DESCRIPTION_HEADER = """Search the knowledge base for error codes, troubleshooting steps, and asset information.
+    You should choose the appropriate source based on the query.
+    Use precise=True when you have an exact ID, error code, or tag name.
+
+    Current available sources:
+    """
+
+
+def _stat_stamp(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+class KnowledgeBaseRegistry:
+    """
+    知识库元数据注册表。
+    只在 data 目录或 metadata.json 的 mtime 变化时重新扫描，
+    平时直接返回预先拼好的工具描述和每个数据源的列信息。
+    """
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.metadata_path = os.path.join(data_dir, "metadata.json")
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._sources = {}
+        self._description = DESCRIPTION_HEADER
+
+    def _current_stamp(self):
+        # 增删文件会改变目录 mtime，编辑描述会改变 metadata.json
+        return (_stat_stamp(self.data_dir), _stat_stamp(self.metadata_path))
+
+    def _ensure_fresh(self):
+        stamp = self._current_stamp()
+        if stamp == self._stamp:
+            return
+        with self._lock:
+            if stamp != self._stamp:
+                self._reload()
+                self._stamp = stamp
+
+    def invalidate(self):
+        """强制下次访问时重新加载"""
+        self._stamp = None
+
+    def _reload(self):
+        metadata = {}
+        if os.path.exists(self.metadata_path):
+            try:
+                with open(self.metadata_path, 'r', encoding='utf-8') as f:
+                    metadata = json.load(f)
+            except Exception as e:
+                logger.error(f"Error loading metadata for description: {e}")
+
+        sources = {}
+        if os.path.exists(self.data_dir):
+            for filename in sorted(f for f in os.listdir(self.data_dir) if f.endswith('.csv')):
+                sources[filename] = self._build_source(filename, metadata.get(filename))
+
+        description = DESCRIPTION_HEADER
+        if not os.path.exists(self.data_dir):
+            description += "No CSV sources available yet.\n"
+        for filename, info in sources.items():
+            if info['has_columns']:
+                description += f"- {filename}: {info['description']} (Columns: {', '.join(info['columns'])})\n"
+            else:
+                description += f"- {filename}: {info['description']}\n"
+
+        self._sources = sources
+        self._description = description
+
+    def _build_source(self, filename, desc_info):
+        if isinstance(desc_info, dict):
+            description = desc_info.get("description", "No description provided.")
+            columns = desc_info.get("columns", "")
+            if isinstance(columns, str):
+                columns = [c.strip() for c in columns.split(",") if c.strip()]
+            has_columns = True
+        else:
+            description = desc_info or "No description provided."
+            columns = []
+            has_columns = False
+
+        # 元数据里没写列名时读取表头补全 schema（不影响描述文本）
+        schema = list(columns)
+        if not schema:
+            try:
+                schema = pd.read_csv(os.path.join(self.data_dir, filename), nrows=0).columns.tolist()
+            except Exception as e:
+                logger.warning(f"Failed to read header of {filename}: {e}")
+
+        return {
+            'description': description,
+            'columns': columns,
+            'schema': schema,
+            'has_columns': has_columns,
+        }
+
+    @property
+    def description(self):
+        """预先拼好的工具描述"""
+        self._ensure_fresh()
+        return self._description
+
+    def sources(self):
+        """{文件名: {'description', 'columns', 'schema'}}"""
+        self._ensure_fresh()
+        return self._sources
+
+    def source_names(self):
+        return list(self.sources().keys())
+
+    def schema(self, filename):
+        """某个数据源的列名列表，未知数据源返回 None"""
+        info = self.sources().get(filename)
+        return info['schema'] if info else None
+
+
+# 进程内共享的注册表实例
+knowledge_base_registry = KnowledgeBaseRegistry(os.path.join(BASE_DIR, "data"))
@@ -0,0 +1,205 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import logging
+import pandas as pd
+from ..config import KB_CACHE_DIR
+
+logger = logging.getLogger('crewai_agent')
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as pa_ipc
+except ImportError:
+    pa = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 列式文件中记录来源 CSV 签名的 schema 元数据键
+SIGNATURE_KEY = b'source_signature'
+
+
+def file_signature(path):
+    """文件签名 (mtime, size)，用于判断派生数据是否过期"""
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+
+def columnar_path(csv_path):
+    """CSV 对应的 Arrow IPC 文件路径（CSV 仍是唯一的数据源）"""
+    csv_path = os.path.abspath(csv_path)
+    digest = hashlib.sha1(csv_path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(KB_CACHE_DIR, 'columnar', f"{os.path.basename(csv_path)}.{digest}.arrow")
+
+
+def _encode_signature(signature):
+    return f"{signature[0]}:{signature[1]}".encode('ascii')
+
+
+def signature_metadata(signature):
+    """写入列式文件 schema 的来源签名"""
+    return {SIGNATURE_KEY: _encode_signature(signature)}
+
+
+def _open_table(path):
+    """以内存映射方式打开 Arrow IPC 文件"""
+    source = pa.memory_map(path, 'r')
+    return pa_ipc.open_file(source)
+
+
+def _manifest_path():
+    return os.path.join(KB_CACHE_DIR, 'manifest.json')
+
+
+_manifest_cache = {'stamp': None, 'data': {}}
+_manifest_lock = threading.Lock()
+
+
+def read_manifest():
+    """
+    读取共享版本清单 {'version': 全局版本号, 'sources': {csv 路径: 版本号}}。
+    按清单文件的 mtime 缓存，未变化时不重复解析。
+    """
+    path = _manifest_path()
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {}
+    stamp = (st.st_mtime_ns, st.st_size)
+    if stamp != _manifest_cache['stamp']:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable knowledge base manifest: {e}")
+            return _manifest_cache['data']
+        _manifest_cache['stamp'] = stamp
+        _manifest_cache['data'] = data
+    return _manifest_cache['data']
+
+
+def source_version(csv_path):
+    """某个 CSV 的版本号；写入方每次重新生成列式文件都会递增"""
+    return read_manifest().get('sources', {}).get(os.path.abspath(csv_path), 0)
+
+
+def bump_version(csv_path):
+    """
+    递增 CSV 的版本号，通知其他 worker 重新映射。
+    使用文件锁保证多进程并发写入时版本号不丢失。
+    """
+    os.makedirs(KB_CACHE_DIR, exist_ok=True)
+    with _manifest_lock, open(os.path.join(KB_CACHE_DIR, 'manifest.lock'), 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        path = _manifest_path()
+        data = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                logger.warning(f"Rewriting unreadable knowledge base manifest: {e}")
+        data['version'] = data.get('version', 0) + 1
+        data.setdefault('sources', {})
+        if os.path.exists(csv_path):
+            data['sources'][os.path.abspath(csv_path)] = data['version']
+        else:
+            data['sources'].pop(os.path.abspath(csv_path), None)
+
+        fd, tmp_path = tempfile.mkstemp(dir=KB_CACHE_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        return data['version']
+
+
+def convert_csv(csv_path):
+    """
+    把 CSV 解析一次并转存为 Arrow IPC 文件，dtype 推断只在这里做一次。
+    返回解析得到的 DataFrame，解析失败时抛出异常（上传校验依赖这一点）。
+    """
+    signature = file_signature(csv_path)
+    df = pd.read_csv(csv_path)
+    if pa is None:
+        return df
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata.update(signature_metadata(signature))
+    table = table.replace_schema_metadata(metadata)
+
+    path = columnar_path(csv_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    os.close(fd)
+    try:
+        # 不压缩，读取时才能直接内存映射
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa_ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    bump_version(csv_path)
+    return df
+
+
+def _is_fresh(path, signature):
+    try:
+        reader = _open_table(path)
+        metadata = reader.schema.metadata or {}
+        return metadata.get(SIGNATURE_KEY) == _encode_signature(signature)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable columnar file {path}: {e}")
+        return False
+
+
+def load_dataframe(csv_path, nrows=None):
+    """
+    读取知识库 CSV。
+    优先从内存映射的 Arrow 文件加载；列式文件缺失或落后于 CSV 时先重新转换。
+    未安装 pyarrow 时退回 pd.read_csv。
+    """
+    if pa is None:
+        return pd.read_csv(csv_path, nrows=nrows)
+
+    path = columnar_path(csv_path)
+    if not (os.path.exists(path) and _is_fresh(path, file_signature(csv_path))):
+        df = convert_csv(csv_path)
+        return df.head(nrows) if nrows is not None else df
+
+    table = _open_table(path).read_all()
+    if nrows is not None:
+        table = table.slice(0, nrows)
+    # 数值列在无空值时可直接复用映射的内存
+    return table.to_pandas(split_blocks=True)
+
+
+def load_table(csv_path):
+    """
+    以内存映射方式加载 CSV 对应的 Arrow 表，必要时先重新转换。
+    多个 worker 映射同一个文件时共享操作系统页缓存，不产生额外拷贝。
+    未安装 pyarrow 时返回 None。
+    """
+    if pa is None:
+        return None
+    path = columnar_path(csv_path)
+    if not (os.path.exists(path) and _is_fresh(path, file_signature(csv_path))):
+        convert_csv(csv_path)
+    return _open_table(path).read_all()
+
+
+def remove_columnar(csv_path):
+    """CSV 被删除时清理对应的列式文件，并通知其他 worker"""
+    path = columnar_path(csv_path)
+    if os.path.exists(path):
+        os.remove(path)
+    bump_version(csv_path)
@@ -1,7 +1,12 @@
 import re
 import sys
 import time
-from ..config import agent_runs, _thread_local
+import asyncio
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from ..config import AGENT_LOG_CAPTURE, _thread_local, _current_run, _local_runs, current_run_id
+from ..run_store import run_store
 
 # 更全面的 ANSI 转义码正则表达式
 ANSI_ESCAPE = re.compile(r'''
@@ -11,109 +16,156 @@ ANSI_ESCAPE = re.compile(r'''
     | \x1B\[[0-9;]*[a-zA-Z]
 ''', re.VERBOSE)
 
+# AGENT_LOG_CAPTURE=stdout 时安装的输出包装
+_capture_streams = []
+
+def bind_run(run_id):
+    """
+    把当前线程（异步模式下为当前 task）绑定到运行，并登记为本进程正在执行的运行。
+    事件循环线程由多个运行共用，只绑定 task 的上下文。
+    """
+    _current_run.set(run_id)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _thread_local.run_id = run_id
+    _local_runs.add(run_id)
+
+def unbind_run(run_id):
+    _local_runs.discard(run_id)
+    for stream in _capture_streams:
+        stream.release(run_id)
+    if _current_run.get() == run_id:
+        _current_run.set(None)
+    if getattr(_thread_local, 'run_id', None) == run_id:
+        _thread_local.run_id = None
+
+class RunContextExecutor(ThreadPoolExecutor):
+    """
+    智能体自己的线程池：任务在提交者的上下文中执行，worker 线程里也能通过 current_run_id() 取到当前运行。
+    worker 在多个运行之间复用，任务结束后上下文随之丢弃，不会残留上一个运行的绑定。
+    只用于智能体拥有的线程池，不改动标准库和第三方代码创建的线程与线程池。
+    """
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+# crewai 装饰框的各个部分（逐行匹配）
+BOX_TITLE = re.compile(r'╭[─\s]+(.*?)[─\s]+╮')
+BOX_BOTTOM = re.compile(r'╰[─\s]*╯')
+BOX_BORDER = re.compile(r'[─╭╮╰╯]')
+TITLE_SYMBOLS = re.compile(r'[^\w\s\u4e00-\u9fa5]')
+
+DEFAULT_BOX_TITLE = "Agent 运行日志"
+
+class BoxLogParser:
+    """
+    crewai 控制台输出的流式解析器，每个运行一个。
+    按行推进的状态机：框外的行直接丢弃，框内的行清理后暂存，遇到下框边时产出一条 (标题, 内容)。
+    每段输入只扫描一次，只保留未结束的最后一行，整体耗时与输出总长度成线性关系。
+    """
+    def __init__(self):
+        self._pending = []  # 还没有换行符的最后一行（按写入的片段保存，避免反复拼接）
+        self._title = None  # 当前所在框的标题，不在框内时为 None
+        self._body = []
+
+    def feed(self, data):
+        """消费一段输出，返回其中完整结束的框 [(title, content), ...]"""
+        self._pending.append(data)
+        records = []
+        if '\n' in data:
+            lines = ''.join(self._pending).split('\n')
+            tail = lines.pop()
+            self._pending = [tail] if tail else []
+            for line in lines:
+                record = self._consume_line(line)
+                if record is not None:
+                    records.append(record)
+
+        # 下框边后面没有换行时也要及时产出
+        if self._pending and self._title is not None and '╯' in data:
+            line = ''.join(self._pending)
+            if BOX_BOTTOM.search(ANSI_ESCAPE.sub('', line)):
+                self._pending = []
+                record = self._consume_line(line)
+                if record is not None:
+                    records.append(record)
+        return records
+
+    def _consume_line(self, line):
+        if '\x1b' in line:
+            line = ANSI_ESCAPE.sub('', line)
+
+        if self._title is None:
+            start = line.find('╭')
+            if start != -1:
+                match = BOX_TITLE.search(line, start)
+                title = TITLE_SYMBOLS.sub('', match.group(1)).strip() if match else ''
+                self._title = title or DEFAULT_BOX_TITLE
+                self._body = []
+            return None
+
+        if '╰' in line and BOX_BOTTOM.search(line):
+            title, body = self._title, "\n".join(self._body)
+            self._title = None
+            self._body = []
+            return (title, body) if body else None
+
+        # 移除行首和行尾的 │ 符号以及空白
+        stripped = line.strip().strip('│').strip()
+        # 过滤掉包含过多边框字符的行，以及 CrewAI 的动态进度行
+        if not stripped or '🚀' in stripped or '📋' in stripped:
+            return None
+        if len(BOX_BORDER.findall(stripped)) > 3:
+            return None
+        self._body.append(stripped)
+        return None
+
+
 class ThreadSpecificStdout:
     """
     一个专门的 stdout 包装类，用于捕获不同线程（即不同 Agent 运行实例）的输出。
-    它会识别 CrewAI 的装饰框格式，并将其解析为结构化的日志存入 agent_runs。
+    每个运行的输出交给各自的 BoxLogParser，解析出的装饰框作为结构化日志存入运行状态存储。
+    仅在 AGENT_LOG_CAPTURE=stdout 时安装，默认的事件采集见 agent_events。
     """
     def __init__(self, original_stream):
         self.original_stream = original_stream
-        self.buffers = {}  # 存储每个 run_id 的缓冲区
+        self.parsers = {}  # 每个 run_id 的解析器
+        self.last_logged = {}  # 每个 run_id 最后一条日志的内容，用于去重
 
     def write(self, data):
         # 始终将内容输出到原始控制台，保证终端能看到
         self.original_stream.write(data)
         
-        # 获取当前线程绑定的 run_id
-        run_id = getattr(_thread_local, 'run_id', None)
+        # 获取当前线程（或 task）绑定的 run_id
+        run_id = current_run_id()
         
         # 如果当前线程没有 run_id (可能是 CrewAI 开启了子线程)，
-        # 且当前只有一个正在运行的任务，则尝试归属于该任务。
-        if not run_id:
-            active_runs = [rid for rid, info in agent_runs.items() if info.get("status") in ["running", "waiting"]]
-            if len(active_runs) == 1:
-                run_id = active_runs[0]
-
-        if not run_id or run_id not in agent_runs:
-            return
-
-        if run_id not in self.buffers:
-            self.buffers[run_id] = ""
-            
-        self.buffers[run_id] += data
-        
-        # CrewAI 的日志块通常以 '╰' (下框边) 结束。
-        if '╰' in data:
-            self._process_buffer(run_id)
+        # 且本进程中只有一个正在运行的任务，则尝试归属于该任务。
+        if not run_id and len(_local_runs) == 1:
+            run_id = next(iter(_local_runs), None)
 
-    def _process_buffer(self, run_id):
-        content = self.buffers[run_id]
-        if not content.strip():
+        if not run_id:
             return
 
-        # 1. 清理 ANSI 转义码
-        clean_content = ANSI_ESCAPE.sub('', content)
-        
-        # 2. 寻找最后一个完整的框
-        # 我们寻找 ╭ 到 ╰ 之间的内容
-        box_pattern = re.compile(r'╭(.*?)╰[─\s]+╯', re.DOTALL)
-        matches = list(box_pattern.finditer(clean_content))
-        
-        if not matches:
-            # 如果没有找到完整的框，可能只是普通的 print
-            if '\n' in clean_content and not any(c in clean_content for c in '╭╰│'):
-                self._record_log(run_id, "系统提示", clean_content.strip())
-                self.buffers[run_id] = ""
-            return
+        parser = self.parsers.get(run_id)
+        if parser is None:
+            parser = self.parsers[run_id] = BoxLogParser()
+        for title, content in parser.feed(data):
+            self._record_log(run_id, title, content)
 
-        # 处理所有找到的框
-        for match in matches:
-            full_box = match.group(0)
-            inner_content = match.group(1)
-            
-            # 提取标题
-            title = "Agent 运行日志"
-            title_line = full_box.split('\n')[0]
-            title_match = re.search(r'[─\s]+(.*?)[─\s]+╮', title_line)
-            if title_match:
-                extracted_title = title_match.group(1).strip()
-                if extracted_title:
-                    title = re.sub(r'[^\w\s\u4e00-\u9fa5]', '', extracted_title).strip()
-
-            # 提取主体内容
-            lines = inner_content.split('\n')
-            body_lines = []
-            for line in lines:
-                # 移除行首和行尾的 │ 符号以及空白
-                stripped_line = line.strip().strip('│').strip()
-                # 过滤掉包含过多边框字符的行
-                if len(re.findall(r'[─╭╮╰╯]', stripped_line)) > 3:
-                    continue
-                # 过滤掉 CrewAI 的动态进度行
-                if '🚀' in stripped_line or '📋' in stripped_line:
-                    continue
-                if stripped_line:
-                    body_lines.append(stripped_line)
-            
-            final_body = "\n".join(body_lines)
-            if final_body:
-                self._record_log(run_id, title, final_body)
-
-        # 清除已处理的部分
-        last_match_end = matches[-1].end()
-        self.buffers[run_id] = clean_content[last_match_end:]
+    def release(self, run_id):
+        """运行结束后丢弃它的解析状态"""
+        self.parsers.pop(run_id, None)
+        self.last_logged.pop(run_id, None)
 
     def _record_log(self, run_id, title, content):
-        """记录日志到 agent_runs"""
-        if "logs" not in agent_runs[run_id]:
-            agent_runs[run_id]["logs"] = []
-            
+        """记录日志到运行状态存储"""
         # 避免重复记录完全相同的内容
-        if agent_runs[run_id]["logs"]:
-            if agent_runs[run_id]["logs"][-1]["content"] == content:
-                return
+        if self.last_logged.get(run_id) == content:
+            return
+        self.last_logged[run_id] = content
 
-        agent_runs[run_id]["logs"].append({
+        run_store.append_log(run_id, {
             "title": title,
             "content": content,
             "timestamp": time.time()
@@ -126,6 +178,15 @@ class ThreadSpecificStdout:
         return self.original_stream.isatty()
 
 def setup_logging():
-    """初始化日志重定向"""
-    sys.stdout = ThreadSpecificStdout(sys.stdout)
-    sys.stderr = ThreadSpecificStdout(sys.stderr)
+    """
+    初始化运行日志的采集。
+    默认通过 crewai 的事件和钩子记录结构化日志，stdout 原样输出到终端，不经过任何包装；
+    AGENT_LOG_CAPTURE=stdout 时改为拦截 stdout/stderr 并解析 crewai 的装饰框。
+    """
+    if AGENT_LOG_CAPTURE == 'stdout':
+        sys.stdout = ThreadSpecificStdout(sys.stdout)
+        sys.stderr = ThreadSpecificStdout(sys.stderr)
+        _capture_streams.extend((sys.stdout, sys.stderr))
+        return
+    from .agent_events import setup_event_capture
+    setup_event_capture()
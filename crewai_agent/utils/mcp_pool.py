@@ -0,0 +1,314 @@
+import time
+import atexit
+import asyncio
+import threading
+import logging
+from contextlib import contextmanager
+from mcp.client.stdio import stdio_client
+from mcp.client.session import ClientSession
+from mcp.shared.exceptions import McpError
+from ..config import (
+    MCP_POOL_MAX_SIZE, MCP_POOL_IDLE_TIMEOUT, MCP_POOL_HEALTH_INTERVAL,
+    MCP_POOL_ACQUIRE_TIMEOUT, MCP_START_TIMEOUT, MCP_CALL_TIMEOUT,
+)
+
+logger = logging.getLogger('crewai_agent')
+
+# 健康检查 ping 的超时（秒）
+PING_TIMEOUT = 5
+
+
+class MCPPoolExhausted(Exception):
+    """会话池已满且在等待时间内没有会话被归还"""
+    pass
+
+
+def session_key(params):
+    """会话的复用键：同一个服务器命令 + 同一组 (base_url, api_key) 共享会话"""
+    env = params.env or {}
+    return (
+        params.command,
+        tuple(params.args),
+        env.get("LOGEASE_BASE_URL", ""),
+        env.get("LOGEASE_API_KEY", ""),
+    )
+
+
+def _tool_dicts(result):
+    return [{
+        "name": t.name,
+        "description": t.description,
+        "input_schema": t.inputSchema
+    } for t in result.tools]
+
+
+class MCPSession:
+    """
+    一个常驻的 MCP stdio 会话（一个 node 子进程）。
+    stdio_client 和 ClientSession 基于 anyio，必须在同一个 task 中进入和退出，
+    因此每个会话由池事件循环上的一个长期 task 持有，其他线程通过 run_coroutine_threadsafe 调用。
+    """
+    def __init__(self, key, params, loop):
+        self.key = key
+        self.params = params
+        self.loop = loop
+        self.session = None
+        self.tools = []
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.broken = False
+        self._closing = None
+        self._task = None
+
+    @property
+    def alive(self):
+        return self.session is not None and not self.broken and not self._task.done()
+
+    def start(self, timeout=MCP_START_TIMEOUT):
+        """启动子进程并完成 initialize，同时取得工具列表"""
+        ready = asyncio.run_coroutine_threadsafe(self._start(), self.loop)
+        try:
+            ready.result(timeout=timeout)
+        except BaseException:
+            ready.cancel()
+            self.close()
+            raise
+
+    async def _start(self):
+        ready = self.loop.create_future()
+        self._closing = asyncio.Event()
+        self._task = self.loop.create_task(self._serve(ready))
+        await ready
+
+    async def _serve(self, ready):
+        try:
+            async with stdio_client(self.params) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.tools = _tool_dicts(await session.list_tools())
+                    self.session = session
+                    ready.set_result(None)
+                    await self._closing.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e if isinstance(e, Exception) else RuntimeError(str(e)))
+            elif not self._closing.is_set():
+                logger.warning(f"MCP session {self.key[2]} exited unexpectedly: {e}")
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            self.session = None
+
+    def _schedule(self, make_coro):
+        session = self.session
+        if session is None or not self.alive:
+            raise ConnectionError("MCP session is not connected")
+        return asyncio.run_coroutine_threadsafe(make_coro(session), self.loop)
+
+    def _submit(self, make_coro, timeout):
+        future = self._schedule(make_coro)
+        try:
+            return future.result(timeout=timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def call_tool(self, name, arguments, timeout=MCP_CALL_TIMEOUT):
+        """调用工具；连接层面的失败（超时、管道断开）会把会话标记为损坏，归还时直接丢弃"""
+        try:
+            return self._submit(lambda session: session.call_tool(name, arguments), timeout)
+        except McpError:
+            # 服务器返回的 JSON-RPC 错误，连接本身仍然可用
+            raise
+        except Exception:
+            self.broken = True
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+    async def acall_tool(self, name, arguments, timeout=MCP_CALL_TIMEOUT):
+        """call_tool 的异步版本，可在其他事件循环上 await，等待期间不占用线程"""
+        try:
+            future = self._schedule(lambda session: session.call_tool(name, arguments))
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+        except McpError:
+            raise
+        except Exception:
+            self.broken = True
+            raise
+        finally:
+            self.last_used = time.monotonic()
+
+    def refresh_tools(self, timeout=MCP_CALL_TIMEOUT):
+        """重新获取工具列表"""
+        self.tools = _tool_dicts(self._submit(lambda session: session.list_tools(), timeout))
+        return self.tools
+
+    def ping(self, timeout=PING_TIMEOUT):
+        try:
+            self._submit(lambda session: session.send_ping(), timeout)
+            return True
+        except Exception as e:
+            logger.info(f"MCP session {self.key[2]} failed health check: {e}")
+            self.broken = True
+            return False
+
+    def close(self):
+        """通知持有会话的 task 退出，不等待子进程结束（可在事件循环线程中调用）"""
+        self.broken = True
+        self.loop.call_soon_threadsafe(self._shutdown)
+
+    def _shutdown(self):
+        if self._closing is not None:
+            self._closing.set()
+        # 还没完成 initialize 的会话（例如启动超时）直接取消
+        if self._task is not None and self.session is None and not self._task.done():
+            self._task.cancel()
+
+
+class MCPSessionPool:
+    """
+    MCP 会话池。
+    按 (base_url, api_key) 缓存已完成 initialize 的会话，运行开始时借出、结束时归还；
+    空闲超过 idle_timeout 的会话由后台定时回收，会话总数不超过 max_size。
+    池满时优先关闭其他凭据下最久未用的空闲会话，否则等待其他运行归还。
+    """
+    def __init__(self, max_size=MCP_POOL_MAX_SIZE, idle_timeout=MCP_POOL_IDLE_TIMEOUT,
+                 health_interval=MCP_POOL_HEALTH_INTERVAL):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_interval = health_interval
+        self._cond = threading.Condition()
+        self._idle = {}
+        self._size = 0
+        self._loop = None
+        self._thread = None
+
+    def _ensure_loop(self):
+        with self._cond:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, name="mcp-session-pool", daemon=True
+                )
+                self._thread.start()
+                asyncio.run_coroutine_threadsafe(self._reaper(), self._loop)
+            return self._loop
+
+    async def _reaper(self):
+        interval = max(min(self.idle_timeout / 2, 60), 1)
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    def acquire(self, params, timeout=MCP_POOL_ACQUIRE_TIMEOUT):
+        """借出一个可用会话，没有可复用的会话时启动新的子进程"""
+        key = session_key(params)
+        loop = self._ensure_loop()
+        deadline = time.monotonic() + timeout
+        while True:
+            candidate = None
+            with self._cond:
+                while True:
+                    idle = self._idle.get(key)
+                    if idle:
+                        candidate = idle.pop()
+                        break
+                    if self._size < self.max_size or self._evict_lru_locked():
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise MCPPoolExhausted(f"MCP session pool is full ({self.max_size} sessions in use)")
+                    self._cond.wait(remaining)
+
+            if candidate is None:
+                session = MCPSession(key, params, loop)
+                try:
+                    session.start()
+                except BaseException:
+                    self._discard(session)
+                    raise
+                logger.info(f"Started MCP session for {key[2]} ({len(session.tools)} tools)")
+                return session
+
+            if self._healthy(candidate):
+                return candidate
+            self._discard(candidate)
+
+    def release(self, session):
+        """归还会话；已损坏的会话直接关闭"""
+        if not session.alive:
+            self._discard(session)
+            return
+        session.last_used = time.monotonic()
+        with self._cond:
+            self._idle.setdefault(session.key, []).append(session)
+            self._cond.notify()
+
+    @contextmanager
+    def session(self, params, timeout=MCP_POOL_ACQUIRE_TIMEOUT):
+        session = self.acquire(params, timeout=timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def _healthy(self, session):
+        if not session.alive:
+            return False
+        if time.monotonic() - session.last_used < self.health_interval:
+            return True
+        return session.ping()
+
+    def _discard(self, session):
+        session.close()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def _evict_lru_locked(self):
+        """关闭所有凭据中最久未用的一个空闲会话，为新会话腾出位置"""
+        oldest = None
+        for sessions in self._idle.values():
+            for session in sessions:
+                if oldest is None or session.last_used < oldest.last_used:
+                    oldest = session
+        if oldest is None:
+            return False
+        self._idle[oldest.key].remove(oldest)
+        oldest.close()
+        self._size -= 1
+        return True
+
+    def evict_idle(self):
+        """回收空闲超时或已经断开的会话"""
+        now = time.monotonic()
+        with self._cond:
+            for key in list(self._idle):
+                keep = []
+                for session in self._idle[key]:
+                    if session.alive and now - session.last_used < self.idle_timeout:
+                        keep.append(session)
+                    else:
+                        session.close()
+                        self._size -= 1
+                        self._cond.notify()
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+
+    def close_all(self):
+        """关闭全部空闲会话（进程退出时调用）"""
+        with self._cond:
+            for sessions in self._idle.values():
+                for session in sessions:
+                    session.close()
+                    self._size -= 1
+            self._idle.clear()
+
+
+# 进程内共享的会话池
+mcp_session_pool = MCPSessionPool()
+atexit.register(mcp_session_pool.close_all)
@@ -1,9 +1,10 @@
 import os
-import asyncio
+import time
+import threading
 import logging
-from mcp.client.stdio import stdio_client, StdioServerParameters
-from mcp.client.session import ClientSession
-from ..config import LOG_TOOLS_SERVER_PATH
+from mcp.client.stdio import StdioServerParameters
+from ..config import LOG_TOOLS_SERVER_PATH, MCP_TOOLS_CACHE_TTL, MCP_TOOLS_ERROR_TTL
+from .mcp_pool import mcp_session_pool, session_key
 
 logger = logging.getLogger('crewai_agent')
 
@@ -23,19 +24,66 @@ def get_rizhiyi_server_params(base_url, api_key, username=None):
         }
     )
 
-async def list_mcp_tools(params: StdioServerParameters):
-    """列出指定 MCP 服务器的所有工具"""
+def list_mcp_tools(params: StdioServerParameters, refresh=False):
+    """
+    列出指定 MCP 服务器的所有工具。
+    借用会话池中的常驻会话，工具列表在会话启动时已取得；refresh=True 时重新向服务器获取。
+    """
     try:
-        async with asyncio.timeout(10):
-            async with stdio_client(params) as (read, write):
-                async with ClientSession(read, write) as session:
-                    await session.initialize()
-                    tools_result = await session.list_tools()
-                    return [{
-                        "name": t.name,
-                        "description": t.description,
-                        "input_schema": t.inputSchema
-                    } for t in tools_result.tools]
+        with mcp_session_pool.session(params) as session:
+            return list(session.refresh_tools() if refresh else session.tools)
     except Exception as e:
         logger.error(f"Error listing MCP tools: {e}")
         return []
+
+
+# 工具列表缓存：{会话键: (获取时间, 工具列表)}
+_tools_cache = {}
+_refreshing = set()
+_fetch_locks = {}
+_cache_lock = threading.Lock()
+
+
+def _fetch_tools(key, params):
+    tools = list_mcp_tools(params, refresh=True)
+    _tools_cache[key] = (time.time(), tools)
+    return tools
+
+
+def _background_refresh(key, params):
+    try:
+        _fetch_tools(key, params)
+    finally:
+        with _cache_lock:
+            _refreshing.discard(key)
+
+
+def get_cached_mcp_tools(params: StdioServerParameters, refresh=False):
+    """
+    按凭据缓存的工具列表，返回 (工具列表, 获取时间)。
+    缓存过期后先返回旧结果，同时在后台刷新；没有缓存或 refresh=True 时同步获取。
+    获取失败（空列表）只缓存 MCP_TOOLS_ERROR_TTL，避免每次请求都去等待启动超时。
+    """
+    key = session_key(params)
+    cached = _tools_cache.get(key)
+    if cached is not None and not refresh:
+        fetched_at, tools = cached
+        ttl = MCP_TOOLS_CACHE_TTL if tools else MCP_TOOLS_ERROR_TTL
+        if time.time() - fetched_at >= ttl:
+            with _cache_lock:
+                start = key not in _refreshing
+                _refreshing.add(key)
+            if start:
+                threading.Thread(target=_background_refresh, args=(key, params), daemon=True).start()
+        return tools, fetched_at
+
+    # 同一组凭据的并发请求只获取一次
+    with _cache_lock:
+        fetch_lock = _fetch_locks.setdefault(key, threading.Lock())
+    with fetch_lock:
+        current = _tools_cache.get(key)
+        if current is not None and current is not cached:
+            # 等锁期间其他请求已经取到了新结果
+            return current[1], current[0]
+        tools = _fetch_tools(key, params)
+        return tools, _tools_cache[key][0]
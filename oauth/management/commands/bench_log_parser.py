@@ -0,0 +1,114 @@
+import io
+import re
+import time
+from django.core.management.base import BaseCommand
+from crewai_agent.utils.logging import ANSI_ESCAPE, BoxLogParser
+
+
+def _legacy_parse(chunks):
+    """
+    原先 ThreadSpecificStdout 的做法，作为对照：
+    每次写入都拼接到整段缓冲区，遇到下框边时重新编译正则并扫描整个缓冲区。
+    """
+    buffer = ""
+    records = []
+    for data in chunks:
+        buffer += data
+        if '╰' not in data:
+            continue
+        clean_content = ANSI_ESCAPE.sub('', buffer)
+        box_pattern = re.compile(r'╭(.*?)╰[─\s]+╯', re.DOTALL)
+        matches = list(box_pattern.finditer(clean_content))
+        if not matches:
+            continue
+        for match in matches:
+            title = "Agent 运行日志"
+            title_match = re.search(r'[─\s]+(.*?)[─\s]+╮', match.group(0).split('\n')[0])
+            if title_match and title_match.group(1).strip():
+                title = re.sub(r'[^\w\s\u4e00-\u9fa5]', '', title_match.group(1).strip()).strip()
+            body_lines = []
+            for line in match.group(1).split('\n'):
+                stripped_line = line.strip().strip('│').strip()
+                if len(re.findall(r'[─╭╮╰╯]', stripped_line)) > 3:
+                    continue
+                if '🚀' in stripped_line or '📋' in stripped_line:
+                    continue
+                if stripped_line:
+                    body_lines.append(stripped_line)
+            if body_lines:
+                records.append((title, "\n".join(body_lines)))
+        buffer = clean_content[matches[-1].end():]
+    return records
+
+
+def _streaming_parse(chunks):
+    parser = BoxLogParser()
+    records = []
+    for data in chunks:
+        records.extend(parser.feed(data))
+    return records
+
+
+def _sample_transcript(steps, output_lines):
+    """用 crewai 自己的控制台格式化器生成一段 verbose 运行输出（带 ANSI 颜色）"""
+    from rich.console import Console
+    from crewai.agents.parser import AgentAction, AgentFinish
+    from crewai.events.utils.console_formatter import ConsoleFormatter
+
+    buffer = io.StringIO()
+    formatter = ConsoleFormatter(verbose=True)
+    formatter.console = Console(file=buffer, force_terminal=True, width=120)
+    role = 'Log Analysis Assistant'
+    formatter.handle_agent_logs_started(role, 'Answer the user query: "Explain error 500 and check recent logs."', True)
+    for step in range(steps):
+        output = "\n".join(
+            f"2024-05-01 10:{step % 60:02d}:{line % 60:02d} ERROR [web-{line % 7}] HTTP 500 upstream timeout request_id={step}-{line}"
+            for line in range(output_lines)
+        )
+        action = AgentAction(
+            thought=f"Step {step}: search recent error logs for the failing service.",
+            tool='search_logs',
+            tool_input=f'{{"query": "status:500 AND step:{step}", "time_range": "-1h"}}',
+            text='',
+            result=output,
+        )
+        formatter.handle_agent_logs_execution(role, action, True)
+    formatter.handle_agent_logs_execution(role, AgentFinish(thought='Done.', output='Root cause: upstream timeout.', text=''), True)
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks parsing of captured CrewAI console output (AGENT_LOG_CAPTURE=stdout)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('transcripts', nargs='*', help='Recorded verbose CrewAI output files; a sample run is generated if omitted')
+        parser.add_argument('--chunk-size', type=int, default=64, help='Bytes per simulated stdout write')
+        parser.add_argument('--steps', type=int, default=50, help='Tool steps in the generated sample run')
+        parser.add_argument('--output-lines', type=int, default=40, help='Tool output lines per step in the generated sample run')
+
+    def handle(self, *args, **options):
+        if options['transcripts']:
+            transcripts = []
+            for path in options['transcripts']:
+                with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                    transcripts.append((path, f.read()))
+        else:
+            transcripts = [('sample', _sample_transcript(options['steps'], options['output_lines']))]
+
+        size = options['chunk_size']
+        for name, text in transcripts:
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            self.stdout.write(f'{name}: {len(text)} chars in {len(chunks)} writes')
+
+            timings = {}
+            results = {}
+            for label, parse in (('legacy', _legacy_parse), ('streaming', _streaming_parse)):
+                start = time.perf_counter()
+                results[label] = parse(chunks)
+                timings[label] = time.perf_counter() - start
+                self.stdout.write(f'  {label:<10} {timings[label] * 1000:10.1f} ms  {len(results[label])} records')
+
+            if results['legacy'] != results['streaming']:
+                self.stdout.write(self.style.WARNING('  parsers produced different records'))
+            speedup = timings['legacy'] / timings['streaming'] if timings['streaming'] else float('inf')
+            self.stdout.write(self.style.SUCCESS(f'  speedup: {speedup:.1f}x'))
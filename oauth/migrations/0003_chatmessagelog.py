@@ -0,0 +1,83 @@
+# Generated by Django 5.2.9 on 2026-10-17 22:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def _legacy_entries(logs):
+    """旧数据中的 logs 不一定是字典列表：单个对象、字符串等统一包装成 {"title", "content"} 字典"""
+    if not isinstance(logs, list):
+        logs = [logs]
+    return [entry if isinstance(entry, dict) else {"title": "", "content": entry} for entry in logs]
+
+
+def move_logs(apps, schema_editor):
+    """把 ChatMessage.logs 中的日志拆成 ChatMessageLog 的行，并生成摘要"""
+    ChatMessage = apps.get_model("oauth", "ChatMessage")
+    ChatMessageLog = apps.get_model("oauth", "ChatMessageLog")
+    for message in ChatMessage.objects.exclude(logs=None).iterator():
+        logs = _legacy_entries(message.logs)
+        ChatMessageLog.objects.bulk_create(
+            [ChatMessageLog(message=message, seq=seq, entry=entry) for seq, entry in enumerate(logs, 1)],
+            batch_size=500,
+        )
+        message.log_summary = {
+            "count": len(logs),
+            "tool_calls": sum(1 for entry in logs if entry.get("title") in ("执行工具", "使用工具")),
+            "errors": sum(1 for entry in logs if entry.get("title") == "执行错误"),
+        }
+        message.save(update_fields=["log_summary"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("oauth", "0002_chatsession_chatmessage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="chatmessage",
+            name="log_summary",
+            field=models.JSONField(blank=True, null=True, verbose_name="执行日志摘要"),
+        ),
+        migrations.CreateModel(
+            name="ChatMessageLog",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("seq", models.PositiveIntegerField(verbose_name="序号")),
+                ("entry", models.JSONField(verbose_name="日志内容")),
+                (
+                    "message",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="log_entries",
+                        to="oauth.chatmessage",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "执行日志",
+                "verbose_name_plural": "执行日志",
+                "ordering": ["message", "seq"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("message", "seq"), name="chat_message_log_seq"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(move_logs, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name="chatmessage",
+            name="logs",
+        ),
+    ]
@@ -36,7 +36,8 @@ class ChatMessage(models.Model):
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
     role = models.CharField(max_length=20, choices=ROLE_CHOICES)
     content = models.TextField(verbose_name="消息内容")
-    logs = models.JSONField(verbose_name="执行日志", null=True, blank=True)
+    # 执行日志存放在 ChatMessageLog 中，这里只保留摘要（条数、工具调用次数、错误数）
+    log_summary = models.JSONField(verbose_name="执行日志摘要", null=True, blank=True)
     status = models.CharField(max_length=20, default='completed')
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -47,3 +48,20 @@ class ChatMessage(models.Model):
         verbose_name = "聊天消息"
         verbose_name_plural = "聊天消息"
         ordering = ['created_at']
+
+class ChatMessageLog(models.Model):
+    """智能体回复的执行日志，每条一行，按序号分页读取"""
+    message = models.ForeignKey(ChatMessage, on_delete=models.CASCADE, related_name='log_entries')
+    seq = models.PositiveIntegerField(verbose_name="序号")
+    entry = models.JSONField(verbose_name="日志内容")
+
+    def __str__(self):
+        return f"{self.message_id}#{self.seq}: {self.entry.get('title', '')}"
+
+    class Meta:
+        verbose_name = "执行日志"
+        verbose_name_plural = "执行日志"
+        ordering = ['message', 'seq']
+        constraints = [
+            models.UniqueConstraint(fields=['message', 'seq'], name='chat_message_log_seq'),
+        ]
@@ -43,7 +43,9 @@ document.addEventListener('DOMContentLoaded', function() {
 
     let currentRunId = null;
     let pollInterval = null;
-    let lastLogsJson = '';
+    let eventSource = null;
+    let renderedLogCount = 0; // 当前运行已渲染的日志条数（即最后一条的序号）
+    let pollCursor = 0; // 轮询模式下的日志游标
     let currentSessionId = null;
 
     // 自动调整输入框高度
@@ -304,7 +306,7 @@ document.addEventListener('DOMContentLoaded', function() {
                         // 如果下一条是 agent，我们把它们成对渲染
                         const nextMsg = data.history[i+1];
                         if (nextMsg && nextMsg.role === 'agent') {
-                            renderHistoryPair(msg.content, nextMsg.content, nextMsg.logs);
+                            renderHistoryPair(msg.content, nextMsg.content, nextMsg);
                             i++; // 跳过下一条
                         } else {
                             renderHistoryPair(msg.content, null, null);
@@ -318,17 +320,18 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
-    function renderHistoryPair(userQuery, agentResult, logs) {
+    function renderHistoryPair(userQuery, agentResult, agentMessage) {
         const els = createNewMessagePair(userQuery);
         chatHistory.push({ role: 'user', content: userQuery });
         
-        if (agentResult || logs) {
+        if (agentResult || agentMessage) {
             els.thinkingProcess.style.display = 'none';
             els.loadingIndicator.style.display = 'none';
             
-            if (logs && logs.length > 0) {
+            const summary = agentMessage && agentMessage.log_summary;
+            if (summary && summary.count > 0) {
                 els.thinkingProcess.style.display = 'block';
-                els.logContent.innerHTML = parseLogs(logs);
+                setupLazyLogs(els, agentMessage.id, summary);
             }
             
             if (agentResult) {
@@ -339,6 +342,57 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // 历史消息的思考轨迹默认折叠，展开时才分页请求日志
+    function setupLazyLogs(els, messageId, summary) {
+        const details = els.thinkingProcess.querySelector('.thinking-details');
+        const label = els.thinkingProcess.querySelector('.thinking-summary span');
+        details.open = false;
+        label.innerText = `智能体思考轨迹（${summary.count} 条日志，${summary.tool_calls} 次工具调用）`;
+        els.logContent.innerHTML = '';
+
+        let cursor = 0;
+        let loading = false;
+
+        async function loadPage() {
+            if (loading) return;
+            loading = true;
+            const moreButton = els.logContent.querySelector('.load-more-logs');
+            if (moreButton) moreButton.remove();
+            try {
+                const response = await fetch(`${config.messageLogsUrl}${messageId}/?since=${cursor}`);
+                const data = await response.json();
+                if (!response.ok) throw new Error(data.error || response.statusText);
+
+                if (data.logs.length > 0) {
+                    els.logContent.insertAdjacentHTML('beforeend', parseLogs(data.logs));
+                }
+                cursor = data.cursor;
+                if (data.has_more) {
+                    const more = document.createElement('button');
+                    more.className = 'load-more-logs';
+                    more.type = 'button';
+                    more.innerText = `加载更多日志（${cursor}/${summary.count}）`;
+                    more.style.cssText = 'display: block; margin: 8px auto; padding: 4px 16px; border: 1px solid #d9d9d9; border-radius: 12px; background: #fff; color: #595959; font-size: 12px; cursor: pointer;';
+                    more.addEventListener('click', loadPage);
+                    els.logContent.appendChild(more);
+                }
+            } catch (err) {
+                console.error('Failed to load message logs:', err);
+                els.logContent.insertAdjacentHTML('beforeend', '<div style="color: #ff4d4f; font-style: italic; text-align: center;">日志加载失败，请收起后重新展开。</div>');
+            } finally {
+                loading = false;
+            }
+        }
+
+        details.addEventListener('toggle', function() {
+            // 首次展开（或上次加载失败后重新展开）时加载第一页
+            if (details.open && cursor === 0) {
+                els.logContent.innerHTML = '';
+                loadPage();
+            }
+        });
+    }
+
     // Enter 键提交，Shift+Enter 换行
     queryInput.addEventListener('keydown', function(e) {
         if (e.key === 'Enter' && !e.shiftKey) {
@@ -448,6 +502,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 els.hitlContainer.style.display = 'none';
                 els.hitlInput.value = '';
                 els.loadingIndicator.style.display = 'block';
+            } else if (data.error) {
+                // 恢复挂起的运行时可能因排队已满被拒绝，保留输入框以便重试
+                showError(data.error);
             }
         } catch (err) {
             showError(err.message);
@@ -473,7 +530,7 @@ document.addEventListener('DOMContentLoaded', function() {
         // Reset thinking process
         currentElements.thinkingProcess.style.display = 'block';
         currentElements.logContent.innerHTML = '<div style="color: #8c8c8c; font-style: italic;">准备开始任务...</div>';
-        lastLogsJson = ''; // 重置日志追踪
+        renderedLogCount = 0; // 重置日志追踪
         updateStatus('running');
         
         // 清空并重置输入框高度
@@ -509,8 +566,14 @@ document.addEventListener('DOMContentLoaded', function() {
             chatHistory.push({ role: 'user', content: query });
 
             currentRunId = data.run_id;
+            if (data.queue_position) updateStatus('queued', data.queue_position);
             startPolling();
         } catch (err) {
+            // 被拒绝（如排队已满）时恢复输入状态
+            updateStatus('error');
+            submitBtn.style.display = 'flex';
+            submitBtn.disabled = false;
+            stopBtn.style.display = 'none';
             showError(err.message);
         }
     });
@@ -545,7 +608,18 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 
     function startPolling() {
-        if (pollInterval) clearInterval(pollInterval);
+        stopPolling();
+        // 服务端运行在 ASGI 下时优先使用 SSE 推送；WSGI 下或浏览器不支持时轮询
+        if (config.useSse && window.EventSource) {
+            startStream();
+        } else {
+            startStatusPolling();
+        }
+    }
+
+    function startStatusPolling() {
+        // 从已渲染的位置继续（SSE 连接失败后退回轮询时不重复拉取）
+        pollCursor = renderedLogCount;
         pollInterval = setInterval(checkStatus, 2000);
     }
 
@@ -554,75 +628,124 @@ document.addEventListener('DOMContentLoaded', function() {
             clearInterval(pollInterval);
             pollInterval = null;
         }
+        if (eventSource) {
+            eventSource.close();
+            eventSource = null;
+        }
+    }
+
+    function startStream() {
+        const source = new EventSource(`/oauth/crewai/stream/${currentRunId}/`);
+        eventSource = source;
+
+        source.addEventListener('log', function(e) {
+            // 事件 id 是日志序号，重连时已渲染过的日志跳过
+            const seq = Number(e.lastEventId);
+            if (seq && seq <= renderedLogCount) return;
+            appendLogs([JSON.parse(e.data)]);
+        });
+        source.addEventListener('status', function(e) {
+            handleStatus(JSON.parse(e.data));
+        });
+        source.addEventListener('end', function() {
+            // 主动关闭，避免 EventSource 在服务端断开后自动重连
+            if (eventSource === source) stopPolling();
+        });
+        source.onerror = function() {
+            // 断线时浏览器会带着 Last-Event-ID 自动重连；连接被拒绝（如 404）时退回轮询
+            if (source.readyState === EventSource.CLOSED && eventSource === source) {
+                eventSource = null;
+                startStatusPolling();
+            }
+        };
     }
 
     async function checkStatus() {
         if (!currentRunId || !currentElements) return;
 
         try {
-            const response = await fetch(`/oauth/crewai/status/${currentRunId}/`);
+            // 只请求上次游标之后的新日志
+            const response = await fetch(`/oauth/crewai/status/${currentRunId}/?since=${pollCursor}`);
             const data = await response.json();
 
-            updateStatus(data.status);
-            
-            // Update logs with parsing
-            if (data.logs && data.logs.length > 0) {
-                const logsJson = JSON.stringify(data.logs);
-                // 只有当日志内容真正发生变化时才更新 DOM，避免页面抖动
-                if (logsJson !== lastLogsJson) {
-                    const isScrolledToBottom = scrollArea.scrollHeight - scrollArea.clientHeight <= scrollArea.scrollTop + 50;
-                    currentElements.logContent.innerHTML = parseLogs(data.logs);
-                    lastLogsJson = logsJson;
-                    
-                    // 自动滚动日志展示区域到最新内容
-                    scrollLogsToBottom();
-                    
-                    if (isScrolledToBottom) {
-                        scrollToBottom();
-                    }
-                }
+            // 请求重叠时只接受从当前游标开始的那一批，避免重复追加
+            if (data.logs && data.logs.length > 0 && data.cursor - data.logs.length === pollCursor) {
+                pollCursor = data.cursor;
+                appendLogs(data.logs);
             }
-
-            if (data.status === 'waiting') {
-                currentElements.loadingIndicator.style.display = 'none';
-                currentElements.hitlContainer.style.display = 'block';
-                currentElements.hitlPrompt.innerText = data.prompt || '智能体需要您的反馈以继续。';
-                scrollToBottom();
-            } else if (data.status === 'completed') {
-                stopPolling();
-                currentElements.loadingIndicator.style.display = 'none';
-                currentElements.resultContainer.style.display = 'block';
-                currentElements.resultContent.innerHTML = marked.parse(data.result || '');
-                
-                // 将 Agent 的回复加入历史
-                chatHistory.push({ role: 'agent', content: data.result || '' });
-                
-                // 运行完成后刷新会话列表，因为标题可能已更新
-                loadSessions();
-                
-                submitBtn.style.display = 'flex';
-                submitBtn.disabled = false;
-                stopBtn.style.display = 'none';
-                scrollToBottom();
-            } else if (data.status === 'error' || data.status === 'stopped') {
-                stopPolling();
-                currentElements.loadingIndicator.style.display = 'none';
-                if (data.status === 'error') {
-                    showError(data.result);
-                } else {
-                    currentElements.logContent.innerHTML += '<div style="color: #ff4d4f; font-style: italic; text-align: center; margin-top: 10px;">任务已手动停止。</div>';
-                    scrollLogsToBottom();
-                }
-                submitBtn.style.display = 'flex';
-                submitBtn.disabled = false;
-                stopBtn.style.display = 'none';
-                scrollToBottom();
+            if (data.has_more) {
+                // 日志分页返回，还有未取完的部分时立即取下一页
+                checkStatus();
+                return;
             }
+            handleStatus(data);
         } catch (err) {
             console.error('Polling error:', err);
         }
     }
 
+    function appendLogs(logs) {
+        // 只渲染新到的日志并追加到末尾，已有的节点不重建
+        if (!logs.length) return;
+
+        const isScrolledToBottom = scrollArea.scrollHeight - scrollArea.clientHeight <= scrollArea.scrollTop + 50;
+        if (renderedLogCount === 0) {
+            // 清除"准备开始任务..."占位
+            currentElements.logContent.innerHTML = '';
+        }
+        currentElements.logContent.insertAdjacentHTML('beforeend', parseLogs(logs));
+        renderedLogCount += logs.length;
+
+        // 自动滚动日志展示区域到最新内容
+        scrollLogsToBottom();
+
+        if (isScrolledToBottom) {
+            scrollToBottom();
+        }
+    }
+
+    function handleStatus(data) {
+        if (!currentElements) return;
+
+        updateStatus(data.status, data.queue_position);
+
+        if (data.status === 'waiting') {
+            currentElements.loadingIndicator.style.display = 'none';
+            currentElements.hitlContainer.style.display = 'block';
+            currentElements.hitlPrompt.innerText = data.prompt || '智能体需要您的反馈以继续。';
+            scrollToBottom();
+        } else if (data.status === 'completed') {
+            stopPolling();
+            currentElements.loadingIndicator.style.display = 'none';
+            currentElements.resultContainer.style.display = 'block';
+            currentElements.resultContent.innerHTML = marked.parse(data.result || '');
+            
+            // 将 Agent 的回复加入历史
+            chatHistory.push({ role: 'agent', content: data.result || '' });
+            
+            // 运行完成后刷新会话列表，因为标题可能已更新
+            loadSessions();
+            
+            submitBtn.style.display = 'flex';
+            submitBtn.disabled = false;
+            stopBtn.style.display = 'none';
+            scrollToBottom();
+        } else if (data.status === 'error' || data.status === 'stopped') {
+            stopPolling();
+            currentElements.loadingIndicator.style.display = 'none';
+            if (data.status === 'error') {
+                showError(data.result);
+            } else {
+                currentElements.logContent.innerHTML += '<div style="color: #ff4d4f; font-style: italic; text-align: center; margin-top: 10px;">任务已手动停止。</div>';
+                scrollLogsToBottom();
+            }
+            submitBtn.style.display = 'flex';
+            submitBtn.disabled = false;
+            stopBtn.style.display = 'none';
+            scrollToBottom();
+        }
+    }
+
     function parseLogs(logs) {
         if (!Array.isArray(logs)) return '';
         
@@ -717,10 +840,16 @@ document.addEventListener('DOMContentLoaded', function() {
         return html || '<div style="color: #8c8c8c; font-style: italic; text-align: center; padding: 20px;">智能体正在思考中...</div>';
     }
 
-    function updateStatus(status) {
+    function updateStatus(status, queuePosition) {
         if (!currentElements) return;
         currentElements.statusBadge.innerText = status.toUpperCase();
-        if (status === 'running') {
+        if (status === 'queued') {
+            // 排队中：显示当前排在第几位
+            if (queuePosition) currentElements.statusBadge.innerText = `QUEUED #${queuePosition}`;
+            currentElements.statusBadge.style.background = '#f5f5f5';
+            currentElements.statusBadge.style.color = '#8c8c8c';
+            currentElements.loadingIndicator.style.display = 'block';
+        } else if (status === 'running') {
             currentElements.statusBadge.style.background = '#e6f7ff';
             currentElements.statusBadge.style.color = '#1890ff';
             currentElements.loadingIndicator.style.display = 'block';
@@ -0,0 +1,76 @@
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase
+
+
+class MoveLogsMigrationTests(TransactionTestCase):
+    """0003 把 ChatMessage.logs 拆到 ChatMessageLog，旧数据里的 logs 不保证是字典列表"""
+
+    migrate_from = [("oauth", "0002_chatsession_chatmessage")]
+    migrate_to = [("oauth", "0003_chatmessagelog")]
+
+    def setUp(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        old_apps = executor.loader.project_state(self.migrate_from).apps
+        UserProfile = old_apps.get_model("oauth", "UserProfile")
+        ChatSession = old_apps.get_model("oauth", "ChatSession")
+        ChatMessage = old_apps.get_model("oauth", "ChatMessage")
+
+        session = ChatSession.objects.create(user=UserProfile.objects.create(rizhiyi_id="u1"), title="t")
+        self.message_ids = {
+            name: ChatMessage.objects.create(session=session, role="agent", content=name, logs=logs).id
+            for name, logs in {
+                "dicts": [
+                    {"title": "执行工具", "content": "search"},
+                    {"title": "执行错误", "content": "boom"},
+                    {"title": "思考", "content": "..."},
+                ],
+                "mixed": ["plain text", {"title": "使用工具", "content": "x"}, 42, None],
+                "scalar": "only a string",
+                "empty": [],
+                "none": None,
+            }.items()
+        }
+
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(self.migrate_to)
+        self.apps = executor.loader.project_state(self.migrate_to).apps
+
+    def tearDown(self):
+        MigrationExecutor(connection).migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+
+    def entries(self, name):
+        ChatMessageLog = self.apps.get_model("oauth", "ChatMessageLog")
+        return list(
+            ChatMessageLog.objects.filter(message_id=self.message_ids[name]).order_by("seq").values_list("seq", "entry")
+        )
+
+    def summary(self, name):
+        ChatMessage = self.apps.get_model("oauth", "ChatMessage")
+        return ChatMessage.objects.get(id=self.message_ids[name]).log_summary
+
+    def test_dict_entries_are_moved_in_order(self):
+        self.assertEqual([seq for seq, _ in self.entries("dicts")], [1, 2, 3])
+        self.assertEqual(self.entries("dicts")[1][1], {"title": "执行错误", "content": "boom"})
+        self.assertEqual(self.summary("dicts"), {"count": 3, "tool_calls": 1, "errors": 1})
+
+    def test_non_dict_entries_are_wrapped(self):
+        self.assertEqual(self.entries("mixed"), [
+            (1, {"title": "", "content": "plain text"}),
+            (2, {"title": "使用工具", "content": "x"}),
+            (3, {"title": "", "content": 42}),
+            (4, {"title": "", "content": None}),
+        ])
+        self.assertEqual(self.summary("mixed"), {"count": 4, "tool_calls": 1, "errors": 0})
+
+    def test_non_list_logs_become_a_single_entry(self):
+        self.assertEqual(self.entries("scalar"), [(1, {"title": "", "content": "only a string"})])
+        self.assertEqual(self.summary("scalar")["count"], 1)
+
+    def test_empty_and_missing_logs(self):
+        self.assertEqual(self.entries("empty"), [])
+        self.assertEqual(self.summary("empty"), {"count": 0, "tool_calls": 0, "errors": 0})
+        self.assertEqual(self.entries("none"), [])
+        self.assertIsNone(self.summary("none"))
@@ -10,9 +10,11 @@ urlpatterns = [
     path('crewai/', views.crewai_demo, name='crewai_demo'),
     path('crewai/run/', views.crewai_run, name='crewai_run'),
     path('crewai/status/<str:run_id>/', views.crewai_status, name='crewai_status'),
+    path('crewai/stream/<str:run_id>/', views.crewai_stream, name='crewai_stream'),
     path('crewai/input/<str:run_id>/', views.crewai_input, name='crewai_input'),
     path('crewai/stop/<str:run_id>/', views.crewai_stop, name='crewai_stop'),
     path('crewai/history/', views.crewai_history, name='crewai_history'),
+    path('crewai/message_logs/<int:message_id>/', views.crewai_message_logs, name='crewai_message_logs'),
     path('crewai/sessions/', views.crewai_sessions, name='crewai_sessions'),
     path('crewai/new_session/', views.crewai_new_session, name='crewai_new_session'),
     path('crewai/delete_session/<int:session_id>/', views.crewai_delete_session, name='crewai_delete_session'),
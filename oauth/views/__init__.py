@@ -1,4 +1,4 @@
 from .auth import index, callback, logout, save_api_key, demo_flow
 from .csv import csv_manager, generate_csv_description
-from .crewai import crewai_demo, crewai_run, crewai_status, crewai_input, crewai_stop, crewai_history, crewai_new_session, crewai_sessions, crewai_delete_session
+from .crewai import crewai_demo, crewai_run, crewai_status, crewai_stream, crewai_input, crewai_stop, crewai_history, crewai_message_logs, crewai_new_session, crewai_sessions, crewai_delete_session
 from .mcp import mcp_list
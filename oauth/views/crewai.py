@@ -1,17 +1,145 @@
 import json
+import time
 import uuid
-import threading
+import asyncio
 import logging
+from asgiref.sync import sync_to_async
 from django.shortcuts import render, redirect, reverse
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
+from django.db import transaction
 from ..config import RizhiyiOAuthConfig
-from ..models import UserProfile, ChatSession, ChatMessage
-from crewai_agent.agent import run_crew
-from crewai_agent.config import agent_runs
+from ..models import UserProfile, ChatSession, ChatMessage, ChatMessageLog
+from crewai_agent.run_store import run_store, ACTIVE_STATUSES, FINISHED_STATUSES, QUEUED, WAITING, COMPLETED, ERROR
+from crewai_agent.config import AGENT_LOG_PAGE_SIZE
+from crewai_agent.checkpoint import resume_steps
+from crewai_agent.execution import dispatch_run, send_input, request_stop
+from crewai_agent.scheduler import agent_scheduler, RunRejected, PRIORITY_NORMAL, PRIORITY_LOW
 
 logger = logging.getLogger('oauth')
 
+# SSE 推送检查运行状态的间隔（秒）
+STREAM_POLL_INTERVAL = 0.5
+# 没有新内容时发送心跳注释的间隔（秒），避免代理因空闲断开连接
+STREAM_HEARTBEAT_INTERVAL = 15
+
+def _rejected_response(e):
+    """准入控制拒绝时返回 429，并告知客户端多久后重试"""
+    response = JsonResponse({'error': str(e)}, status=429)
+    if e.retry_after:
+        response['Retry-After'] = str(e.retry_after)
+    return response
+
+def _run_credentials(request):
+    """当前用户访问日志易的 (base_url, api_key, username)"""
+    user_info = request.session.get('user_info')
+    api_key = None
+    username = None
+    base_url = RizhiyiOAuthConfig.RIZHIYI_BASE_URL
+    
+    if user_info:
+        username = user_info.get('name')
+        try:
+            profile = UserProfile.objects.get(rizhiyi_id=user_info['id'])
+            api_key = profile.api_key
+        except UserProfile.DoesNotExist:
+            pass
+    return base_url, api_key, username
+
+def _run_identity(request):
+    """调度器按用户限制并发：登录用户按日志易 ID，匿名用户按浏览器会话"""
+    user_info = request.session.get('user_info')
+    if user_info:
+        return f"user:{user_info['id']}", PRIORITY_NORMAL
+    if not request.session.session_key:
+        request.session.save()
+    return f"anon:{request.session.session_key}", PRIORITY_LOW
+
+def _save_result(run_id, session_id, result):
+    # 运行期间被停止的任务保持 stopped，不保存结果
+    run_store.transition(run_id, ACTIVE_STATUSES, status=COMPLETED, result=str(result))
+    if run_store.get_status(run_id) != COMPLETED:
+        return
+
+    # 保存结果到数据库
+    try:
+        if session_id:
+            session = ChatSession.objects.get(id=session_id)
+            with transaction.atomic():
+                message = ChatMessage.objects.create(
+                    session=session,
+                    role='agent',
+                    content=str(result)
+                )
+                message.log_summary = _save_message_logs(message, run_id)
+                message.save(update_fields=['log_summary'])
+            # 更新会话时间
+            session.save()
+    except Exception as db_e:
+        logger.error(f"Failed to save chat history: {db_e}", exc_info=True)
+
+def _save_message_logs(message, run_id):
+    """把运行日志按页写入 ChatMessageLog（不在内存中拼出完整列表），返回消息的日志摘要"""
+    summary = {'count': 0, 'tool_calls': 0, 'errors': 0}
+    batch = []
+    for entry in run_store.iter_logs(run_id):
+        summary['count'] += 1
+        title = entry.get('title')
+        if title in ('执行工具', '使用工具'):
+            summary['tool_calls'] += 1
+        elif title == '执行错误':
+            summary['errors'] += 1
+        batch.append(ChatMessageLog(message=message, seq=summary['count'], entry=entry))
+        if len(batch) >= AGENT_LOG_PAGE_SIZE:
+            ChatMessageLog.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        ChatMessageLog.objects.bulk_create(batch)
+    return summary
+
+def _submit_run(run_id, run_kwargs, run_user, priority, session_id):
+    """把运行交给调度器，返回排队位置；被拒绝时抛出 RunRejected"""
+    # 由调度器的 worker 线程执行智能体（async 模式下交给异步运行时后立即返回）
+    def thread_target():
+        try:
+            return dispatch_run(run_id, lambda result: _save_result(run_id, session_id, result), **run_kwargs)
+        except Exception as e:
+            logger.error(f"Error in agent thread: {e}", exc_info=True)
+            run_store.transition(run_id, ACTIVE_STATUSES, status=ERROR, result=str(e))
+
+    return agent_scheduler.submit(run_id, thread_target, user=run_user, priority=priority)
+
+def _resume_run(request, run_id, run_data, user_input):
+    """
+    恢复挂起等待人类输入的运行：带着回答重新排队，由任意 worker 从检查点继续执行。
+    同一个问题只有第一次回答生效；排队被拒绝时恢复为等待状态并抛出 RunRejected。
+    """
+    checkpoint = run_data['checkpoint']
+    base_url, api_key, username = _run_credentials(request)
+    run_user, priority = _run_identity(request)
+    agent_scheduler.check_admission(run_user)
+
+    if not run_store.transition(run_id, (WAITING,), status=QUEUED, prompt=None, response=None, checkpoint=None):
+        return
+    # 记录人类反馈到日志，以便前端渲染
+    run_store.append_log(run_id, {
+        "title": "人类反馈",
+        "content": user_input,
+        "timestamp": time.time()
+    })
+
+    run_kwargs = dict(
+        query=checkpoint['query'], history=checkpoint['history'], allow_human_input=True,
+        base_url=base_url, api_key=api_key, username=username,
+        steps=resume_steps(checkpoint, user_input),
+    )
+    try:
+        _submit_run(run_id, run_kwargs, run_user, priority, run_data.get('session_id'))
+    except RunRejected:
+        run_store.transition(run_id, (QUEUED,), status=WAITING, prompt=checkpoint['prompt'], checkpoint=checkpoint)
+        raise
+
 def crewai_demo(request):
     """演示 crewAI 智能体"""
     code = request.GET.get('code')
@@ -23,7 +151,11 @@ def crewai_demo(request):
         return redirect(f"{callback_url}?{query_params.urlencode()}")
         
     query = request.GET.get('query', 'Why am I seeing error 500 in the logs?')
-    return render(request, 'oauth/crewai.html', {'query': query})
+    # 只有 ASGI 服务器能边生成边发送 SSE 事件流，WSGI（如 runserver）下前端改为轮询
+    return render(request, 'oauth/crewai.html', {'query': query, 'use_sse': _is_asgi(request)})
+
+def _is_asgi(request):
+    return isinstance(request, ASGIRequest)
 
 @csrf_exempt
 def crewai_run(request):
@@ -40,17 +172,14 @@ def crewai_run(request):
     
     # 获取用户信息和 API Key
     user_info = request.session.get('user_info')
-    api_key = None
-    username = None
-    base_url = RizhiyiOAuthConfig.RIZHIYI_BASE_URL
-    
-    if user_info:
-        username = user_info.get('name')
-        try:
-            profile = UserProfile.objects.get(rizhiyi_id=user_info['id'])
-            api_key = profile.api_key
-        except UserProfile.DoesNotExist:
-            pass
+    base_url, api_key, username = _run_credentials(request)
+    run_user, priority = _run_identity(request)
+
+    # 在写入数据库之前先做准入检查，过载时直接拒绝
+    try:
+        agent_scheduler.check_admission(run_user)
+    except RunRejected as e:
+        return _rejected_response(e)
 
     # 获取或创建当前用户的会话
     try:
@@ -79,7 +208,7 @@ def crewai_run(request):
             session.save()
 
         # 保存用户消息
-        ChatMessage.objects.create(
+        user_message = ChatMessage.objects.create(
             session=session,
             role='user',
             content=query
@@ -88,98 +217,193 @@ def crewai_run(request):
         # 记录当前使用的 session_id
         current_session_id = session.id
     else:
+        user_message = None
         current_session_id = None
 
     # 启动 CrewAI 运行
     run_id = str(uuid.uuid4())
-    agent_runs[run_id] = {
-        "status": "running",
-        "prompt": None,
-        "response": None,
-        "event": threading.Event(),
-        "result": None,
-        "logs": [],
-        "session_id": current_session_id
-    }
+    run_store.create(run_id, status=QUEUED, session_id=current_session_id)
     
-    # 在后台线程中运行智能体
-    def thread_target():
-        try:
-            result = run_crew(query, history=history, allow_human_input=True, run_id=run_id, base_url=base_url, api_key=api_key, username=username)
-            run_data = agent_runs[run_id]
-            run_data['status'] = 'completed'
-            run_data['result'] = str(result)
-
-            # 保存结果到数据库
-            try:
-                if user_profile and current_session_id:
-                    session = ChatSession.objects.get(id=current_session_id)
-                    ChatMessage.objects.create(
-                        session=session,
-                        role='agent',
-                        content=str(result),
-                        logs=run_data.get('logs', [])
-                    )
-                    # 更新会话时间
-                    session.save()
-            except Exception as db_e:
-                print(f"Failed to save chat history: {db_e}")
-        except Exception as e:
-            logger.error(f"Error in agent thread: {e}", exc_info=True)
-            agent_runs[run_id]["status"] = "error"
-            agent_runs[run_id]["result"] = str(e)
-            
-    thread = threading.Thread(target=thread_target)
-    thread.daemon = True
-    thread.start()
+    run_kwargs = dict(query=query, history=history, allow_human_input=True, base_url=base_url, api_key=api_key, username=username)
+    try:
+        position = _submit_run(run_id, run_kwargs, run_user, priority, current_session_id)
+    except RunRejected as e:
+        # 并发请求在检查之后占满了名额，撤销本次写入
+        run_store.delete(run_id)
+        if user_message:
+            user_message.delete()
+        return _rejected_response(e)
     
-    return JsonResponse({'run_id': run_id, 'session_id': current_session_id})
+    return JsonResponse({'run_id': run_id, 'session_id': current_session_id, 'queue_position': position})
+
+async def _store_call(func, *args, **kwargs):
+    """在线程池中执行运行状态存储的读写（sqlite/file 存储有磁盘 IO），不阻塞事件循环"""
+    return await sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+def _parse_cursor(value):
+    """日志游标（已收到的日志条数），非法值按 0 处理"""
+    try:
+        return max(int(value or 0), 0)
+    except (TypeError, ValueError):
+        return 0
 
-def crewai_status(request, run_id):
-    """获取智能体运行状态"""
-    run_data = agent_runs.get(run_id)
+async def crewai_status(request, run_id):
+    """
+    获取智能体运行状态。
+    携带 since（上次返回的 cursor）时只返回其后的新日志，客户端自行追加；不带时从头返回。
+    每次最多返回 AGENT_LOG_PAGE_SIZE 条，has_more 表示还有未取完的日志。
+    """
+    run_data = await _store_call(run_store.get, run_id)
     if not run_data:
         return JsonResponse({'error': 'Run not found'}, status=404)
     
-    return JsonResponse({
+    since = _parse_cursor(request.GET.get('since'))
+    logs = await _store_call(run_store.get_logs, run_id, since=since, limit=AGENT_LOG_PAGE_SIZE + 1)
+    data = _status_payload(run_id, run_data)
+    data['has_more'] = len(logs) > AGENT_LOG_PAGE_SIZE
+    data['logs'] = logs[:AGENT_LOG_PAGE_SIZE]
+    data['cursor'] = since + len(data['logs'])
+    return JsonResponse(data)
+
+def _status_payload(run_id, run_data):
+    return {
         'status': run_data['status'],
         'prompt': run_data['prompt'],
         'result': run_data['result'],
-        'logs': run_data.get('logs', [])
-    })
+        'queue_position': agent_scheduler.queue_position(run_id) if run_data['status'] == QUEUED else None
+    }
+
+def _sse_event(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+class _StreamCursor:
+    """一个 SSE 连接的推送进度"""
+    def __init__(self, since):
+        self.since = since
+        self.last_state = None
+        self.last_sent = time.monotonic()
+
+def _stream_step(run_id, cursor):
+    """
+    读取一次运行的新日志和状态，返回 (要推送的事件, 是否结束, 是否立即再读一次)。
+    新日志逐条以 log 事件推送（id 为日志序号，断线重连时浏览器通过 Last-Event-ID 续传），
+    状态、人类输入提示或结果变化时推送 status 事件，运行结束后推送 end 事件。
+    """
+    run_data = run_store.get(run_id)
+    if not run_data:
+        return [_sse_event('end', {'status': None})], True, False
+
+    events = []
+    logs = run_store.get_logs(run_id, since=cursor.since, limit=AGENT_LOG_PAGE_SIZE)
+    for entry in logs:
+        cursor.since += 1
+        events.append(_sse_event('log', entry, event_id=cursor.since))
+
+    if len(logs) == AGENT_LOG_PAGE_SIZE:
+        # 还有未推送的日志，先推完再推送状态（结束状态会让前端关闭连接）
+        return events, False, True
+
+    state = _status_payload(run_id, run_data)
+    if state != cursor.last_state:
+        events.append(_sse_event('status', state))
+        cursor.last_state = state
+        cursor.last_sent = time.monotonic()
+    elif logs:
+        cursor.last_sent = time.monotonic()
+
+    if run_data['status'] in FINISHED_STATUSES:
+        events.append(_sse_event('end', {'status': run_data['status']}))
+        return events, True, False
+    if time.monotonic() - cursor.last_sent >= STREAM_HEARTBEAT_INTERVAL:
+        events.append(": ping\n\n")
+        cursor.last_sent = time.monotonic()
+    return events, False, False
+
+async def _stream_run(run_id, since):
+    """ASGI 下的 SSE 事件流：存储读取放到线程池中短暂执行，等待期间不占用线程"""
+    cursor = _StreamCursor(since)
+    while True:
+        events, finished, more = await _store_call(_stream_step, run_id, cursor)
+        for event in events:
+            yield event
+        if finished:
+            return
+        if not more:
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+def _stream_run_sync(run_id, since):
+    """
+    WSGI 下的 SSE 事件流。
+    Django 在 WSGI 下会先把异步迭代器整个读完再发送，必须用同步生成器才能逐条送达；
+    每个连接在运行期间占用一个 worker 线程，页面在 WSGI 下默认使用轮询，这里只服务直接访问的客户端。
+    """
+    cursor = _StreamCursor(since)
+    while True:
+        events, finished, more = _stream_step(run_id, cursor)
+        yield from events
+        if finished:
+            return
+        if not more:
+            time.sleep(STREAM_POLL_INTERVAL)
+
+async def crewai_stream(request, run_id):
+    """以 SSE 推送智能体运行的新日志、状态变化和人类输入提示"""
+    run_data = await _store_call(run_store.get, run_id)
+    if not run_data:
+        return JsonResponse({'error': 'Run not found'}, status=404)
+
+    since = _parse_cursor(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+    events = _stream_run(run_id, since) if _is_asgi(request) else _stream_run_sync(run_id, since)
+    response = StreamingHttpResponse(events, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # 关闭 nginx 的响应缓冲，事件才能即时到达浏览器
+    response['X-Accel-Buffering'] = 'no'
+    return response
 
 @csrf_exempt
-def crewai_input(request, run_id):
+async def crewai_input(request, run_id):
     """提交人类输入"""
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST allowed'}, status=405)
     
-    run_data = agent_runs.get(run_id)
+    run_data = await _store_call(run_store.get, run_id)
     if not run_data:
         return JsonResponse({'error': 'Run not found'}, status=404)
     
     data = json.loads(request.body)
     user_input = data.get('input')
     
-    run_data['response'] = user_input
-    run_data['event'].set() # 唤醒等待的智能体线程
+    if run_data.get('checkpoint'):
+        # 已挂起的运行没有在等待的执行，从检查点恢复
+        try:
+            await sync_to_async(_resume_run)(request, run_id, run_data, user_input)
+        except RunRejected as e:
+            return _rejected_response(e)
+    else:
+        await _store_call(send_input, run_id, user_input) # 唤醒等待的智能体
     
     return JsonResponse({'status': 'ok'})
 
 @csrf_exempt
-def crewai_stop(request, run_id):
+async def crewai_stop(request, run_id):
     """手动停止智能体运行"""
     if request.method != 'POST':
         return JsonResponse({'error': 'Only POST allowed'}, status=405)
     
-    run_data = agent_runs.get(run_id)
+    run_data = await _store_call(run_store.get, run_id)
     if not run_data:
         return JsonResponse({'error': 'Run not found'}, status=404)
     
-    run_data['status'] = 'stopped'
-    # 如果正在等待人类输入，唤醒它
-    if 'event' in run_data:
-        run_data['event'].set()
+    # 如果正在等待人类输入，会被唤醒
+    await _store_call(request_stop, run_id)
+    # 还在排队的任务直接移出队列；已挂起的运行没有执行中的 worker，直接丢弃检查点
+    if agent_scheduler.cancel(run_id) or run_data.get('checkpoint'):
+        await _store_call(run_store.update, run_id, result="Task stopped by user.", checkpoint=None)
     
     return JsonResponse({'status': 'ok'})
 
@@ -206,18 +430,46 @@ def crewai_history(request):
         if not session:
             return JsonResponse({'history': []})
             
+        # 只返回消息内容和日志摘要，执行日志在展开时通过 crewai_message_logs 分页获取
         messages = session.messages.all().order_by('created_at')
         history = []
         for msg in messages:
             history.append({
+                'id': msg.id,
                 'role': msg.role,
                 'content': msg.content,
-                'logs': msg.logs
+                'log_summary': msg.log_summary
             })
         return JsonResponse({'history': history, 'session_id': session.id, 'title': session.title})
     except UserProfile.DoesNotExist:
         return JsonResponse({'history': []})
 
+def crewai_message_logs(request, message_id):
+    """
+    分页获取一条智能体回复的执行日志（前端展开思考轨迹时才请求）。
+    since 为上次返回的 cursor，每次最多返回 AGENT_LOG_PAGE_SIZE 条，has_more 表示还有下一页。
+    """
+    user_info = request.session.get('user_info')
+    if not user_info:
+        return JsonResponse({'error': 'Not logged in'}, status=401)
+
+    try:
+        message = ChatMessage.objects.get(id=message_id, session__user__rizhiyi_id=user_info['id'])
+    except ChatMessage.DoesNotExist:
+        return JsonResponse({'error': 'Message not found'}, status=404)
+
+    since = _parse_cursor(request.GET.get('since'))
+    entries = list(
+        message.log_entries.filter(seq__gt=since).order_by('seq')
+        .values_list('entry', flat=True)[:AGENT_LOG_PAGE_SIZE + 1]
+    )
+    logs = entries[:AGENT_LOG_PAGE_SIZE]
+    return JsonResponse({
+        'logs': logs,
+        'cursor': since + len(logs),
+        'has_more': len(entries) > AGENT_LOG_PAGE_SIZE,
+    })
+
 def crewai_sessions(request):
     """获取用户所有会话列表"""
     user_info = request.session.get('user_info')
@@ -1,6 +1,6 @@
 import json
 import os
-import pandas as pd
+import threading
 import logging
 from django.shortcuts import render, redirect
 from django.http import JsonResponse
@@ -8,6 +8,10 @@ from django.conf import settings
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage
 from ..config import RizhiyiOAuthConfig
+from crewai_agent.utils.kb_index import invalidate_csv_index, remove_bm25_cache
+from crewai_agent.utils.kb_embeddings import sync_embeddings, remove_embeddings
+from crewai_agent.utils.kb_store import load_dataframe, remove_columnar
+from crewai_agent.utils.kb_ingest import ingest_upload, IngestError
 
 logger = logging.getLogger('oauth')
 
@@ -96,19 +100,21 @@ def csv_manager(request):
             if uploaded_file and uploaded_file.name.endswith('.csv'):
                 file_path = data_dir / uploaded_file.name
                 
-                # 先写入临时文件进行校验，或者直接写入
-                with open(file_path, 'wb+') as destination:
-                    for chunk in uploaded_file.chunks():
-                        destination.write(chunk)
-                
-                # 校验 CSV 合法性
+                # 流式导入：边接收边校验、统计、建索引，全部通过后才原子替换到 data/ 下
+                try:
+                    result = ingest_upload(uploaded_file, file_path)
+                except IngestError as e:
+                    # 校验失败时原有文件保持不变
+                    logger.error(f"Invalid CSV file {uploaded_file.name}: {e}")
+                    request.session['upload_error'] = f"无效的 CSV 文件: {str(e)}"
+                    return redirect('csv_manager')
+
                 try:
-                    # 尝试读取前几行来验证格式
-                    df_check = pd.read_csv(file_path, nrows=5)
+                    df_check = result['preview']
                     
                     # 如果用户没写列名，自动从读取的结果中提取
                     if not columns:
-                        columns = ", ".join(df_check.columns.tolist())
+                        columns = ", ".join(result['columns'])
                         logger.debug(f"Auto-extracted columns: {columns}")
                     
                     # 如果用户没写描述，自动生成描述
@@ -119,17 +125,19 @@ def csv_manager(request):
                     # 更新元数据
                     metadata[uploaded_file.name] = {
                         'description': description,
-                        'columns': columns
+                        'columns': columns,
+                        'rows': result['rows'],
+                        'stats': result['stats']
                     }
                     with open(metadata_path, 'w', encoding='utf-8') as f:
                         json.dump(metadata, f, indent=4, ensure_ascii=False)
+
+                    # 后台增量更新向量：只对新增或修改的行做向量化
+                    threading.Thread(target=sync_embeddings, args=(str(file_path),), daemon=True).start()
                         
                 except Exception as e:
-                    # 如果不合法，删除已写入的文件并报错
-                    if file_path.exists():
-                        os.remove(file_path)
-                    logger.error(f"Invalid CSV file {uploaded_file.name}: {e}")
-                    request.session['upload_error'] = f"无效的 CSV 文件: {str(e)}"
+                    logger.error(f"Error saving metadata for {uploaded_file.name}: {e}")
+                    request.session['upload_error'] = f"保存元数据失败: {str(e)}"
                 
                 return redirect('csv_manager')
         
@@ -139,6 +147,10 @@ def csv_manager(request):
                 file_path = data_dir / filename
                 if file_path.exists() and file_path.is_file() and filename.endswith('.csv'):
                     os.remove(file_path)
+                    invalidate_csv_index(file_path)
+                    remove_bm25_cache(file_path)
+                    remove_embeddings(str(file_path))
+                    remove_columnar(file_path)
                     # 删除元数据
                     if filename in metadata:
                         del metadata[filename]
@@ -178,7 +190,7 @@ def csv_manager(request):
         file_path = data_dir / preview_filename
         if file_path.exists() and file_path.is_file() and preview_filename.endswith('.csv'):
             try:
-                df = pd.read_csv(file_path, nrows=10)
+                df = load_dataframe(file_path, nrows=10)
                 preview_data = {
                     'filename': preview_filename,
                     'columns': df.columns.tolist(),
@@ -1,12 +1,16 @@
-import asyncio
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
 from ..config import RizhiyiOAuthConfig
 from ..models import UserProfile
-from crewai_agent.utils.mcp_utils import get_rizhiyi_server_params, list_mcp_tools
+from crewai_agent.utils.mcp_utils import get_rizhiyi_server_params, get_cached_mcp_tools
 
-def mcp_list(request):
-    """获取 MCP 服务器及其工具列表"""
-    user_info = request.session.get('user_info')
+async def mcp_list(request):
+    """
+    获取 MCP 服务器及其工具列表。
+    工具列表按凭据缓存，传入 ?refresh=1 时强制重新获取。
+    """
+    refresh = request.GET.get('refresh', '').lower() in ('1', 'true', 'yes')
+    user_info = await request.session.aget('user_info')
     api_key = None
     username = None
     base_url = RizhiyiOAuthConfig.RIZHIYI_BASE_URL
@@ -14,7 +18,7 @@ def mcp_list(request):
     if user_info:
         username = user_info.get('name')
         try:
-            profile = UserProfile.objects.get(rizhiyi_id=user_info['id'])
+            profile = await UserProfile.objects.aget(rizhiyi_id=user_info['id'])
             api_key = profile.api_key
         except UserProfile.DoesNotExist:
             pass
@@ -34,8 +38,10 @@ def mcp_list(request):
     results = []
     for s in servers_config:
         try:
-            # 使用 asyncio.run 在同步视图中运行异步任务
-            tools = asyncio.run(list_mcp_tools(s['params']))
+            # 优先返回缓存；过期时后台刷新，不阻塞当前请求（首次获取需要启动会话，放到线程池中等待）
+            tools, fetched_at = await sync_to_async(get_cached_mcp_tools, thread_sensitive=False)(
+                s['params'], refresh=refresh
+            )
             results.append({
                 "id": s['id'],
                 "name": s['name'],
@@ -43,7 +49,8 @@ def mcp_list(request):
                 "color": s['color'],
                 "description": s['description'],
                 "tools": tools,
-                "connected": len(tools) > 0
+                "connected": len(tools) > 0,
+                "fetched_at": fetched_at
             })
         except Exception as e:
             results.append({